@@ -0,0 +1,16 @@
+import os
+import pytz
+
+from datetime import datetime
+from lib.backfill_controller import BackfillController
+from nypl_py_utils.functions.config_helper import load_env_file
+
+
+def main():
+    load_env_file(os.environ['ENVIRONMENT'], 'config/{}.yaml')
+    now = datetime.now(pytz.utc).isoformat()
+    BackfillController(now).run_backfill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark comparing the census geocoder response parser with the previous
+pd.read_csv(engine='python') parser on synthetic responses, about 70% of
+whose rows are matches.
+
+    python -m benchmarks.census_parser_benchmark [--sizes 1000 10000]
+        [--repeats 5]
+"""
+import argparse
+import pandas as pd
+import random
+import time
+
+from helpers.census_response_helper import parse_census_geoids
+from io import BytesIO
+
+_MATCH_ROW = ('"{index}","{number} Main St, Apt 4, New York, NY, 10001",'
+              '"Match","Exact","{number} MAIN ST, NEW YORK, NY, 10001",'
+              '"-73.99,40.75","{tigerline}","L","36","061","{tract}","1001"\n')
+_NO_MATCH_ROW = '"{index}","{number} Nowhere Rd, New York, NY, 10001",' \
+    '"No_Match"\n'
+
+
+def build_response(size):
+    rows = []
+    for index in range(size):
+        row = _MATCH_ROW if random.random() < 0.7 else _NO_MATCH_ROW
+        rows.append(row.format(
+            index=index, number=random.randint(1, 9999),
+            tigerline=random.randint(10**8, 10**9 - 1),
+            tract='{:06d}'.format(random.randint(0, 999999))))
+    return ''.join(rows).encode('utf-8')
+
+
+def parse_with_pandas(raw_response):
+    response_df = pd.read_csv(BytesIO(raw_response), header=None,
+                              dtype=str, index_col=0, engine='python',
+                              names=['index', 'input_address', 'match',
+                                     'match_type', 'matched_address',
+                                     'coordinates', 'tigerline_id',
+                                     'tigerline_side', 'state_id',
+                                     'county_id', 'tract_id', 'block_id'])
+    return (response_df['state_id'] + response_df['county_id'] +
+            response_df['tract_id']).rename('geoid')
+
+
+def run_benchmark(sizes, repeats):
+    parsers = [('pandas', parse_with_pandas),
+               ('csv', lambda raw_response: parse_census_geoids(
+                   [raw_response]))]
+    print('Parser    Size      Best seconds  Rows/sec')
+    for size in sizes:
+        raw_response = build_response(size)
+        for name, parser in parsers:
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                parser(raw_response)
+                timings.append(time.perf_counter() - start)
+            print('{name:<9} {size:<9} {best:<13.4f} {rate:.0f}'.format(
+                name=name, size=size, best=min(timings),
+                rate=size/min(timings)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.repeats)
@@ -0,0 +1,74 @@
+"""
+Benchmark comparing the thread and process Geosupport backends of the NYC
+geocoder client, to size GEOSUPPORT_WORKERS by measured addresses per
+second. Geosupport must be installed, so run it inside the
+nycplanning/docker-geosupport image (e.g. the poller's own Docker image).
+
+The input cycles through a fixed set of NYC addresses, some of which can't
+be geocoded, so every run does the same work.
+
+    python -m benchmarks.geosupport_benchmark [--sizes 1000 20000]
+        [--backends thread process] [--workers N] [--chunk-size N]
+"""
+import argparse
+import os
+import pandas as pd
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from lib.nyc_geocoder_client import NycGeocoderClient
+from lib.obfuscation_engine import get_cpu_quota
+
+_ADDRESSES = [
+    ('476', '5th Ave', '10018'),
+    ('455', '5th Ave', '10016'),
+    ('1', 'Centre St', '10007'),
+    ('310', 'Lenox Ave', '10027'),
+    ('10', 'Grand Army Plz', '11238'),
+    ('89-11', 'Merrick Blvd', '11432'),
+    ('5', 'Central Ave', '10301'),
+    ('2556', 'Bainbridge Ave', '10458'),
+    ('1', 'Fake St', '10001'),
+    ('99999', 'Broadway', '10025')]
+
+
+def run_benchmark(sizes, backends, workers, chunk_size):
+    print('Backend   Size      Seconds   Addresses/sec  (workers={workers}, '
+          'chunk size={chunk_size})'.format(workers=workers,
+                                            chunk_size=chunk_size))
+    os.environ['GEOSUPPORT_WORKERS'] = str(workers)
+    os.environ['GEOSUPPORT_CHUNK_SIZE'] = str(chunk_size)
+    for size in sizes:
+        address_df = pd.DataFrame(
+            [_ADDRESSES[i % len(_ADDRESSES)] for i in range(size)],
+            columns=['house_number', 'street_name', 'postal_code'])
+        for backend in backends:
+            os.environ['GEOSUPPORT_BACKEND'] = backend
+            client = NycGeocoderClient()
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    # Warm up so that starting the worker processes isn't
+                    # counted
+                    client.get_geoids(address_df.head(len(_ADDRESSES)),
+                                      executor=executor)
+                    start = time.perf_counter()
+                    client.get_geoids(address_df, executor=executor)
+                    elapsed = time.perf_counter() - start
+            finally:
+                client.close()
+            print('{backend:<9} {size:<9} {elapsed:<9.2f} {rate:.0f}'.format(
+                backend=backend, size=size, elapsed=elapsed,
+                rate=size/elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 20000])
+    parser.add_argument('--backends', nargs='+',
+                        default=['thread', 'process'])
+    parser.add_argument('--workers', type=int, default=get_cpu_quota())
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    run_benchmark(args.sizes, args.backends, args.workers, args.chunk_size)
@@ -0,0 +1,65 @@
+"""
+Benchmark comparing the serial, thread, and process obfuscation engines, to
+size ECS tasks by measured hashes per second.
+
+Hashing uses the real obfuscate function with the BCRYPT_SALT environment
+variable if it's set. Otherwise a salt is generated with --rounds bcrypt
+rounds; the production salt's cost makes every hash far slower, so a full
+500k run is only practical with a cheap salt.
+
+    python -m benchmarks.obfuscation_benchmark [--sizes 10000 500000]
+        [--engines serial thread process] [--rounds 4] [--workers N]
+        [--chunk-size N]
+"""
+import argparse
+import bcrypt
+import os
+import time
+
+from lib.obfuscation_engine import (ProcessObfuscationEngine,
+                                    SerialObfuscationEngine,
+                                    ThreadObfuscationEngine, get_cpu_quota)
+from nypl_py_utils.functions.obfuscation_helper import obfuscate
+
+
+def _create_engine(name, workers, chunk_size):
+    if name == 'serial':
+        return SerialObfuscationEngine()
+    elif name == 'thread':
+        return ThreadObfuscationEngine(workers)
+    return ProcessObfuscationEngine(workers, chunk_size)
+
+
+def run_benchmark(sizes, engines, workers, chunk_size):
+    print('Engine    Size      Seconds   Hashes/sec  (workers={workers}, '
+          'chunk size={chunk_size})'.format(workers=workers,
+                                            chunk_size=chunk_size))
+    for size in sizes:
+        values = [str(i) for i in range(size)]
+        for name in engines:
+            engine = _create_engine(name, workers, chunk_size)
+            try:
+                start = time.perf_counter()
+                engine.map(obfuscate, values)
+                elapsed = time.perf_counter() - start
+            finally:
+                engine.close()
+            print('{name:<9} {size:<9} {elapsed:<9.2f} {rate:.0f}'.format(
+                name=name, size=size, elapsed=elapsed, rate=size/elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 500000])
+    parser.add_argument('--engines', nargs='+',
+                        default=['serial', 'thread', 'process'])
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=get_cpu_quota())
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    if 'BCRYPT_SALT' not in os.environ:
+        os.environ['BCRYPT_SALT'] = bcrypt.gensalt(
+            rounds=args.rounds).decode()
+    run_benchmark(args.sizes, args.engines, args.workers, args.chunk_size)
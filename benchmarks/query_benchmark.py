@@ -0,0 +1,148 @@
+"""
+Micro-benchmark comparing the old string-formatted queries with the current
+parameterized ones at production batch sizes.
+
+By default only the time spent building each query is measured. Pass
+--execute to also time running the real Sierra patron details query and
+Redshift address query, both with literal values and with bound
+parameters, in which case the ENVIRONMENT variable must be set and the
+config file's credentials must be decryptable.
+
+    python -m benchmarks.query_benchmark [--execute] [--runs N]
+"""
+import argparse
+import os
+import random
+import string
+import timeit
+
+from helpers.pipeline_mode import PipelineMode
+from helpers.query_helper import (REDSHIFT_MAX_QUERY_PARAMS,
+                                  build_active_patron_details_query,
+                                  build_redshift_address_query)
+
+_BATCH_SIZES = {'ACTIVE_PATRON_BATCH_SIZE': 10000,
+                'DELETED_PATRON_BATCH_SIZE': 500000}
+_OLD_REDSHIFT_ADDRESS_QUERY = '''
+    SELECT address_hash, patron_id, geoid, initial_patron_home_library_code
+    FROM {redshift_table}
+    WHERE address_hash IN ({address_hashes})
+'''
+_OLD_PATRON_DETAILS_QUERY = '''
+    SELECT id FROM sierra_view.record_metadata WHERE id IN ({patron_ids})'''
+
+
+def _build_old_redshift_address_query(address_hashes):
+    # The address hashes used to be read back out of the dataframe with
+    # to_string(index=False).split(), which costs more still
+    return _OLD_REDSHIFT_ADDRESS_QUERY.format(
+        redshift_table=os.environ['REDSHIFT_TABLE'],
+        address_hashes="'" + "','".join(address_hashes) + "'")
+
+
+def _build_old_patron_details_query(patron_ids):
+    return _OLD_PATRON_DETAILS_QUERY.format(
+        patron_ids=','.join(str(int(patron_id)) for patron_id in patron_ids))
+
+
+def _time(fn, runs):
+    return min(timeit.repeat(fn, number=1, repeat=runs)) * 1000
+
+
+def benchmark_build(runs):
+    print('Query build time (best of {} runs, ms)'.format(runs))
+    for name, batch_size in _BATCH_SIZES.items():
+        address_hashes = [''.join(random.choices(
+            string.ascii_letters + string.digits, k=53))
+            for _ in range(batch_size)]
+        patron_ids = [str(i) for i in range(batch_size)]
+        print('  {name}={size}'.format(name=name, size=batch_size))
+        if batch_size > REDSHIFT_MAX_QUERY_PARAMS:
+            # Lookups this large join against a temp table instead
+            print('    Redshift address query: too many keys for an IN list')
+        else:
+            print('    Redshift address query: old {old:.1f} / new {new:.1f}'
+                  .format(
+                      old=_time(lambda: _build_old_redshift_address_query(
+                          address_hashes), runs),
+                      new=_time(lambda: build_redshift_address_query(
+                          address_hashes), runs)))
+        print('    Sierra details query:   old {old:.1f} / new {new:.1f}'
+              .format(
+                  old=_time(lambda: _build_old_patron_details_query(
+                      patron_ids), runs),
+                  new=_time(lambda: build_active_patron_details_query(
+                      PipelineMode.UPDATED_PATRONS, patron_ids), runs)))
+
+
+def benchmark_execute(runs):
+    """
+    Times the real Sierra patron details query and Redshift address query,
+    each run once with its values inlined as literals (as the old queries
+    were) and once with bound parameters (as the poller runs them now)
+    """
+    import psycopg
+
+    from lib import DatabaseConnectionManager
+    from nypl_py_utils.classes.postgresql_client import PostgreSQLClient
+    from nypl_py_utils.classes.redshift_client import RedshiftClient
+    from nypl_py_utils.functions.config_helper import load_env_file
+
+    load_env_file(os.environ['ENVIRONMENT'], 'config/{}.yaml')
+    sierra_client = PostgreSQLClient(
+        os.environ['SIERRA_DB_HOST'], os.environ['SIERRA_DB_PORT'],
+        os.environ['SIERRA_DB_NAME'], os.environ['SIERRA_DB_USER'],
+        os.environ['SIERRA_DB_PASSWORD'])
+    redshift_connection = DatabaseConnectionManager(RedshiftClient(
+        os.environ['REDSHIFT_DB_HOST'], os.environ['REDSHIFT_DB_NAME'],
+        os.environ['REDSHIFT_DB_USER'], os.environ['REDSHIFT_DB_PASSWORD']),
+        'Redshift', autocommit=True)
+    sierra_client.connect()
+    try:
+        print('Sierra patron details query execute time (best of {} runs, '
+              'ms)'.format(runs))
+        for name, batch_size in _BATCH_SIZES.items():
+            query, query_params = build_active_patron_details_query(
+                PipelineMode.UPDATED_PATRONS, range(batch_size))
+            literal_query = psycopg.ClientCursor(sierra_client.conn).mogrify(
+                query, query_params)
+            print('  {name}={size}'.format(name=name, size=batch_size))
+            print('    literal:  {:.1f}'.format(_time(
+                lambda: sierra_client.execute_query(literal_query), runs)))
+            print('    prepared: {:.1f}'.format(_time(
+                lambda: sierra_client.execute_query(
+                    query, query_params, prepare=True), runs)))
+
+        # Larger lookups join against a temp table instead of using IN lists
+        batch_size = int(os.environ.get('REDSHIFT_TEMP_TABLE_THRESHOLD',
+                                        10000))
+        address_hashes = [''.join(random.choices(
+            string.ascii_letters + string.digits, k=53))
+            for _ in range(batch_size)]
+        query, query_params = build_redshift_address_query(address_hashes)
+        literal_query = _build_old_redshift_address_query(address_hashes)
+        print('Redshift address query execute time (best of {runs} runs, '
+              'ms) for {size} address hashes'.format(
+                  runs=runs, size=batch_size))
+        print('    literal:       {:.1f}'.format(_time(
+            lambda: redshift_connection.execute_query(literal_query), runs)))
+        print('    parameterized: {:.1f}'.format(_time(
+            lambda: redshift_connection.execute_parameterized_query(
+                query, query_params), runs)))
+    finally:
+        sierra_client.close_connection()
+        redshift_connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--execute', action='store_true')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('REDSHIFT_TABLE', 'patron_info')
+    os.environ.update({name: str(size)
+                       for name, size in _BATCH_SIZES.items()})
+    benchmark_build(args.runs)
+    if args.execute:
+        benchmark_execute(args.runs)
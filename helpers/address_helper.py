@@ -15,6 +15,11 @@ _SECONDARY_KEYS = [
     'BuildingName', 'SubaddressType', 'OccupancyType', 'OccupancyIdentifier']
 _ADDRESS_TAG_MAP = dict.fromkeys(_STREET_KEYS, 'street')
 _ADDRESS_TAG_MAP.update(dict.fromkeys(_SECONDARY_KEYS, 'line2'))
+_CANONICAL_ABBREVIATIONS = {
+    'AVENUE': 'AVE', 'BOULEVARD': 'BLVD', 'COURT': 'CT', 'DRIVE': 'DR',
+    'LANE': 'LN', 'PARKWAY': 'PKWY', 'PLACE': 'PL', 'ROAD': 'RD',
+    'STREET': 'ST', 'TERRACE': 'TER', 'EAST': 'E', 'NORTH': 'N', 'SOUTH': 'S',
+    'WEST': 'W'}
 
 
 def reformat_malformed_address(address_row):
@@ -69,6 +74,42 @@ def reformat_malformed_address(address_row):
     return address_row
 
 
+def canonicalize_address(address, city, region, postal_code):
+    """
+    Returns a patron-independent canonical form of an address for use as a
+    geocoding cache key. The house number, street, city, state, and 5-digit
+    ZIP code parsed by usaddress are uppercased, stripped of punctuation,
+    and abbreviated consistently. Apartment/unit details are dropped since
+    they don't affect the census tract. Addresses that can't be parsed as a
+    street address fall back to the normalized full address.
+    """
+    full_address = ' '.join(
+        part for part in (address, city, region, postal_code) if part)
+    try:
+        parsed_address, address_type = usaddress.tag(full_address)
+    except usaddress.RepeatedLabelError:
+        parsed_address, address_type = {}, None
+
+    if (address_type == 'Street Address'
+            and parsed_address.get('AddressNumber')
+            and parsed_address.get('StreetName')):
+        parts = [
+            parsed_address['AddressNumber'],
+            ' '.join(parsed_address[key] for key in _STREET_KEYS
+                     if key in parsed_address),
+            parsed_address.get('PlaceName', ''),
+            parsed_address.get('StateName', ''),
+            parsed_address.get('ZipCode', '')[:5]]
+        return '|'.join(_normalize_address_part(part) for part in parts)
+    return _normalize_address_part(full_address)
+
+
+def _normalize_address_part(address_part):
+    words = re.sub('[^A-Z0-9-/\\s]', ' ',
+                   unidecode(address_part).upper()).split()
+    return ' '.join(_CANONICAL_ABBREVIATIONS.get(word, word) for word in words)
+
+
 def _combine_repeated_labels(parsed_string, label):
     """
     When the parsed address contains multiple portions with the same label,
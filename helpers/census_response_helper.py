@@ -0,0 +1,61 @@
+import codecs
+import csv
+import numpy as np
+import pandas as pd
+
+# Positions of the needed fields in each row of a census geocoder response
+_INDEX_FIELD = 0
+_STATE_FIELD = 8
+_COUNTY_FIELD = 9
+_TRACT_FIELD = 10
+
+
+def parse_census_geoids(response_chunks):
+    """
+    Parses a census geocoder API batch response, given as an iterable of byte
+    strings (e.g. chunks of a response as they stream in), into a series of
+    geoids (or NaN) indexed by the input row indices.
+
+    Only the index and the state, county, and tract fields of each row are
+    extracted. Rows for unmatched addresses only have three fields, and the
+    quoted input address and coordinates fields may contain commas, so each
+    line is still read with the csv module.
+    """
+    indices = []
+    geoids = []
+    for row in csv.reader(_iter_lines(response_chunks)):
+        if not row:
+            continue
+        indices.append(_parse_index(row[_INDEX_FIELD]))
+        if (len(row) > _TRACT_FIELD and row[_STATE_FIELD]
+                and row[_COUNTY_FIELD] and row[_TRACT_FIELD]):
+            geoids.append(
+                row[_STATE_FIELD] + row[_COUNTY_FIELD] + row[_TRACT_FIELD])
+        else:
+            geoids.append(np.nan)
+    return pd.Series(geoids, index=pd.Index(indices, name='index'),
+                     name='geoid', dtype=object)
+
+
+def _iter_lines(response_chunks):
+    """
+    Decodes the chunks and yields each line, including its line ending, as
+    soon as it is complete
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    partial_line = ''
+    for chunk in response_chunks:
+        lines = (partial_line + decoder.decode(chunk)).split('\n')
+        partial_line = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    partial_line += decoder.decode(b'', final=True)
+    if partial_line:
+        yield partial_line
+
+
+def _parse_index(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
@@ -2,6 +2,9 @@ import os
 
 from helpers.pipeline_mode import PipelineMode
 
+# The most bind parameters Redshift accepts in a single statement
+REDSHIFT_MAX_QUERY_PARAMS = 32767
+
 _ACTIVE_PATRONS_QUERY = '''
     SELECT
         x.id, ptype_code, pcode3,
@@ -13,42 +16,57 @@ _ACTIVE_PATRONS_QUERY = '''
         deletion_date_gmt,
         record_last_updated_gmt,
         creation_date_gmt
-    FROM (
+    FROM ({record_metadata_query}) x
+    LEFT JOIN LATERAL (
+        SELECT city, region, postal_code, addr1
+        FROM sierra_view.patron_record_address
+        WHERE patron_record_address.patron_record_id = x.id
+        ORDER BY display_order, patron_record_address_type_id
+        LIMIT 1) first_address ON TRUE
+    LEFT JOIN sierra_view.patron_view
+        ON x.id = patron_view.id
+    ORDER BY {ordering_field}, x.id;'''
+
+_ACTIVE_PATRON_IDS_QUERY = '''
         SELECT
             id, record_last_updated_gmt, deletion_date_gmt, creation_date_gmt
         FROM sierra_view.record_metadata
         WHERE record_type_code = 'p'
-            AND {ordering_field} >= '{start_dt}'
-            AND {ordering_field} < '{now}'
+            AND {ordering_field} >= %(start_dt)s
+            AND ({ordering_field}, id) > (%(start_dt)s, %(start_id)s)
+            AND {ordering_field} < %(now)s
             AND {ordering_field} IS NOT NULL
-        ORDER BY {ordering_field}
-        LIMIT {limit}) x
-    LEFT JOIN sierra_view.patron_record_address
-        ON x.id = patron_record_address.patron_record_id
-    LEFT JOIN sierra_view.patron_view
-        ON x.id = patron_view.id
-    ORDER BY {ordering_field}, display_order, patron_record_address_type_id;'''
+        ORDER BY {ordering_field}, id
+        LIMIT %(limit)s'''
+
+_PATRON_IDS_QUERY = '''
+        SELECT
+            id, record_last_updated_gmt, deletion_date_gmt, creation_date_gmt
+        FROM sierra_view.record_metadata
+        WHERE id = ANY(%(patron_ids)s)'''
 
 _DELETED_PATRONS_QUERY = '''
     SELECT id, deletion_date_gmt
     FROM sierra_view.record_metadata
     WHERE record_type_code = 'p'
-        AND deletion_date_gmt >= '{cached_deletion_date}'
-        AND deletion_date_gmt < '{now}'
+        AND deletion_date_gmt >= %(cached_deletion_date)s
+        AND (deletion_date_gmt, id) > (%(cached_deletion_date)s,
+            %(cached_deletion_id)s)
+        AND deletion_date_gmt < %(now)s
         AND deletion_date_gmt IS NOT NULL
-    ORDER BY deletion_date_gmt
-    LIMIT {limit};'''
+    ORDER BY deletion_date_gmt, id
+    LIMIT %(limit)s;'''
 
 _REDSHIFT_ADDRESS_QUERY = '''
     SELECT address_hash, patron_id, geoid, initial_patron_home_library_code
     FROM {redshift_table}
-    WHERE address_hash IN ({address_hashes})
+    {key_filter}
 '''
 
 _REDSHIFT_IPHLC_QUERY = '''
     SELECT patron_id, initial_patron_home_library_code
     FROM {redshift_table}
-    WHERE patron_id IN ({patron_ids})
+    {key_filter}
 '''
 
 _REDSHIFT_PATRON_QUERY = '''
@@ -56,42 +74,163 @@ _REDSHIFT_PATRON_QUERY = '''
         circ_active_date_et, ptype_code, pcode3, patron_home_library_code,
         initial_patron_home_library_code
     FROM {redshift_table}
-    WHERE patron_id IN ({patron_ids})
+    {key_filter}
 '''
 
+_REDSHIFT_IN_FILTER = 'WHERE {key_column} IN ({placeholders})'
+
+_REDSHIFT_JOIN_FILTER = '''JOIN {temp_table}
+        ON {redshift_table}.{key_column} = {temp_table}.lookup_key'''
+
+_CREATE_TEMP_TABLE_QUERY = \
+    'CREATE TEMP TABLE {temp_table} (lookup_key VARCHAR(256));'
+
+_INSERT_TEMP_TABLE_QUERY = 'INSERT INTO {temp_table} VALUES {placeholders};'
+
+_DROP_TEMP_TABLE_QUERY = 'DROP TABLE {temp_table};'
+
 
 def build_active_patrons_query(mode, poller_state, now):
-    if mode == PipelineMode.NEW_PATRONS:
-        ordering_field = 'creation_date_gmt'
-        start_dt = poller_state['creation_dt']
-    elif mode == PipelineMode.UPDATED_PATRONS:
-        ordering_field = 'record_last_updated_gmt'
-        start_dt = poller_state['update_dt']
+    """
+    Builds a query for the next batch of patrons strictly after the
+    (timestamp, patron id) cursor stored in the poller state. States cached
+    before the patron id was stored default to 0, which includes every record
+    with the cached timestamp.
+
+    Like every Sierra query builder, returns a (query, query_params) tuple.
+    The query text only depends on the mode, so it can be prepared once by
+    the server and reused for every batch.
+    """
+    query, query_params = _build_active_patron_ids_subquery(
+        mode, poller_state, now)
     return _ACTIVE_PATRONS_QUERY.format(
-        ordering_field=ordering_field, start_dt=start_dt, now=now,
-        limit=os.environ['ACTIVE_PATRON_BATCH_SIZE'])
+        record_metadata_query=query,
+        ordering_field=_get_ordering_field(mode)), query_params
 
 
-def build_deleted_patrons_query(deletion_date_start, now):
-    return _DELETED_PATRONS_QUERY.format(
-        cached_deletion_date=deletion_date_start,
-        limit=os.environ['DELETED_PATRON_BATCH_SIZE'],
-        now=now)
+def build_active_patron_ids_query(mode, poller_state, now):
+    """
+    Builds a query for only the ids and timestamps of the patrons that
+    build_active_patrons_query would return
+    """
+    query, query_params = _build_active_patron_ids_subquery(
+        mode, poller_state, now)
+    return query + ';', query_params
 
 
-def build_redshift_address_query(address_hashes):
-    return _REDSHIFT_ADDRESS_QUERY.format(
-        redshift_table=os.environ['REDSHIFT_TABLE'],
-        address_hashes=address_hashes)
+def build_active_patron_details_query(mode, patron_ids):
+    """
+    Builds a query for the full Sierra data of the given patron ids, which
+    are expected to be integers
+    """
+    return _ACTIVE_PATRONS_QUERY.format(
+        record_metadata_query=_PATRON_IDS_QUERY,
+        ordering_field=_get_ordering_field(mode)), {
+        'patron_ids': [int(patron_id) for patron_id in patron_ids]}
 
 
-def build_redshift_iphlc_query(patron_ids):
-    return _REDSHIFT_IPHLC_QUERY.format(
-        redshift_table=os.environ['REDSHIFT_TABLE'],
-        patron_ids=patron_ids)
+def _build_active_patron_ids_subquery(mode, poller_state, now):
+    if mode == PipelineMode.NEW_PATRONS:
+        start_dt = poller_state['creation_dt']
+        start_id = poller_state.get('creation_id', 0)
+    elif mode == PipelineMode.UPDATED_PATRONS:
+        start_dt = poller_state['update_dt']
+        start_id = poller_state.get('update_id', 0)
+    return _ACTIVE_PATRON_IDS_QUERY.format(
+        ordering_field=_get_ordering_field(mode)), {
+        'start_dt': start_dt, 'start_id': int(start_id), 'now': now,
+        'limit': int(os.environ['ACTIVE_PATRON_BATCH_SIZE'])}
 
 
-def build_redshift_patron_query(patron_ids):
-    return _REDSHIFT_PATRON_QUERY.format(
-        redshift_table=os.environ['REDSHIFT_TABLE'],
-        patron_ids=patron_ids)
+def _get_ordering_field(mode):
+    if mode == PipelineMode.NEW_PATRONS:
+        return 'creation_date_gmt'
+    elif mode == PipelineMode.UPDATED_PATRONS:
+        return 'record_last_updated_gmt'
+
+
+def build_deleted_patrons_query(deletion_date_start, deletion_id_start, now):
+    return _DELETED_PATRONS_QUERY, {
+        'cached_deletion_date': deletion_date_start,
+        'cached_deletion_id': int(deletion_id_start),
+        'limit': int(os.environ['DELETED_PATRON_BATCH_SIZE']),
+        'now': now}
+
+
+def build_redshift_address_query(address_hashes, temp_table=None):
+    """
+    Like every Redshift query builder, takes a list of values and returns a
+    (query, query_params) tuple with one placeholder per value. Redshift does
+    not support array parameters, so the list of placeholders is padded to a
+    power of two (by repeating the last value), capped at
+    REDSHIFT_MAX_QUERY_PARAMS, to limit the number of distinct statements
+    the server has to prepare. Larger lists have to use a temp table.
+
+    If a temp_table is given, the query instead joins against the keys
+    loaded into it by build_redshift_temp_table_queries and has no params.
+    """
+    return _build_redshift_lookup_query(
+        _REDSHIFT_ADDRESS_QUERY, 'address_hash', address_hashes, temp_table)
+
+
+def build_redshift_iphlc_query(patron_ids, temp_table=None):
+    return _build_redshift_lookup_query(
+        _REDSHIFT_IPHLC_QUERY, 'patron_id', patron_ids, temp_table)
+
+
+def build_redshift_patron_query(patron_ids, temp_table=None):
+    return _build_redshift_lookup_query(
+        _REDSHIFT_PATRON_QUERY, 'patron_id', patron_ids, temp_table)
+
+
+def build_redshift_temp_table_queries(temp_table, keys):
+    """
+    Builds the (query, query_params) tuples that create a session temp table
+    and load the keys into it using multi-row inserts of at most
+    REDSHIFT_INSERT_CHUNK_SIZE rows each
+    """
+    chunk_size = min(int(os.environ.get('REDSHIFT_INSERT_CHUNK_SIZE', 10000)),
+                     REDSHIFT_MAX_QUERY_PARAMS)
+    queries = [(_CREATE_TEMP_TABLE_QUERY.format(temp_table=temp_table), None)]
+    for i in range(0, len(keys), chunk_size):
+        chunk = list(keys[i:i + chunk_size])
+        queries.append((_INSERT_TEMP_TABLE_QUERY.format(
+            temp_table=temp_table,
+            placeholders=','.join(['(%s)'] * len(chunk))), chunk))
+    return queries
+
+
+def build_redshift_drop_temp_table_query(temp_table):
+    return _DROP_TEMP_TABLE_QUERY.format(temp_table=temp_table)
+
+
+def _build_redshift_lookup_query(query, key_column, values, temp_table):
+    redshift_table = os.environ['REDSHIFT_TABLE']
+    if temp_table is not None:
+        return query.format(
+            redshift_table=redshift_table,
+            key_filter=_REDSHIFT_JOIN_FILTER.format(
+                redshift_table=redshift_table, key_column=key_column,
+                temp_table=temp_table)), None
+
+    query_params = list(values)
+    if len(query_params) > REDSHIFT_MAX_QUERY_PARAMS:
+        raise QueryHelperError(
+            'Cannot look up ({count}) keys in a single Redshift query -- the '
+            'limit is {limit}'.format(count=len(query_params),
+                                      limit=REDSHIFT_MAX_QUERY_PARAMS))
+    padded_length = 1
+    while padded_length < len(query_params):
+        padded_length *= 2
+    padded_length = min(padded_length, REDSHIFT_MAX_QUERY_PARAMS)
+    query_params += query_params[-1:] * (padded_length - len(query_params))
+    return query.format(
+        redshift_table=redshift_table,
+        key_filter=_REDSHIFT_IN_FILTER.format(
+            key_column=key_column,
+            placeholders=','.join(['%s'] * len(query_params)))), query_params
+
+
+class QueryHelperError(Exception):
+    def __init__(self, message=None):
+        self.message = message
@@ -1,2 +1,6 @@
-from .census_geocoder_api_client import CensusGeocoderApiClient, CensusGeocoderApiClientError # noqa
-from .nyc_geocoder_client import NycGeocoderClient # noqa
\ No newline at end of file
+from .async_census_geocoder_api_client import AsyncCensusGeocoderApiClient # noqa
+from .census_geocoder_api_client import CensusGeocoderApiClient, CensusGeocoderApiClientError, CensusGeocoderCircuitOpenError # noqa
+from .database_connection_manager import DatabaseConnectionManager, DatabaseConnectionManagerError # noqa
+from .geocode_cache import GeocodeCache # noqa
+from .nyc_geocoder_client import NycGeocoderClient, NycGeocoderClientError # noqa
+from .obfuscation_cache import ObfuscationCache # noqa
@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import threading
+
+from nypl_py_utils.functions.log_helper import create_log
+
+_MIN_CHUNK_SIZE = 100
+# The census geocoder API accepts at most 10,000 addresses per file
+MAX_CHUNK_SIZE = 10000
+_ADDITIVE_INCREASE = 250
+_MULTIPLICATIVE_DECREASE = 0.5
+# Weight given to the newest observation in the moving averages
+_SMOOTHING = 0.3
+# How much the best observed throughput decays with each request, so that an
+# unusually fast run doesn't hold the chunk size down forever
+_BEST_DECAY = 0.99
+
+
+class AdaptiveChunkSizer:
+    """
+    Chooses how many addresses to send to the census geocoder API per request
+    based on how recent requests went, AIMD style:
+
+    - After a request that succeeds within target_seconds, the chunk size
+      grows by a fixed number of rows as long as throughput (rows per second)
+      is still within 90% of the best recently observed. Otherwise it returns
+      to the chunk size that achieved the best throughput.
+    - After a request that fails or takes longer than target_seconds, the
+      chunk size is halved.
+
+    Moving averages of the latency, throughput, and failure rate are kept
+    along with the chunk size and, if a state_file is given, are loaded from
+    and saved to it so that they carry over to the next run. Requests may be
+    recorded from multiple threads.
+    """
+
+    def __init__(self, initial_chunk_size, target_seconds, state_file=None):
+        self.logger = create_log('adaptive_chunk_sizer')
+        self.target_seconds = target_seconds
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.state = {
+            'chunk_size': _clamp(initial_chunk_size),
+            'latency_seconds': None,
+            'rows_per_second': None,
+            'failure_rate': 0.0,
+            'best_rows_per_second': 0.0,
+            'best_chunk_size': _clamp(initial_chunk_size),
+            'requests': 0}
+        if state_file is not None and os.path.exists(state_file):
+            with open(state_file, 'r') as state_stream:
+                self.state.update(json.load(state_stream))
+            self.state['chunk_size'] = _clamp(self.state['chunk_size'])
+            self.state['best_chunk_size'] = _clamp(
+                self.state['best_chunk_size'])
+            self.logger.info('Loaded adaptive chunk size state: {}'.format(
+                self.state))
+
+    @property
+    def chunk_size(self):
+        with self.lock:
+            return self.state['chunk_size']
+
+    @property
+    def min_chunk_size(self):
+        return _MIN_CHUNK_SIZE
+
+    def record_success(self, rows, seconds):
+        """Records a request that geocoded the given rows in seconds"""
+        with self.lock:
+            rows_per_second = rows / max(seconds, 1e-6)
+            self._update_averages(seconds, rows_per_second, 0.0)
+            state = self.state
+            if rows_per_second > state['best_rows_per_second']:
+                state['best_rows_per_second'] = rows_per_second
+                state['best_chunk_size'] = rows
+
+            if seconds > self.target_seconds:
+                self._decrease()
+            elif rows_per_second >= 0.9 * state['best_rows_per_second']:
+                state['chunk_size'] = _clamp(
+                    state['chunk_size'] + _ADDITIVE_INCREASE)
+            else:
+                state['chunk_size'] = _clamp(state['best_chunk_size'])
+
+    def record_failure(self, seconds):
+        """Records a request that failed after the given seconds"""
+        with self.lock:
+            self._update_averages(seconds, None, 1.0)
+            self._decrease()
+
+    def log_state(self):
+        with self.lock:
+            state = dict(self.state)
+        self.logger.info(
+            'Census geocoder chunk size: {chunk_size} rows (latency '
+            '{latency}s, {throughput} rows/s, {failure_rate:.0%} failure '
+            'rate over {requests} requests)'.format(
+                chunk_size=state['chunk_size'],
+                latency=_round(state['latency_seconds']),
+                throughput=_round(state['rows_per_second']),
+                failure_rate=state['failure_rate'],
+                requests=state['requests']))
+
+    def save_state(self):
+        """Writes the current state to the state file, if there is one"""
+        if self.state_file is None:
+            return
+        with self.lock:
+            state = dict(self.state)
+        # Each writer uses a temp file of its own, so that writers saving the
+        # same state file at the same time don't collide
+        temp_fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.state_file)),
+            prefix=os.path.basename(self.state_file) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(temp_fd, 'w') as state_stream:
+                json.dump(state, state_stream)
+            os.replace(temp_file, self.state_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    def _update_averages(self, seconds, rows_per_second, failure):
+        state = self.state
+        state['requests'] += 1
+        state['latency_seconds'] = _smooth(state['latency_seconds'], seconds)
+        if rows_per_second is not None:
+            state['rows_per_second'] = _smooth(state['rows_per_second'],
+                                               rows_per_second)
+        state['failure_rate'] = _smooth(state['failure_rate'], failure)
+        state['best_rows_per_second'] *= _BEST_DECAY
+
+    def _decrease(self):
+        self.state['chunk_size'] = _clamp(
+            self.state['chunk_size'] * _MULTIPLICATIVE_DECREASE)
+
+
+def _clamp(chunk_size):
+    return int(min(MAX_CHUNK_SIZE, max(_MIN_CHUNK_SIZE, chunk_size)))
+
+
+def _smooth(average, value):
+    if average is None:
+        return value
+    return _SMOOTHING * value + (1 - _SMOOTHING) * average
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
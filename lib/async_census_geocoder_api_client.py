@@ -0,0 +1,151 @@
+import aiohttp
+import asyncio
+import os
+import pandas as pd
+import threading
+import time
+
+from lib.census_geocoder_api_client import (CensusGeocoderApiClient,
+                                            join_responses)
+from nypl_py_utils.functions.log_helper import create_log
+
+# Matches the blocking client's Retry(total=2, backoff_factor=4) policy
+_RETRIES = 2
+_BACKOFF_FACTOR = 4
+_RETRY_STATUSES = {500, 502, 503, 504}
+
+
+class AsyncCensusGeocoderApiClient(CensusGeocoderApiClient):
+    """
+    Client for the Census Geocoder API that sends its requests with aiohttp on
+    an event loop running in a background thread, so that waiting on an
+    upload doesn't hold a thread of its own. Requests share a pool of at most
+    GEOCODER_API_WORKERS connections.
+
+    get_geoids has the same contract as CensusGeocoderApiClient.get_geoids,
+    including chunking and adaptive chunk sizing, and get_geoids_async can be
+    awaited on the client's loop directly.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.logger = create_log('async_census_geocoder_api_client')
+        self.max_connections = int(os.environ.get('GEOCODER_API_WORKERS', 4))
+        self.loop = None
+        self.loop_thread = None
+        self.http_session = None
+
+    def get_geoids(self, address_df, executor=None):
+        """
+        Runs get_geoids_async on the client's event loop and waits for the
+        result. The executor is ignored, since the requests are all sent from
+        the event loop.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.get_geoids_async(address_df), self._get_loop()).result()
+
+    async def get_geoids_async(self, address_df):
+        """
+        Sends the addresses in address_df to the geocoder, sending every chunk
+        concurrently in chunked mode. Returns a series containing the geoids
+        (or NaN) indexed to match address_df.
+        """
+        self.logger.info(
+            'Sending ({}) addresses to census geocoder API'.format(
+                len(address_df)))
+        try:
+            chunks = self._split_into_chunks(address_df)
+            results = [self._parse_response(await response)
+                       for response in asyncio.as_completed(
+                           [self._send_request_async(chunk)
+                            for chunk in chunks])]
+            return results[0] if len(results) == 1 else pd.concat(results)
+        finally:
+            self._log_chunk_sizer_state()
+
+    def close(self):
+        """Closes the connection pool and stops the event loop"""
+        super().close()
+        if self.loop is None:
+            return
+        if self.http_session is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.http_session.close(), self.loop).result()
+            self.http_session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+        self.loop_thread = None
+
+    def _get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(
+                target=self.loop.run_forever, name='census_geocoder_loop',
+                daemon=True)
+            self.loop_thread.start()
+        return self.loop
+
+    def _get_http_session(self):
+        if self.http_session is None:
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=300))
+        return self.http_session
+
+    async def _send_request_async(self, address_df):
+        """
+        Sends a request to the API and, if it fails, splits the addresses
+        into smaller batches that are sent concurrently.
+
+        Returns a csv string where each line contains information about a
+        single geocoded address.
+        """
+        self._check_circuit()
+        start_time = time.monotonic()
+        try:
+            content = await self._post_with_retries(address_df)
+            self._record_success(address_df, start_time)
+            return content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            pieces = self._split_failed_request(address_df, start_time, e)
+            return join_responses(await asyncio.gather(
+                *[self._send_request_async(piece) for piece in pieces]))
+        except Exception:
+            self._record_unexpected_failure()
+            raise
+
+    async def _post_with_retries(self, address_df):
+        """
+        Posts the addresses to the API, retrying connection errors, timeouts,
+        and 5xx responses up to twice with the same backoff as the blocking
+        client
+        """
+        address_csv = address_df.to_csv(
+            header=False, columns=['address', 'city', 'region', 'postal_code'])
+        self.logger.debug('Sending {}-address batch to geocoder API'.format(
+            len(address_df)))
+        for attempt in range(_RETRIES + 1):
+            if attempt > 1:
+                await asyncio.sleep(_BACKOFF_FACTOR * 2 ** (attempt - 1))
+            try:
+                return await self._post(address_csv)
+            except (aiohttp.ClientConnectionError,
+                    aiohttp.ClientResponseError, asyncio.TimeoutError):
+                if attempt == _RETRIES:
+                    raise
+
+    async def _post(self, address_csv):
+        form = aiohttp.FormData()
+        form.add_field('addressFile', address_csv.encode('utf-8'),
+                       filename='input_addresses.csv',
+                       content_type='text/csv')
+        async with self._get_http_session().post(
+                os.environ['GEOCODER_API_BASE_URL'], data=form, params={
+                    'benchmark': os.environ['GEOCODER_API_BENCHMARK'],
+                    'vintage': os.environ['GEOCODER_API_VINTAGE'],
+                    'key': os.environ['GEOCODER_API_KEY']}) as response:
+            if response.status in _RETRY_STATUSES:
+                response.raise_for_status()
+            return await response.read()
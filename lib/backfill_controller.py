@@ -0,0 +1,209 @@
+import json
+import os
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from helpers.pipeline_mode import PipelineMode
+from lib.pipeline_controller import PipelineController, write_json_atomically
+from nypl_py_utils.classes.s3_client import S3Client
+from nypl_py_utils.functions.log_helper import create_log
+
+_PLAN_FILE = 'plan.json'
+_BACKFILL_STATE_FIELDS = {
+    PipelineMode.NEW_PATRONS: ('creation_dt', 'creation_id',
+                               'STARTING_CREATION_DT'),
+    PipelineMode.UPDATED_PATRONS: ('update_dt', 'update_id',
+                                   'STARTING_UPDATE_DT')}
+
+
+class BackfillController:
+    """
+    Class for backfilling a large range of new or updated patrons. The range
+    [start_dt, now) is split into disjoint time windows ("shards") that are
+    each processed in their own process, with their own Sierra cursor and a
+    local checkpoint file. An interrupted backfill is resumed from the shard
+    checkpoints when it is rerun with the same mode and start date.
+
+    The global poller state is only advanced to the end of the backfill once
+    every shard has finished, so the regular poller never skips a window that
+    hasn't been processed yet.
+    """
+
+    def __init__(self, now):
+        self.logger = create_log('backfill_controller')
+        self.now = now
+        self.mode = PipelineMode[os.environ.get(
+            'BACKFILL_MODE', PipelineMode.NEW_PATRONS.name)]
+        if self.mode not in _BACKFILL_STATE_FIELDS:
+            raise BackfillControllerError(
+                'Backfill is not supported for mode {}'.format(self.mode))
+        self.dt_field, self.id_field, start_env_var = \
+            _BACKFILL_STATE_FIELDS[self.mode]
+        self.start_dt = os.environ.get(start_env_var,
+                                       '2020-01-01 00:00:00-05')
+        self.shard_count = int(os.environ.get('BACKFILL_SHARDS',
+                                              os.cpu_count() or 1))
+        self.checkpoint_dir = os.environ.get('BACKFILL_CHECKPOINT_DIR',
+                                             'backfill_checkpoints')
+        self.ignore_cache = os.environ.get('IGNORE_CACHE', False) == 'True'
+
+    def run_backfill(self):
+        """
+        Runs every unfinished shard in parallel and advances the global poller
+        state once all of them have finished
+        """
+        plan = self._load_or_create_plan()
+        unfinished_shards = [
+            shard for shard in plan['shards']
+            if not self._read_checkpoint(shard).get('complete', False)]
+        self.logger.info(
+            'Backfilling {mode} patrons from {start} to {end} with '
+            '{unfinished} of {total} shards left to run'.format(
+                mode=self.mode, start=plan['start_dt'], end=plan['end_dt'],
+                unfinished=len(unfinished_shards),
+                total=len(plan['shards'])))
+
+        if unfinished_shards:
+            with ProcessPoolExecutor(
+                    max_workers=len(unfinished_shards)) as executor:
+                futures = [executor.submit(
+                    _run_backfill_shard, self.mode, shard['end_dt'],
+                    shard['checkpoint_file']) for shard in unfinished_shards]
+                for future in futures:
+                    future.result()
+
+        incomplete_shards = [
+            shard['checkpoint_file'] for shard in plan['shards']
+            if not self._read_checkpoint(shard).get('complete', False)]
+        if incomplete_shards:
+            raise BackfillControllerError(
+                'Backfill shards did not finish: {}'.format(incomplete_shards))
+        self._merge_poller_state(plan['end_dt'])
+
+    def _load_or_create_plan(self):
+        """
+        Loads the existing backfill plan if it matches this backfill's mode
+        and start date. Otherwise splits the time range into shards and writes
+        a new plan along with an initial checkpoint for each shard.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        plan_path = os.path.join(self.checkpoint_dir, _PLAN_FILE)
+        if os.path.exists(plan_path):
+            with open(plan_path, 'r') as plan_stream:
+                plan = json.load(plan_stream)
+            if (plan['mode'] == self.mode.name
+                    and plan['start_dt'] == self.start_dt):
+                self.logger.info('Resuming backfill from existing plan')
+                return plan
+            self.logger.warning(
+                'Existing backfill plan is for a different mode or start date '
+                '-- replacing it')
+
+        shards = []
+        for i, (window_start, window_end) in enumerate(
+                build_time_windows(self.start_dt, self.now,
+                                   self.shard_count)):
+            checkpoint_file = os.path.join(
+                self.checkpoint_dir, 'shard_{}.json'.format(i))
+            write_json_atomically(checkpoint_file, {
+                self.dt_field: window_start, self.id_field: 0,
+                'complete': False})
+            shards.append({'start_dt': window_start, 'end_dt': window_end,
+                           'checkpoint_file': checkpoint_file})
+        plan = {'mode': self.mode.name, 'start_dt': self.start_dt,
+                'end_dt': self.now, 'shards': shards}
+        write_json_atomically(plan_path, plan)
+        return plan
+
+    def _read_checkpoint(self, shard):
+        with open(shard['checkpoint_file'], 'r') as checkpoint_stream:
+            return json.load(checkpoint_stream)
+
+    def _merge_poller_state(self, end_dt):
+        """
+        Advances the mode's fields of the global poller state to the end of
+        the backfill, unless the live poller has already moved past it, in
+        which case the cached cursor is kept so that it never goes backward
+        """
+        if self.ignore_cache:
+            self.logger.info(
+                'Backfill complete -- not caching {dt_field}={end_dt}'.format(
+                    dt_field=self.dt_field, end_dt=end_dt))
+            return
+
+        s3_client = S3Client(os.environ['S3_BUCKET'],
+                             os.environ['S3_RESOURCE'])
+        poller_state = s3_client.fetch_cache()
+        cached_dt = poller_state.get(self.dt_field)
+        if cached_dt is not None and _to_timestamp(
+                cached_dt) >= _to_timestamp(end_dt):
+            s3_client.close()
+            self.logger.info((
+                'Backfill complete -- poller state {state} is already at or '
+                'past {end_dt}, leaving it unchanged').format(
+                    state=poller_state, end_dt=end_dt))
+            return
+        poller_state[self.dt_field] = end_dt
+        poller_state[self.id_field] = 0
+        s3_client.set_cache(poller_state)
+        s3_client.close()
+        self.logger.info(
+            'Backfill complete -- advanced poller state to {}'.format(
+                poller_state))
+
+
+def _to_timestamp(value):
+    """
+    Parses an isoformat date or timestamp, treating one without a UTC offset
+    as UTC so that it can be compared with offset-aware timestamps
+    """
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else (
+        timestamp)
+
+
+def build_time_windows(start_dt, end_dt, window_count):
+    """
+    Splits [start_dt, end_dt) into window_count disjoint, equally sized
+    windows and returns them as a list of (start, end) isoformat strings
+    """
+    start = pd.Timestamp(start_dt)
+    end = pd.Timestamp(end_dt)
+    if start >= end:
+        raise BackfillControllerError(
+            'Backfill start {start} is not before its end {end}'.format(
+                start=start_dt, end=end_dt))
+
+    window_length = (end - start) / window_count
+    boundaries = [start + window_length*i for i in range(window_count)]
+    boundaries = [boundary.isoformat() for boundary in boundaries] + [end_dt]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _run_backfill_shard(mode, window_end, checkpoint_file):
+    """
+    Processes a single backfill shard until its window is exhausted and then
+    marks its checkpoint as complete. The controller's "now" is the end of the
+    window, which bounds its Sierra queries. If the controller stopped early
+    because geocoding was deferred, the checkpoint is left incomplete at the
+    last committed cursor so that the shard is resumed by the next run.
+    """
+    controller = PipelineController(window_end,
+                                    checkpoint_file=checkpoint_file)
+    controller.has_max_batches = False
+    controller.run_pipeline(mode)
+    if controller.geocoding_deferred:
+        create_log('backfill_controller').warning(
+            'Backfill shard {} deferred geocoding -- leaving it '
+            'incomplete'.format(checkpoint_file))
+        return
+
+    with open(checkpoint_file, 'r') as checkpoint_stream:
+        checkpoint = json.load(checkpoint_stream)
+    checkpoint['complete'] = True
+    write_json_atomically(checkpoint_file, checkpoint)
+
+
+class BackfillControllerError(Exception):
+    def __init__(self, message=None):
+        self.message = message
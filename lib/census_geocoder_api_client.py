@@ -1,18 +1,53 @@
 import os
 import pandas as pd
 import requests
+import time
 
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from helpers.census_response_helper import parse_census_geoids
 from io import BytesIO, TextIOWrapper
+from lib.adaptive_chunk_sizer import AdaptiveChunkSizer, MAX_CHUNK_SIZE
+from lib.circuit_breaker import CircuitBreaker
 from nypl_py_utils.functions.log_helper import create_log
 from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import RequestException
 
 
 class CensusGeocoderApiClient:
-    """Client for managing requests to the Census Geocoder API"""
+    """
+    Client for managing requests to the Census Geocoder API. If
+    GEOCODER_API_CHUNK_SIZE is set, larger inputs are split into chunks of at
+    most that many addresses that are sent concurrently. Chunks never exceed
+    the API's limit of 10,000 addresses per file, so larger inputs are
+    always split.
+
+    If GEOCODER_API_ADAPTIVE_CHUNKING is true, the chunk size (starting at
+    GEOCODER_API_CHUNK_SIZE, or 1000) is instead adjusted after every request
+    by an AdaptiveChunkSizer, and failed requests are split down to its
+    current chunk size.
+
+    If GEOCODER_API_CIRCUIT_BREAKER_THRESHOLD is set, that many consecutive
+    failed requests open a circuit breaker, after which requests fail fast
+    with a CensusGeocoderCircuitOpenError until a probe request succeeds.
+    """
 
     def __init__(self):
         self.logger = create_log('census_geocoder_api_client')
+        self.chunk_size = min(
+            int(os.environ['GEOCODER_API_CHUNK_SIZE']), MAX_CHUNK_SIZE) if (
+            os.environ.get('GEOCODER_API_CHUNK_SIZE')) else None
+        self.chunk_sizer = AdaptiveChunkSizer(
+            self.chunk_size or 1000,
+            float(os.environ.get('GEOCODER_API_TARGET_SECONDS', 60)),
+            os.environ.get('GEOCODER_API_ADAPTIVE_STATE_FILE')) if (
+            os.environ.get('GEOCODER_API_ADAPTIVE_CHUNKING') == 'True') \
+            else None
+        self.circuit_breaker = CircuitBreaker(
+            'Census geocoder API',
+            int(os.environ['GEOCODER_API_CIRCUIT_BREAKER_THRESHOLD']),
+            float(os.environ.get('GEOCODER_API_CIRCUIT_RESET_SECONDS', 300))
+        ) if os.environ.get('GEOCODER_API_CIRCUIT_BREAKER_THRESHOLD') \
+            else None
 
         retry_policy = Retry(total=2, backoff_factor=4,
                              status_forcelist=[500, 502, 503, 504],
@@ -20,37 +55,87 @@ class CensusGeocoderApiClient:
         self.session = requests.Session()
         self.session.mount('https://', HTTPAdapter(max_retries=retry_policy))
 
-    def get_geoids(self, address_df):
+    def get_geoids(self, address_df, executor=None):
         """
         Sends the addresses in address_df to the geocoder a single time, which
         may require multiple requests if the geocoder is overloaded.
 
+        In chunked mode, each chunk is sent using the given executor if there
+        is one and otherwise a temporary pool of GEOCODER_API_WORKERS threads,
+        and only the chunks that fail are split and resent.
+
         Returns a series containing the geoids (or NaN) indexed to match
         address_df.
         """
         self.logger.info(
             'Sending ({}) addresses to census geocoder API'.format(
                 len(address_df)))
-        raw_response = self._send_request(address_df)
-        response_df = pd.read_csv(BytesIO(raw_response), header=None,
-                                  dtype=str, index_col=0, engine='python',
-                                  names=['index', 'input_address', 'match',
-                                         'match_type', 'matched_address',
-                                         'coordinates', 'tigerline_id',
-                                         'tigerline_side', 'state_id',
-                                         'county_id', 'tract_id', 'block_id'])
-        geoids = (response_df['state_id'] + response_df['county_id'] +
-                  response_df['tract_id']).rename('geoid')
-        return geoids
+        try:
+            chunks = self._split_into_chunks(address_df)
+            if len(chunks) == 1:
+                return self._parse_response(self._send_request(address_df))
+            if executor is not None:
+                return self._send_chunks(chunks, executor)
+            with ThreadPoolExecutor(max_workers=int(os.environ.get(
+                    'GEOCODER_API_WORKERS', 4))) as executor:
+                return self._send_chunks(chunks, executor)
+        finally:
+            self._log_chunk_sizer_state()
+
+    def close(self):
+        self.session.close()
+
+    def _split_into_chunks(self, address_df):
+        """
+        Splits address_df into chunks of the current chunk size, or of the
+        API's limit if chunked mode is off, or returns it as the only chunk
+        if it's small enough
+        """
+        chunk_size = self.chunk_size if self.chunk_sizer is None else \
+            self.chunk_sizer.chunk_size
+        chunk_size = min(chunk_size or MAX_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        if len(address_df) <= chunk_size:
+            return [address_df]
+        chunks = [address_df.iloc[i:i + chunk_size]
+                  for i in range(0, len(address_df), chunk_size)]
+        self.logger.info(
+            'Splitting addresses into ({}) concurrent chunks'.format(
+                len(chunks)))
+        return chunks
+
+    def _log_chunk_sizer_state(self):
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.log_state()
+            self.chunk_sizer.save_state()
+
+    def _send_chunks(self, chunks, executor):
+        """
+        Sends each chunk in its own request and parses the responses as they
+        arrive. Returns the combined series of geoids.
+        """
+        futures = [executor.submit(self._send_request, chunk)
+                   for chunk in chunks]
+        return pd.concat([self._parse_response(future.result())
+                          for future in as_completed(futures)])
+
+    def _parse_response(self, raw_response):
+        """
+        Parses the API's csv response into a series of geoids (or NaN)
+        indexed by the input row indices
+        """
+        return parse_census_geoids([raw_response])
 
     def _send_request(self, address_df):
         """
         Send a request to the API. Recursively calls itself with a smaller
-        batch size if the initial request fails.
+        batch size if the initial request fails. Each request's latency and
+        outcome is recorded by the chunk sizer if there is one.
 
         Returns a csv string where each line contains information about a
         single geocoded address.
         """
+        self._check_circuit()
+        start_time = time.monotonic()
         try:
             with BytesIO() as address_stream:
                 address_df.to_csv(
@@ -71,23 +156,83 @@ class CensusGeocoderApiClient:
                         'key': os.environ['GEOCODER_API_KEY']
                     },
                     timeout=300)
+                self._record_success(address_df, start_time)
                 return response.content
         except RequestException as e:
-            new_df_size = len(address_df) // 2
-            if new_df_size >= 1000:
-                self.logger.info(
-                    ('Initial geocoding request failed -- sending two new '
-                     'requests with {} addresses each').format(new_df_size))
-                results_1 = self._send_request(address_df.iloc[:new_df_size])
-                results_2 = self._send_request(address_df.iloc[new_df_size:])
-                return results_1 + results_2
-            else:
-                self.logger.error(
-                    ('Failed to retrieve geocoded addresses from API: {}')
-                    .format(e))
-                raise CensusGeocoderApiClientError(
-                    ('Failed to retrieve geocoded addresses from API: {}')
-                    .format(e)) from None
+            pieces = self._split_failed_request(address_df, start_time, e)
+            return join_responses(
+                [self._send_request(piece) for piece in pieces])
+        except Exception:
+            self._record_unexpected_failure()
+            raise
+
+    def _check_circuit(self):
+        """
+        Raises a CensusGeocoderCircuitOpenError if the circuit breaker is
+        open
+        """
+        if (self.circuit_breaker is not None
+                and not self.circuit_breaker.allow_request()):
+            raise CensusGeocoderCircuitOpenError(
+                'Census geocoder API circuit is open')
+
+    def _record_success(self, address_df, start_time):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.record_success(
+                len(address_df), time.monotonic() - start_time)
+
+    def _record_unexpected_failure(self):
+        """
+        Records an error other than a failed request as a circuit breaker
+        failure, so that a half-open circuit doesn't stay waiting on its probe
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
+    def _split_failed_request(self, address_df, start_time, error):
+        """
+        Records a failed request and splits its addresses into the smaller
+        batches that should be sent instead. Raises a
+        CensusGeocoderApiClientError if the batch is already too small.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+        new_df_size = len(address_df) // 2
+        min_df_size = 1000
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.record_failure(time.monotonic() - start_time)
+            new_df_size = min(new_df_size, self.chunk_sizer.chunk_size)
+            min_df_size = self.chunk_sizer.min_chunk_size
+        if new_df_size < min_df_size:
+            self.logger.error(
+                ('Failed to retrieve geocoded addresses from API: {}')
+                .format(error))
+            raise CensusGeocoderApiClientError(
+                ('Failed to retrieve geocoded addresses from API: {}')
+                .format(error)) from None
+
+        self.logger.info(
+            ('Initial geocoding request failed -- sending new '
+             'requests with {} addresses each').format(new_df_size))
+        boundaries = list(range(
+            new_df_size, len(address_df) - new_df_size + 1, new_df_size))
+        return [address_df.iloc[start:end] for start, end in zip(
+            [0] + boundaries, boundaries + [len(address_df)])]
+
+
+def join_responses(responses):
+    """
+    Concatenates raw csv responses, making sure the last line of one doesn't
+    run into the first line of the next
+    """
+    results = b''
+    for response in responses:
+        if results and not results.endswith(b'\n'):
+            results += b'\n'
+        results += response
+    return results
 
 
 class NamedTextIOWrapper(TextIOWrapper):
@@ -109,3 +254,7 @@ class NamedTextIOWrapper(TextIOWrapper):
 class CensusGeocoderApiClientError(Exception):
     def __init__(self, message=None):
         self.message = message
+
+
+class CensusGeocoderCircuitOpenError(CensusGeocoderApiClientError):
+    pass
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from nypl_py_utils.functions.log_helper import create_log
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for calls to an external service. After
+    failure_threshold consecutive failures the circuit opens and
+    allow_request() returns False, so that callers can fail fast rather than
+    waiting on a degraded service. Once reset_seconds have passed, a single
+    probe request is allowed through (half-open): if it succeeds the circuit
+    closes again, and if it fails the circuit reopens for another
+    reset_seconds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.logger = create_log('circuit_breaker')
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def allow_request(self):
+        """
+        Returns whether a request should be sent, moving an open circuit to
+        half-open (and allowing a single probe) once its reset time has passed
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    time.monotonic() - self.opened_at >= self.reset_seconds):
+                self.state = self.HALF_OPEN
+                self.logger.info(
+                    '{} circuit is half-open -- sending a probe request'
+                    .format(self.name))
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.logger.info('{} circuit is closed'.format(self.name))
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self.consecutive_failures >= self.failure_threshold):
+                if self.state != self.OPEN:
+                    self.logger.warning((
+                        '{name} circuit is open after ({failures}) '
+                        'consecutive failures -- failing fast for {reset} '
+                        'seconds').format(
+                            name=self.name,
+                            failures=self.consecutive_failures,
+                            reset=self.reset_seconds))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
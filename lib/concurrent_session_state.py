@@ -0,0 +1,68 @@
+import pandas as pd
+import threading
+
+
+class ConcurrentSessionState:
+    """
+    State shared by the controllers of pipeline modes running concurrently,
+    so that together they skip the same patrons they would if the modes ran
+    one after another: the patron ids processed by any mode this session,
+    and the new patrons mode's current (creation timestamp, patron id)
+    cursor. Updated patrons created after that cursor are left for the new
+    patrons mode, which reaches them later in the session (or the next one)
+    and, unlike the updated patrons mode, doesn't need them to already be in
+    Redshift.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processed_ids = set()
+        self.new_patrons_cursor = None
+        self.new_patrons_cursor_ready = threading.Event()
+
+    def unseen_mask(self, patron_ids):
+        """
+        Returns whether each patron id hasn't been processed by any mode
+        this session
+        """
+        with self.lock:
+            return ~patron_ids.isin(self.processed_ids)
+
+    def add_processed_ids(self, patron_ids):
+        with self.lock:
+            self.processed_ids.update(patron_ids)
+
+    def discard_processed_ids(self, patron_ids):
+        with self.lock:
+            self.processed_ids.difference_update(patron_ids)
+
+    def set_new_patrons_cursor(self, creation_dt, creation_id):
+        with self.lock:
+            self.new_patrons_cursor = (pd.Timestamp(creation_dt),
+                                       int(creation_id))
+        self.new_patrons_cursor_ready.set()
+
+    def release_new_patrons_cursor(self):
+        """
+        Stops waiting for the new patrons mode to set its cursor, e.g.
+        because it failed before starting. Without a cursor, no updated
+        patrons are skipped.
+        """
+        self.new_patrons_cursor_ready.set()
+
+    def pending_new_patrons_mask(self, sierra_df):
+        """
+        Returns whether each record is for a patron created after the new
+        patrons mode's cursor, waiting for that mode to set its cursor first
+        """
+        self.new_patrons_cursor_ready.wait()
+        with self.lock:
+            cursor = self.new_patrons_cursor
+        if cursor is None:
+            return pd.Series(False, index=sierra_df.index)
+        creation_dt, creation_id = cursor
+        creation_timestamps = pd.to_datetime(
+            sierra_df['creation_timestamp'], utc=True)
+        patron_ids = pd.to_numeric(sierra_df['patron_id_plaintext'])
+        return (creation_timestamps > creation_dt) | (
+            (creation_timestamps == creation_dt) & (patron_ids > creation_id))
@@ -0,0 +1,175 @@
+import os
+import psycopg
+import redshift_connector
+import time
+
+from nypl_py_utils.classes.postgresql_client import PostgreSQLClientError
+from nypl_py_utils.classes.redshift_client import RedshiftClientError
+from nypl_py_utils.functions.log_helper import create_log
+
+
+class DatabaseConnectionManager:
+    """
+    Keeps a single database connection open for the length of a pipeline
+    session instead of connecting and disconnecting for every query. Before
+    an idle connection is reused it is checked for liveness, and a connection
+    that has been dropped is reopened and the failed query retried once.
+
+    Takes as input a PostgreSQLClient or RedshiftClient, a name to use in the
+    logs, and whether the connection should be put into autocommit mode so
+    that read queries don't leave a transaction open between batches.
+    """
+
+    def __init__(self, client, name, autocommit=False):
+        self.logger = create_log('database_connection_manager')
+        self.client = client
+        self.name = name
+        self.autocommit = autocommit
+        self.liveness_check_seconds = int(
+            os.environ.get('DB_LIVENESS_CHECK_SECONDS', 60))
+
+        self.is_connected = False
+        self.last_used = None
+        self.connection_count = 0
+        self.reuse_count = 0
+
+    def acquire(self):
+        """
+        Returns the underlying client with a healthy open connection, opening
+        a new connection if there isn't one or the existing one is dead
+        """
+        if not self.is_connected:
+            self._connect()
+        elif (time.monotonic() - self.last_used >= self.liveness_check_seconds
+                and not self._is_alive()):
+            self.logger.warning(
+                '{} connection failed liveness check -- reconnecting'.format(
+                    self.name))
+            self._reconnect()
+        else:
+            self.reuse_count += 1
+        self.last_used = time.monotonic()
+        return self.client
+
+    def execute_query(self, query, *args, **kwargs):
+        """
+        Executes the query using the managed connection. If the query fails
+        because the connection was lost, reconnects and retries it once.
+        """
+        return self.run_with_retry(
+            lambda client: client.execute_query(query, *args, **kwargs))
+
+    def execute_parameterized_query(self, query, query_params):
+        """
+        Executes a parameterized read query directly on a cursor of the
+        managed connection, for clients such as the RedshiftClient whose
+        execute_query does not accept query parameters. Retries the same way
+        as execute_query.
+        """
+        return self.run_with_retry(
+            lambda client: self._execute_on_cursor(
+                client, query, query_params))
+
+    def run_with_retry(self, execute):
+        """
+        Calls execute with the client and returns its result. If it fails
+        because the connection was lost, reconnects and calls it once more.
+        Useful for work that has to happen within a single session, such as
+        loading and then querying a temp table.
+        """
+        client = self.acquire()
+        try:
+            return execute(client)
+        # A dropped connection can also surface as a raw driver error, e.g.
+        # when the client's own rollback fails after the query does
+        except (PostgreSQLClientError, RedshiftClientError,
+                DatabaseConnectionManagerError, psycopg.Error,
+                redshift_connector.Error):
+            if self._is_alive():
+                raise
+            self.logger.warning(
+                '{} connection was lost -- reconnecting and retrying '
+                'query'.format(self.name))
+            self._reconnect()
+            return execute(self.client)
+        finally:
+            self.last_used = time.monotonic()
+
+    def _execute_on_cursor(self, client, query, query_params):
+        self.logger.debug(
+            'Executing parameterized {name} query {query}'.format(
+                name=self.name, query=query))
+        cursor = client.conn.cursor()
+        try:
+            cursor.execute(query, query_params)
+            return cursor.fetchall()
+        except Exception as e:
+            try:
+                client.conn.rollback()
+            except Exception as rollback_error:
+                self.logger.warning(
+                    'Error rolling back {name} query: {error}'.format(
+                        name=self.name, error=rollback_error))
+            self.logger.error(
+                'Error executing {name} query \'{query}\': {error}'.format(
+                    name=self.name, query=query, error=e))
+            raise DatabaseConnectionManagerError(
+                'Error executing {name} query \'{query}\': {error}'.format(
+                    name=self.name, query=query, error=e)) from None
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Closes the managed connection and logs how often it was reused"""
+        if not self.is_connected:
+            return
+        self.logger.info(
+            'Closing {name} connection after opening it {opened} time(s) and '
+            'reusing it {reused} time(s)'.format(
+                name=self.name, opened=self.connection_count,
+                reused=self.reuse_count))
+        try:
+            self.client.close_connection()
+        except Exception as e:
+            self.logger.warning(
+                'Error closing {name} connection: {error}'.format(
+                    name=self.name, error=e))
+        self.is_connected = False
+        self.connection_count = 0
+        self.reuse_count = 0
+
+    def _connect(self):
+        self.client.connect()
+        if self.autocommit:
+            self.client.conn.autocommit = True
+        self.is_connected = True
+        self.connection_count += 1
+
+    def _reconnect(self):
+        try:
+            self.client.close_connection()
+        except Exception:
+            pass
+        self._connect()
+
+    def _is_alive(self):
+        """Checks whether the connection can still run a trivial query"""
+        conn = self.client.conn
+        if conn is None or getattr(conn, 'closed', False) is True:
+            return False
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1;')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.commit()
+            return True
+        except Exception:
+            return False
+
+
+class DatabaseConnectionManagerError(Exception):
+    def __init__(self, message=None):
+        self.message = message
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from lib.obfuscation_engine import get_cpu_quota
+from nypl_py_utils.functions.log_helper import create_log
+
+
+class ExecutorRegistry:
+    """
+    Holds the thread pools shared by every stage of a pipeline session, one
+    per class of workload, so that they aren't created and torn down for
+    every batch:
+
+    - cpu_hashing: bcrypt obfuscation, sized by OBFUSCATION_WORKERS (the
+      container's CPU quota by default)
+    - blocking_io: background database queries, sized by BLOCKING_IO_WORKERS
+      (4 by default)
+    - geosupport: NYC geocoder calls, sized by GEOSUPPORT_WORKERS (2 by
+      default)
+    - census_geocoder: chunked census geocoder API requests, sized by
+      GEOCODER_API_WORKERS (4 by default)
+    - hedged_census_geocoder: the census geocoder API requests for hedged
+      NYC addresses, which wait on the census_geocoder pool, also sized by
+      GEOCODER_API_WORKERS
+
+    Pools are created the first time they're requested and shut down by
+    shutdown(), after which they will be recreated if requested again.
+    """
+
+    def __init__(self):
+        self.logger = create_log('executor_registry')
+        self.pool_sizes = {
+            'cpu_hashing': int(os.environ.get('OBFUSCATION_WORKERS',
+                                              get_cpu_quota())),
+            'blocking_io': int(os.environ.get('BLOCKING_IO_WORKERS', 4)),
+            'geosupport': int(os.environ.get('GEOSUPPORT_WORKERS', 2)),
+            'census_geocoder': int(os.environ.get('GEOCODER_API_WORKERS', 4)),
+            'hedged_census_geocoder': int(os.environ.get(
+                'GEOCODER_API_WORKERS', 4))}
+        self.pools = {}
+        # Pools are requested from several threads at once, e.g. by
+        # background geocoding, so creating them is serialized
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """Returns the named pool, creating it if necessary"""
+        if name not in self.pool_sizes:
+            raise ExecutorRegistryError('Unknown executor pool: {}'.format(
+                name))
+        with self.lock:
+            if name not in self.pools:
+                self.pools[name] = InstrumentedThreadPoolExecutor(
+                    max_workers=self.pool_sizes[name],
+                    thread_name_prefix=name)
+            return self.pools[name]
+
+    def log_stats(self):
+        """
+        Logs the current and peak queue depth and the utilization of each
+        pool that has been used since the last call, then resets the stats
+        """
+        with self.lock:
+            pools = list(self.pools.items())
+        for name, pool in pools:
+            stats = pool.reset_stats()
+            self.logger.info(
+                'Executor pool {name}: ({tasks}) tasks, queue depth {depth} '
+                '(peak {peak}), {utilization:.0%} utilization of '
+                '{workers} workers'.format(
+                    name=name, tasks=stats['completed_tasks'],
+                    depth=stats['queue_depth'],
+                    peak=stats['peak_queue_depth'],
+                    utilization=stats['utilization'],
+                    workers=pool._max_workers))
+
+    def shutdown(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            pool.shutdown()
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that tracks how many tasks are waiting for a worker
+    and how much time its workers spend running tasks
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._queue_depth = 0
+        self._peak_queue_depth = 0
+        self._busy_seconds = 0.0
+        self._completed_tasks = 0
+        self._stats_start = time.monotonic()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self._queue_depth += 1
+            self._peak_queue_depth = max(self._peak_queue_depth,
+                                         self._queue_depth)
+        return super().submit(self._run_task, fn, *args, **kwargs)
+
+    def reset_stats(self):
+        """Returns the stats since the last reset and resets them"""
+        with self._stats_lock:
+            elapsed = time.monotonic() - self._stats_start
+            stats = {
+                'queue_depth': self._queue_depth,
+                'peak_queue_depth': self._peak_queue_depth,
+                'completed_tasks': self._completed_tasks,
+                'utilization': self._busy_seconds / (
+                    elapsed * self._max_workers) if elapsed > 0 else 0.0}
+            self._peak_queue_depth = self._queue_depth
+            self._busy_seconds = 0.0
+            self._completed_tasks = 0
+            self._stats_start = time.monotonic()
+        return stats
+
+    def _run_task(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self._queue_depth -= 1
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._busy_seconds += time.monotonic() - start
+                self._completed_tasks += 1
+
+
+class ExecutorRegistryError(Exception):
+    def __init__(self, message=None):
+        self.message = message
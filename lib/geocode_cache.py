@@ -0,0 +1,180 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import time
+
+from nypl_py_utils.functions.log_helper import create_log
+
+# SQLite versions before 3.32 allow at most 999 variables per statement
+_SQLITE_CHUNK_SIZE = 900
+
+
+class GeocodeCache:
+    """
+    Persistent cache of geoids keyed on canonical addresses (see
+    helpers.address_helper.canonicalize_address), so that an address that
+    has already been geocoded for one patron doesn't have to be geocoded
+    again for the next patron at the same address. Addresses that no
+    geocoder could resolve are also cached, for failure_ttl_seconds, so that
+    they aren't sent through every geocoder again each time the patron is
+    updated.
+
+    Entries are stored in a local SQLite database keyed by an HMAC-SHA256
+    digest of the canonical address (keyed with the bcrypt salt) so that no
+    addresses are written to disk. Entries expire after ttl_seconds, and once
+    either table holds more than max_entries the least recently written
+    entries are evicted.
+    """
+
+    def __init__(self, db_file, ttl_seconds, max_entries,
+                 failure_ttl_seconds):
+        self.logger = create_log('geocode_cache')
+        self.db_file = db_file
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.failure_ttl_seconds = failure_ttl_seconds
+        self.digest_key = os.environ['BCRYPT_SALT'].encode()
+
+        self.conn = None
+        self.hits = 0
+        self.lookups = 0
+        self.failure_hits = 0
+
+    def get_geoids(self, address_keys):
+        """
+        Takes a list of canonical addresses and returns a dictionary mapping
+        each one that has an unexpired cached geoid to that geoid
+        """
+        address_keys = list(dict.fromkeys(address_keys))
+        results = self._fetch('SELECT digest, geoid FROM geocodes',
+                              address_keys, self.ttl_seconds)
+        self.hits += len(results)
+        self.lookups += len(address_keys)
+        return results
+
+    def get_failures(self, address_keys):
+        """
+        Takes a list of canonical addresses and returns the set of them that
+        recently failed to geocode
+        """
+        address_keys = list(dict.fromkeys(address_keys))
+        results = set(self._fetch(
+            'SELECT digest, NULL FROM failed_geocodes', address_keys,
+            self.failure_ttl_seconds).keys())
+        self.failure_hits += len(results)
+        return results
+
+    def set_geoids(self, geoids_by_address_key):
+        """
+        Caches each canonical address's geoid and then evicts expired and
+        excess entries
+        """
+        if not geoids_by_address_key:
+            return
+        now = time.time()
+        conn = self._get_connection()
+        conn.executemany(
+            'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?);',
+            [(self._digest(key), geoid, now)
+             for key, geoid in geoids_by_address_key.items()])
+        conn.executemany(
+            'DELETE FROM failed_geocodes WHERE digest = ?;',
+            [(self._digest(key),) for key in geoids_by_address_key])
+        self._evict('geocodes', now - self.ttl_seconds)
+        conn.commit()
+
+    def set_failures(self, address_keys):
+        """
+        Caches the canonical addresses that failed to geocode and then evicts
+        expired and excess failures
+        """
+        if not address_keys:
+            return
+        now = time.time()
+        conn = self._get_connection()
+        conn.executemany(
+            'INSERT OR REPLACE INTO failed_geocodes VALUES (?, ?);',
+            [(self._digest(key), now) for key in set(address_keys)])
+        self._evict('failed_geocodes', now - self.failure_ttl_seconds)
+        conn.commit()
+
+    def log_stats(self):
+        """Logs the hit rate since the last call and resets it"""
+        if self.lookups > 0:
+            self.logger.info(
+                'Geocode cache hit rate: {hits}/{lookups} ({rate:.0%}) '
+                'distinct addresses'.format(
+                    hits=self.hits, lookups=self.lookups,
+                    rate=self.hits/self.lookups))
+        if self.failure_hits > 0:
+            self.logger.info(
+                'Skipped geocoding ({}) distinct addresses that recently '
+                'failed to geocode'.format(self.failure_hits))
+        self.hits = 0
+        self.lookups = 0
+        self.failure_hits = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _get_connection(self):
+        if self.conn is None:
+            # The cache is used from whichever thread is geocoding a batch,
+            # but never from more than one thread at a time
+            self.conn = sqlite3.connect(self.db_file, timeout=30,
+                                        check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL;')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS geocodes ('
+                'digest TEXT PRIMARY KEY, geoid TEXT NOT NULL, '
+                'updated_at REAL NOT NULL);')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS geocodes_updated_at '
+                'ON geocodes (updated_at);')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS failed_geocodes ('
+                'digest TEXT PRIMARY KEY, updated_at REAL NOT NULL);')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS failed_geocodes_updated_at '
+                'ON failed_geocodes (updated_at);')
+            self.conn.commit()
+        return self.conn
+
+    def _digest(self, address_key):
+        return hmac.new(self.digest_key, address_key.encode(),
+                        hashlib.sha256).hexdigest()
+
+    def _fetch(self, select_statement, address_keys, ttl_seconds):
+        """
+        Runs the select statement (which should select a digest and a value)
+        against the unexpired rows for the given canonical addresses and
+        returns a dictionary mapping each address found to its value
+        """
+        digests = {self._digest(key): key for key in address_keys}
+        digest_list = list(digests.keys())
+        min_updated_at = time.time() - ttl_seconds
+        conn = self._get_connection()
+        results = {}
+        for i in range(0, len(digest_list), _SQLITE_CHUNK_SIZE):
+            chunk = digest_list[i:i + _SQLITE_CHUNK_SIZE]
+            for digest, value in conn.execute(
+                    '{select} WHERE digest IN ({params}) '
+                    'AND updated_at >= ?;'.format(
+                        select=select_statement,
+                        params=','.join(['?'] * len(chunk))),
+                    chunk + [min_updated_at]).fetchall():
+                results[digests[digest]] = value
+        return results
+
+    def _evict(self, table, min_updated_at):
+        """Deletes the table's expired rows and its oldest excess rows"""
+        conn = self._get_connection()
+        conn.execute('DELETE FROM {} WHERE updated_at < ?;'.format(table),
+                     (min_updated_at,))
+        conn.execute(
+            'DELETE FROM {table} WHERE digest IN ('
+            'SELECT digest FROM {table} ORDER BY updated_at DESC '
+            'LIMIT -1 OFFSET ?);'.format(table=table), (self.max_entries,))
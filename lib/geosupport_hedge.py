@@ -0,0 +1,96 @@
+import pandas as pd
+
+from concurrent.futures import FIRST_COMPLETED, wait
+from nypl_py_utils.functions.log_helper import create_log
+
+
+class GeosupportHedge:
+    """
+    NYC geocoder requests sent for a set of NYC addresses at the same time as
+    they're sent to the census geocoder API, so that each address is given
+    whichever valid geoid comes back first.
+
+    Addresses that share a house number, street name, and postal code are
+    only sent to the NYC geocoder once. Once the NYC geocoder has geocoded
+    every address, the census geocoder request is no longer waited on, and
+    once the census geocoder has geocoded an address, its NYC geocoder
+    request is cancelled if it hasn't started yet and ignored if it has.
+    """
+
+    def __init__(self, nyc_geocoder_client, address_df, columns, executor):
+        self.logger = create_log('geosupport_hedge')
+        self.index = address_df.index
+        address_ids = address_df.groupby(
+            columns, sort=False, dropna=False).ngroup()
+        unique_df = address_df[~address_ids.duplicated()]
+        # Maps each request to the rows that share it
+        rows_by_address_id = address_df.index.groupby(address_ids.values)
+        self.futures = dict(zip(
+            nyc_geocoder_client.submit_geoids(unique_df, executor),
+            [rows_by_address_id[address_id]
+             for address_id in address_ids[unique_df.index]]))
+        self.nyc_wins = 0
+        self.census_wins = 0
+
+    def race(self, census_future):
+        """
+        Takes a future resolving to the census geocoder's geoids for the same
+        addresses and the indices of the addresses it bypassed because its
+        circuit breaker was open. Returns the geoids, each the first valid
+        one to come back, and the indices of the bypassed addresses that are
+        still without one.
+        """
+        geoids = pd.Series(None, index=self.index, dtype=object)
+        try:
+            pending = set(self.futures)
+            while pending and not census_future.done():
+                done, pending = wait(pending | {census_future},
+                                     return_when=FIRST_COMPLETED)
+                done.discard(census_future)
+                pending.discard(census_future)
+                for future in done:
+                    self._take_nyc_geoid(future, geoids)
+                if geoids.notnull().all():
+                    census_future.cancel()
+                    return geoids, pd.Index([])
+
+            census_geoids, bypassed_indices = census_future.result()
+            finished = {future for future in pending if future.done()}
+            for future in finished:
+                self._take_nyc_geoid(future, geoids)
+            pending -= finished
+            census_geoids = census_geoids.reindex(geoids.index)
+            census_mask = geoids.isnull() & census_geoids.notnull()
+            self.census_wins += census_mask.sum()
+            geoids[census_mask] = census_geoids[census_mask]
+            for future in pending:
+                if geoids[self.futures[future]].notnull().all():
+                    future.cancel()
+                else:
+                    self._take_nyc_geoid(future, geoids)
+            return geoids, bypassed_indices[
+                geoids[bypassed_indices].isnull().values]
+        finally:
+            self.cancel()
+            self.logger.info((
+                'Hedged NYC addresses: ({nyc}) geocoded first by the NYC '
+                'geocoder and ({census}) by the census geocoder').format(
+                    nyc=self.nyc_wins, census=self.census_wins))
+
+    def cancel(self):
+        """Cancels every NYC geocoder request that hasn't started yet"""
+        for future in self.futures:
+            future.cancel()
+
+    def _take_nyc_geoid(self, future, geoids):
+        """
+        Gives the NYC geocoder's geoid to the request's rows that don't have
+        one yet
+        """
+        nyc_geoid = future.result()
+        if nyc_geoid is None:
+            return
+        rows = self.futures[future]
+        rows = rows[geoids[rows].isnull().values]
+        self.nyc_wins += len(rows)
+        geoids[rows] = nyc_geoid
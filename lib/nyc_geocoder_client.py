@@ -1,7 +1,11 @@
+import functools
 import geosupport
+import multiprocessing
+import numpy as np
+import os
 import pandas as pd
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from nypl_py_utils.functions.log_helper import create_log
 
 
@@ -13,57 +17,197 @@ _BOROUGH_MAP = {
     'STATEN IS': '36085'
 }
 
+# The Geosupport instance of a process pool worker, created once by
+# _init_worker when the worker starts
+_worker_geosupport = None
+
 
 class NycGeocoderClient:
-    """Client for managing calls to the NYC Geocoder"""
+    """
+    Client for managing calls to the NYC Geocoder.
+
+    Geosupport calls are serialized within a process, so with the default
+    thread backend extra threads add little parallelism. With
+    GEOSUPPORT_BACKEND set to process, get_geoids instead sends chunks of
+    GEOSUPPORT_CHUNK_SIZE addresses to a pool of GEOSUPPORT_WORKERS
+    processes, each with its own Geosupport instance.
+    """
 
     def __init__(self):
         self.logger = create_log('nyc_geocoder_client')
+        self.backend = os.environ.get('GEOSUPPORT_BACKEND', 'thread')
+        if self.backend not in ('thread', 'process'):
+            raise NycGeocoderClientError(
+                'Unknown GEOSUPPORT_BACKEND: {}'.format(self.backend))
+        self.workers = int(os.environ.get('GEOSUPPORT_WORKERS', 2))
+        self.chunk_size = int(os.environ.get('GEOSUPPORT_CHUNK_SIZE', 500))
         self.geosupport = geosupport.Geosupport()
+        self.process_pool = None
 
-    def get_geoids(self, address_df):
+    def get_geoids(self, address_df, executor=None):
         """
         Geocodes the addresses in address_df and returns a series containing
-        the geoids (or None) indexed to match address_df
+        the geoids (or None) indexed to match address_df. With the thread
+        backend, uses the given executor if there is one and otherwise a
+        temporary two-thread pool. The executor is ignored by the process
+        backend.
         """
         self.logger.info(
             'Sending ({}) addresses to NYC geocoder'.format(len(address_df)))
+        if self.backend == 'process':
+            return self._get_geoids_with_processes(address_df)
+        if executor is not None:
+            return self._get_geoids_with_threads(address_df, executor)
         with ThreadPoolExecutor(max_workers=2) as executor:
-            geoids_list = list(executor.map(
-                self._geocode_address, address_df.iterrows()))
+            return self._get_geoids_with_threads(address_df, executor)
+
+    def submit_geoids(self, address_df, executor):
+        """
+        Submits the addresses in address_df to the NYC geocoder without
+        waiting for the results. Returns a list of futures, one per row, that
+        each resolve to the address's geoid (or None). With the thread
+        backend, each address is submitted to the given executor. The process
+        backend instead submits chunks of addresses to the process pool and
+        ignores the executor.
+        """
+        self.logger.info(
+            'Submitting ({}) addresses to NYC geocoder'.format(
+                len(address_df)))
+        if self.backend == 'process':
+            return self._submit_geoids_to_processes(address_df)
+        geocode = functools.partial(_geocode, self.geosupport)
+        return [executor.submit(geocode, *address)
+                for address in zip(*_address_columns(address_df))]
+
+    def close(self):
+        """Shuts down the process pool, if there is one"""
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
 
-        # Transforms a list of (index, value) tuples into [(indices), (values)]
-        # so that it can be used to construct a pandas Series
-        transposed_geoids_list = list(zip(*geoids_list))
-        return pd.Series(transposed_geoids_list[1],
-                         index=transposed_geoids_list[0], name='geoid')
+    def _get_geoids_with_threads(self, address_df, executor):
+        """
+        Pulls the address columns out of address_df as plain arrays once and
+        geocodes them in order on the executor, writing each geoid into a
+        preallocated array rather than building a series per row
+        """
+        geocode = functools.partial(_geocode, self.geosupport)
+        geoids = np.empty(len(address_df), dtype=object)
+        for position, geoid in enumerate(executor.map(
+                geocode, *_address_columns(address_df))):
+            geoids[position] = geoid
+        return pd.Series(geoids, index=address_df.index, name='geoid')
 
-    def _geocode_address(self, address_row_tuple):
+    def _get_geoids_with_processes(self, address_df):
         """
-        Processes a single row of the address dataframe by parsing the given
-        address and sending it to the NYC geocoder.
+        Sends the addresses to the process pool as chunks of (house_number,
+        street_name, zip_code) tuples and returns the geoids in order
+        """
+        geoids = []
+        for chunk_geoids in self._get_process_pool().map(
+                _geocode_chunk, self._split_into_chunks(address_df)):
+            geoids.extend(chunk_geoids)
+        return pd.Series(geoids, index=address_df.index, name='geoid',
+                         dtype=object)
 
-        Returns the row index and the address's geoid as a string or None if it
-        can't be geocoded.
+    def _submit_geoids_to_processes(self, address_df):
+        """
+        Submits the addresses to the process pool as chunks and returns a
+        future for each row that's resolved once its chunk is geocoded.
+        Cancelling a row's future doesn't cancel its chunk.
+        """
+        row_futures = []
+        for chunk in self._split_into_chunks(address_df):
+            chunk_row_futures = [Future() for _ in chunk]
+            self._get_process_pool().submit(
+                _geocode_chunk, chunk).add_done_callback(functools.partial(
+                    _resolve_row_futures, chunk_row_futures))
+            row_futures.extend(chunk_row_futures)
+        return row_futures
+
+    def _split_into_chunks(self, address_df):
+        """
+        Splits the addresses into lists of at most GEOSUPPORT_CHUNK_SIZE
+        (house_number, street_name, zip_code) tuples
         """
-        index = address_row_tuple[0]
-        address_row = address_row_tuple[1]
-        try:
-            # Setting street_name_normalization='C' prevents the geocoder from
-            # padding the results for sorting/display purposes
-            result = self.geosupport.address(
-                house_number=address_row['house_number'],
-                street_name=address_row['street_name'],
-                zip_code=address_row['postal_code'],
-                street_name_normalization='C')
-            county_id = _BOROUGH_MAP.get(result.get('First Borough Name'))
-            tract_id = (result.get('2020 Census Tract') or
-                        result.get('2010 Census Tract') or
-                        result.get('2000 Census Tract') or
-                        result.get('1990 Census Tract'))
-            if county_id is None or tract_id is None:
-                return index, None
-            else:
-                return index, county_id + tract_id
-        except geosupport.error.GeosupportError:
-            return index, None
+        address_tuples = list(zip(*_address_columns(address_df)))
+        return [address_tuples[i:i + self.chunk_size]
+                for i in range(0, len(address_tuples), self.chunk_size)]
+
+    def _get_process_pool(self):
+        if self.process_pool is None:
+            # Workers are spawned rather than forked, since forking while
+            # other threads are running can leave the child holding their
+            # locks. Each worker then loads its own Geosupport instance.
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker)
+        return self.process_pool
+
+
+def _address_columns(address_df):
+    """
+    Returns the house_number, street_name, and postal_code columns as object
+    arrays
+    """
+    return [address_df[column].to_numpy(dtype=object)
+            for column in ('house_number', 'street_name', 'postal_code')]
+
+
+def _geocode(geosupport_instance, house_number, street_name, zip_code):
+    """
+    Sends a single address to the given Geosupport instance and returns its
+    geoid as a string or None if it can't be geocoded
+    """
+    try:
+        # Setting street_name_normalization='C' prevents the geocoder from
+        # padding the results for sorting/display purposes
+        result = geosupport_instance.address(
+            house_number=house_number, street_name=street_name,
+            zip_code=zip_code, street_name_normalization='C')
+        county_id = _BOROUGH_MAP.get(result.get('First Borough Name'))
+        tract_id = (result.get('2020 Census Tract') or
+                    result.get('2010 Census Tract') or
+                    result.get('2000 Census Tract') or
+                    result.get('1990 Census Tract'))
+        if county_id is None or tract_id is None:
+            return None
+        else:
+            return county_id + tract_id
+    except geosupport.error.GeosupportError:
+        return None
+
+
+def _init_worker():
+    global _worker_geosupport
+    _worker_geosupport = geosupport.Geosupport()
+
+
+def _geocode_chunk(address_tuples):
+    return [_geocode(_worker_geosupport, *address_tuple)
+            for address_tuple in address_tuples]
+
+
+def _resolve_row_futures(row_futures, chunk_future):
+    """
+    Sets the result of each row's future from its chunk's geoids, skipping
+    the rows whose futures have been cancelled
+    """
+    if chunk_future.cancelled():
+        for row_future in row_futures:
+            row_future.cancel()
+        return
+    error = chunk_future.exception()
+    for position, row_future in enumerate(row_futures):
+        if not row_future.set_running_or_notify_cancel():
+            continue
+        if error is not None:
+            row_future.set_exception(error)
+        else:
+            row_future.set_result(chunk_future.result()[position])
+
+
+class NycGeocoderClientError(Exception):
+    def __init__(self, message=None):
+        self.message = message
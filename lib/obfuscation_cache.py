@@ -0,0 +1,170 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import tempfile
+
+from collections import OrderedDict
+from nypl_py_utils.functions.log_helper import create_log
+
+# SQLite versions before 3.32 allow at most 999 variables per statement
+_SQLITE_CHUNK_SIZE = 900
+
+
+class ObfuscationCache:
+    """
+    Memoizes obfuscated values so that each plaintext only has to be run
+    through bcrypt once. Because the bcrypt salt is fixed, the obfuscated
+    value for a given plaintext never changes.
+
+    Values are stored in a local SQLite database keyed by an HMAC-SHA256
+    digest of the plaintext (keyed with the bcrypt salt), so the plaintext
+    patron ids and addresses are never written to disk. An in-memory LRU of
+    up to lru_size entries sits in front of the database.
+
+    If a snapshot_file is given, its entries are loaded into the database
+    when it is first opened and the database is written back to it when the
+    cache is closed, so that the cache can outlive the container.
+    """
+
+    def __init__(self, db_file, lru_size=100000, snapshot_file=None):
+        self.logger = create_log('obfuscation_cache')
+        self.db_file = db_file
+        self.lru_size = lru_size
+        self.snapshot_file = snapshot_file
+        self.digest_key = os.environ['BCRYPT_SALT'].encode()
+
+        self.conn = None
+        self.lru = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def obfuscate(self, inputs, obfuscate_all):
+        """
+        Returns the obfuscated value of every input, in order. Inputs that
+        aren't cached are passed as a list to obfuscate_all, which should
+        return their obfuscated values in the same order.
+        """
+        inputs = [str(value) for value in inputs]
+        digests = {value: self._digest(value) for value in inputs}
+        results = {}
+        for value, digest in digests.items():
+            if digest in self.lru:
+                self.lru.move_to_end(digest)
+                results[value] = self.lru[digest]
+        self.memory_hits += sum(value in results for value in inputs)
+
+        disk_results = self._fetch([digests[value] for value in digests
+                                    if value not in results])
+        for value, digest in digests.items():
+            if digest in disk_results:
+                results[value] = disk_results[digest]
+                self._remember(digest, results[value])
+        self.disk_hits += sum(digests[value] in disk_results
+                              for value in inputs)
+
+        missing = [value for value in digests if value not in results]
+        self.misses += sum(value not in results for value in inputs)
+        if missing:
+            obfuscated_values = obfuscate_all(missing)
+            self._store([(digests[value], obfuscated_value)
+                         for value, obfuscated_value
+                         in zip(missing, obfuscated_values)])
+            results.update(zip(missing, obfuscated_values))
+        return [results[value] for value in inputs]
+
+    def load_snapshot(self, snapshot_file):
+        """Copies every entry in the snapshot database into the cache"""
+        conn = self._get_connection()
+        conn.execute('ATTACH DATABASE ? AS snapshot;', (snapshot_file,))
+        try:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO obfuscations '
+                'SELECT digest, obfuscated FROM snapshot.obfuscations;')
+            conn.commit()
+            self.logger.info(
+                'Loaded ({count}) obfuscated values from snapshot {file}'
+                .format(count=cursor.rowcount, file=snapshot_file))
+        finally:
+            conn.execute('DETACH DATABASE snapshot;')
+
+    def save_snapshot(self, snapshot_file):
+        """
+        Writes a copy of the cache database to the snapshot file. The copy is
+        written to a temp file of its own first, so that writers saving the
+        same snapshot at the same time don't collide.
+        """
+        temp_fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(snapshot_file)),
+            prefix=os.path.basename(snapshot_file) + '.', suffix='.tmp')
+        os.close(temp_fd)
+        try:
+            self._get_connection().execute('VACUUM INTO ?;', (temp_file,))
+            os.replace(temp_file, snapshot_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    def log_stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        self.logger.info(
+            'Obfuscation cache: ({memory}) memory hits, ({disk}) disk hits, '
+            'and ({misses}) misses out of ({total}) lookups'.format(
+                memory=self.memory_hits, disk=self.disk_hits,
+                misses=self.misses, total=total))
+
+    def close(self):
+        """Logs the hit and miss counts and closes the database"""
+        if self.conn is None:
+            return
+        self.log_stats()
+        if self.snapshot_file is not None:
+            self.save_snapshot(self.snapshot_file)
+        self.conn.close()
+        self.conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _get_connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_file, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL;')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS obfuscations ('
+                'digest TEXT PRIMARY KEY, obfuscated TEXT NOT NULL);')
+            self.conn.commit()
+            if (self.snapshot_file is not None
+                    and os.path.exists(self.snapshot_file)):
+                self.load_snapshot(self.snapshot_file)
+        return self.conn
+
+    def _digest(self, value):
+        return hmac.new(self.digest_key, value.encode(),
+                        hashlib.sha256).hexdigest()
+
+    def _fetch(self, digests):
+        conn = self._get_connection()
+        results = {}
+        for i in range(0, len(digests), _SQLITE_CHUNK_SIZE):
+            chunk = digests[i:i + _SQLITE_CHUNK_SIZE]
+            results.update(conn.execute(
+                'SELECT digest, obfuscated FROM obfuscations '
+                'WHERE digest IN ({});'.format(','.join(['?'] * len(chunk))),
+                chunk).fetchall())
+        return results
+
+    def _store(self, rows):
+        conn = self._get_connection()
+        conn.executemany(
+            'INSERT OR REPLACE INTO obfuscations VALUES (?, ?);', rows)
+        conn.commit()
+        for digest, obfuscated_value in rows:
+            self._remember(digest, obfuscated_value)
+
+    def _remember(self, digest, obfuscated_value):
+        self.lru[digest] = obfuscated_value
+        self.lru.move_to_end(digest)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
@@ -0,0 +1,158 @@
+import math
+import multiprocessing
+import os
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ObfuscationEngine(ABC):
+    """
+    Base class for the engines that run an obfuscation function over a list
+    of values. Engines keep their workers between calls until closed.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    @abstractmethod
+    def map(self, fn, values):
+        """Returns [fn(value) for value in values], in order"""
+
+    def close(self):
+        pass
+
+
+class SerialObfuscationEngine(ObfuscationEngine):
+    """Obfuscates every value in the calling thread"""
+
+    def __init__(self):
+        super().__init__(1)
+
+    def map(self, fn, values):
+        return [fn(value) for value in values]
+
+
+class ThreadObfuscationEngine(ObfuscationEngine):
+    """
+    Obfuscates values in a pool of threads, one value per task. bcrypt
+    releases the GIL while hashing, but each task still pays for the Python
+    wrapper.
+
+    If given an ExecutorRegistry, the engine uses its shared cpu_hashing pool
+    rather than its own, and the registry is responsible for shutting it down.
+    """
+
+    def __init__(self, workers, executor_registry=None):
+        super().__init__(workers)
+        self.executor_registry = executor_registry
+        self.executor = None
+
+    def map(self, fn, values):
+        if self.executor_registry is not None:
+            return list(self.executor_registry.get('cpu_hashing').map(
+                fn, values))
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self.executor.map(fn, values))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class ProcessObfuscationEngine(ObfuscationEngine):
+    """
+    Obfuscates values in a pool of processes, spreading them evenly across
+    the workers in chunks of at most chunk_size values per task so that the
+    per-task overhead is spread over many hashes. fn must be picklable.
+    """
+
+    def __init__(self, workers, chunk_size):
+        super().__init__(workers)
+        self.chunk_size = chunk_size
+        self.executor = None
+
+    def map(self, fn, values):
+        values = list(values)
+        if len(values) <= 1 or self.workers <= 1:
+            return [fn(value) for value in values]
+        if self.executor is None:
+            # Workers are spawned rather than forked, since forking while
+            # other threads are running can leave the child holding their
+            # locks
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        chunk_size = min(math.ceil(len(values) / self.workers),
+                         self.chunk_size)
+        chunks = [values[i:i + chunk_size]
+                  for i in range(0, len(values), chunk_size)]
+        results = []
+        for chunk_results in self.executor.map(
+                _map_chunk, [fn] * len(chunks), chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def create_obfuscation_engine(executor_registry=None):
+    """
+    Creates the engine named by OBFUSCATION_ENGINE (serial, thread, or
+    process), with OBFUSCATION_WORKERS workers. The number of workers
+    defaults to the container's CPU quota. The thread engine uses the
+    executor_registry's cpu_hashing pool if one is given.
+    """
+    engine_name = os.environ.get('OBFUSCATION_ENGINE', 'thread')
+    workers = int(os.environ.get('OBFUSCATION_WORKERS', get_cpu_quota()))
+    if engine_name == 'serial':
+        return SerialObfuscationEngine()
+    elif engine_name == 'thread':
+        return ThreadObfuscationEngine(workers, executor_registry)
+    elif engine_name == 'process':
+        return ProcessObfuscationEngine(
+            workers, int(os.environ.get('OBFUSCATION_CHUNK_SIZE', 2000)))
+    raise ObfuscationEngineError(
+        'Unknown OBFUSCATION_ENGINE: {}'.format(engine_name))
+
+
+def get_cpu_quota(cgroup_dir='/sys/fs/cgroup'):
+    """
+    Returns the number of CPUs the container is allowed to use, based on its
+    cgroup CPU quota, rounded up. Falls back to the number of CPUs on the
+    host if there is no quota.
+    """
+    cpu_count = os.cpu_count() or 1
+    try:
+        with open(os.path.join(cgroup_dir, 'cpu.max'), 'r') as quota_file:
+            quota, period = quota_file.read().split()[:2]
+        if quota == 'max':
+            return cpu_count
+        quota, period = int(quota), int(period)
+    except (OSError, ValueError):
+        try:
+            with open(os.path.join(cgroup_dir, 'cpu', 'cpu.cfs_quota_us'),
+                      'r') as quota_file:
+                quota = int(quota_file.read())
+            with open(os.path.join(cgroup_dir, 'cpu', 'cpu.cfs_period_us'),
+                      'r') as period_file:
+                period = int(period_file.read())
+        except (OSError, ValueError):
+            return cpu_count
+    if quota <= 0 or period <= 0:
+        return cpu_count
+    return max(1, min(cpu_count, -(-quota // period)))
+
+
+def _map_chunk(fn, chunk):
+    return [fn(value) for value in chunk]
+
+
+class ObfuscationEngineError(Exception):
+    def __init__(self, message=None):
+        self.message = message
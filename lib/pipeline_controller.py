@@ -1,16 +1,29 @@
+import copy
 import json
 import os
 import pandas as pd
+import uuid
 
-from concurrent.futures import ThreadPoolExecutor
-from helpers.address_helper import reformat_malformed_address
+from helpers.address_helper import (canonicalize_address,
+                                    reformat_malformed_address)
 from helpers.pipeline_mode import PipelineMode
-from helpers.query_helper import (build_active_patrons_query,
+from helpers.query_helper import (REDSHIFT_MAX_QUERY_PARAMS,
+                                  build_active_patron_details_query,
+                                  build_active_patron_ids_query,
+                                  build_active_patrons_query,
                                   build_deleted_patrons_query,
                                   build_redshift_address_query,
+                                  build_redshift_drop_temp_table_query,
                                   build_redshift_iphlc_query,
-                                  build_redshift_patron_query)
-from lib import CensusGeocoderApiClient, NycGeocoderClient
+                                  build_redshift_patron_query,
+                                  build_redshift_temp_table_queries)
+from lib import (AsyncCensusGeocoderApiClient, CensusGeocoderApiClient,
+                 CensusGeocoderCircuitOpenError, DatabaseConnectionManager,
+                 GeocodeCache, NycGeocoderClient, ObfuscationCache)
+from lib.executor_registry import ExecutorRegistry
+from lib.geosupport_hedge import GeosupportHedge
+from lib.obfuscation_engine import create_obfuscation_engine
+from lib.zip_routing_index import ZipRoutingIndex
 from nypl_py_utils.classes.avro_encoder import AvroEncoder
 from nypl_py_utils.classes.kinesis_client import KinesisClient
 from nypl_py_utils.classes.postgresql_client import PostgreSQLClient
@@ -28,6 +41,16 @@ _SIERRA_COLUMNS = [
     'patron_id_plaintext', 'ptype_code', 'pcode3', 'patron_home_library_code',
     'city', 'region', 'postal_code', 'address', 'circ_active_date_et',
     'deletion_date_et', 'last_updated_timestamp', 'creation_timestamp']
+_SIERRA_ID_COLUMNS = [
+    'patron_id_plaintext', 'last_updated_timestamp', 'deletion_date_et',
+    'creation_timestamp']
+_CENSUS_ADDRESS_COLUMNS = ['address', 'city', 'region', 'postal_code']
+_NYC_ADDRESS_COLUMNS = ['house_number', 'street_name', 'postal_code']
+_GEOCODED_COLUMNS = ['patron_id', 'geoid', 'geocoding_deferred']
+_POLLER_STATE_FIELDS = {
+    PipelineMode.NEW_PATRONS: ['creation_dt', 'creation_id'],
+    PipelineMode.UPDATED_PATRONS: ['update_dt', 'update_id'],
+    PipelineMode.DELETED_PATRONS: ['deletion_date', 'deletion_id']}
 _DTYPE_MAP = {
     'patron_id': 'string',
     'address_hash': 'string',
@@ -47,14 +70,37 @@ class PipelineController:
     Class for orchestrating different types of pipeline runs. There are three
     modes: 1) checking for newly created patrons, 2) checking for recently
     updated patrons (who may or may not have changed their address), and 3)
-    checking for recently deleted patrons
+    checking for recently deleted patrons.
+
+    If the controller is given a poller_state_lock, it assumes other
+    controllers are running different modes at the same time and only updates
+    its own mode's fields of the cached poller state while holding the lock.
+    Those controllers should also share a ConcurrentSessionState, which
+    tracks the patrons processed by every mode. If it's given a
+    checkpoint_file, the poller state is read from and written to that local
+    JSON file instead of the S3 cache.
     """
 
-    def __init__(self, now):
+    def __init__(self, now, poller_state_lock=None, checkpoint_file=None,
+                 session_state=None):
         self.logger = create_log('pipeline_controller')
         self.now = now
+        self.poller_state_lock = poller_state_lock
+        self.session_state = session_state
+        self.checkpoint_file = checkpoint_file
 
-        self.census_geocoder_client = CensusGeocoderApiClient()
+        self.async_census_geocoder = os.environ.get(
+            'ASYNC_CENSUS_GEOCODER', False) == 'True'
+        self.census_geocoder_client = AsyncCensusGeocoderApiClient() if (
+            self.async_census_geocoder) else CensusGeocoderApiClient()
+        self.census_circuit_open_action = os.environ.get(
+            'GEOCODER_API_CIRCUIT_OPEN_ACTION', 'defer')
+        self.hedge_nyc_geocoding = os.environ.get(
+            'HEDGE_NYC_GEOCODING', False) == 'True'
+        self.zip_routing_index = ZipRoutingIndex(
+            os.environ.get('NYC_ZIP_CODES_FILE')) if (
+            os.environ.get('ROUTE_GEOCODING_BY_ZIP', False) == 'True' or
+            self.hedge_nyc_geocoding) else None
         self.nyc_geocoder_client = NycGeocoderClient()
         self.avro_encoder = AvroEncoder(os.environ['PATRON_INFO_SCHEMA_URL'])
         self.sierra_client = PostgreSQLClient(
@@ -66,12 +112,63 @@ class PipelineController:
             os.environ['REDSHIFT_DB_NAME'],
             os.environ['REDSHIFT_DB_USER'],
             os.environ['REDSHIFT_DB_PASSWORD'])
+        self.sierra_connection = DatabaseConnectionManager(
+            self.sierra_client, 'Sierra')
+        self.redshift_connection = DatabaseConnectionManager(
+            self.redshift_client, 'Redshift', autocommit=True)
 
         self.has_max_batches = 'MAX_BATCHES' in os.environ
-        self.ignore_cache = os.environ.get('IGNORE_CACHE', False) == 'True'
+        self.ignore_cache = os.environ.get(
+            'IGNORE_CACHE', False) == 'True' or checkpoint_file is not None
         self.ignore_kinesis = os.environ.get('IGNORE_KINESIS', False) == 'True'
+        self.sierra_fetch_size = int(os.environ['SIERRA_FETCH_SIZE']) if (
+            os.environ.get('SIERRA_FETCH_SIZE')) else None
+        self.two_phase_sierra_fetch = os.environ.get(
+            'TWO_PHASE_SIERRA_FETCH', False) == 'True'
+        self.prefetch_sierra_batches = os.environ.get(
+            'PREFETCH_SIERRA_BATCHES', False) == 'True'
+        self.redshift_temp_table_threshold = int(os.environ.get(
+            'REDSHIFT_TEMP_TABLE_THRESHOLD', 10000))
+        if self.redshift_temp_table_threshold > REDSHIFT_MAX_QUERY_PARAMS:
+            raise PipelineControllerError(
+                'REDSHIFT_TEMP_TABLE_THRESHOLD must be at most {}, the most '
+                'parameters Redshift accepts in a query'.format(
+                    REDSHIFT_MAX_QUERY_PARAMS))
+        self.obfuscation_cache = ObfuscationCache(
+            os.environ['OBFUSCATION_CACHE_FILE'],
+            int(os.environ.get('OBFUSCATION_CACHE_LRU_SIZE', 100000)),
+            os.environ.get('OBFUSCATION_CACHE_SNAPSHOT_FILE')) if (
+            os.environ.get('OBFUSCATION_CACHE_FILE')) else None
+        self.geocode_cache = GeocodeCache(
+            os.environ['GEOCODE_CACHE_FILE'],
+            int(os.environ.get('GEOCODE_CACHE_TTL_SECONDS', 7776000)),
+            int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', 1000000)),
+            int(os.environ.get('GEOCODE_NEGATIVE_CACHE_TTL_SECONDS',
+                               604800))) if (
+            os.environ.get('GEOCODE_CACHE_FILE')) else None
+        self.executor_registry = ExecutorRegistry()
+        self.obfuscation_engine = create_obfuscation_engine(
+            self.executor_registry)
         self.poller_state = None
         self.processed_ids = set()
+        self.geocoding_deferred = False
+        self.prefetch_executor = None
+        self.prefetched_batch = None
+
+        # Prefetched batches are queried on their own connection so that they
+        # can run while the main connection is in use
+        if self.prefetch_sierra_batches and self.sierra_fetch_size is not None:
+            self.logger.warning(
+                'Sierra batches are not prefetched when SIERRA_FETCH_SIZE is '
+                'set, as prefetching requires holding the full batch')
+            self.prefetch_sierra_batches = False
+        if self.prefetch_sierra_batches:
+            self.prefetch_sierra_connection = DatabaseConnectionManager(
+                PostgreSQLClient(
+                    os.environ['SIERRA_DB_HOST'], os.environ['SIERRA_DB_PORT'],
+                    os.environ['SIERRA_DB_NAME'], os.environ['SIERRA_DB_USER'],
+                    os.environ['SIERRA_DB_PASSWORD']),
+                'Sierra prefetch')
 
         if not self.ignore_cache:
             self.s3_client = S3Client(
@@ -87,11 +184,20 @@ class PipelineController:
             raise PipelineControllerError(
                 'run_pipeline called with bad pipeline mode: {}'.format(mode))
 
+        if self.prefetch_sierra_batches:
+            self.prefetch_executor = self.executor_registry.get('blocking_io')
+
         batch_number = 1
         finished = False
+        self.geocoding_deferred = False
         while not finished:
             # Retrieve the query parameters to use for this batch
             self.poller_state = self._get_poller_state(batch_number)
+            if (self.session_state is not None and
+                    mode == PipelineMode.NEW_PATRONS):
+                self.session_state.set_new_patrons_cursor(
+                    self.poller_state['creation_dt'],
+                    self.poller_state.get('creation_id', 0))
 
             # Process the data
             self.logger.info(
@@ -99,22 +205,22 @@ class PipelineController:
                 '{state}'.format(
                     mode=mode, batch=batch_number, state=self.poller_state))
             if mode == PipelineMode.DELETED_PATRONS:
-                last_record = self._run_deleted_patrons_single_iteration()
+                last_record, patron_count = \
+                    self._run_deleted_patrons_single_iteration()
             else:
-                last_record = self._run_active_patrons_single_iteration(mode)
+                last_record, patron_count = \
+                    self._run_active_patrons_single_iteration(mode)
             self.logger.info(
                 'Finished processing {mode} patrons batch {batch}'.format(
                     mode=mode, batch=batch_number))
+            self.executor_registry.log_stats()
+            if self.geocode_cache is not None:
+                self.geocode_cache.log_stats()
 
             # Cache the new state in S3 if necessary and check for more records
             if last_record is not None:
                 self._set_poller_state(mode, last_record)
-                if mode == PipelineMode.DELETED_PATRONS:
-                    no_more_records = (last_record.name + 1) < int(
-                        os.environ['DELETED_PATRON_BATCH_SIZE'])
-                else:
-                    no_more_records = (last_record.name + 1) < int(
-                        os.environ['ACTIVE_PATRON_BATCH_SIZE'])
+                no_more_records = patron_count < self._get_batch_size(mode)
             else:
                 no_more_records = True
 
@@ -122,11 +228,31 @@ class PipelineController:
             reached_max_batches = self.has_max_batches and batch_number >= int(
                 os.environ['MAX_BATCHES'])
             finished = reached_max_batches or no_more_records
+            if self.geocoding_deferred:
+                self.logger.warning(
+                    'Ending {} patrons session early -- the remaining patrons '
+                    'will be processed once the census geocoder is '
+                    'available'.format(mode))
+                finished = True
             batch_number += 1
 
         self.logger.info((
             'Finished processing {mode} patrons session with {batch} batches, '
-            'closing AWS connections').format(mode=mode, batch=batch_number-1))
+            'closing connections').format(mode=mode, batch=batch_number-1))
+        if self.prefetch_executor is not None:
+            self._discard_prefetched_batch()
+            self.prefetch_executor = None
+            self.prefetch_sierra_connection.close()
+        self.sierra_connection.close()
+        self.redshift_connection.close()
+        self.obfuscation_engine.close()
+        self.executor_registry.shutdown()
+        self.census_geocoder_client.close()
+        self.nyc_geocoder_client.close()
+        if self.obfuscation_cache is not None:
+            self.obfuscation_cache.close()
+        if self.geocode_cache is not None:
+            self.geocode_cache.close()
         if not self.ignore_cache:
             self.s3_client.close()
         if not self.ignore_kinesis:
@@ -135,46 +261,58 @@ class PipelineController:
     def _run_active_patrons_single_iteration(self, mode):
         """
         Runs the full pipeline a single time for either newly created
-        patrons or for recently updated patrons
-        """
-        # Get data from Sierra
-        query = build_active_patrons_query(mode, self.poller_state, self.now)
-        self.sierra_client.connect()
-        sierra_raw_data = self.sierra_client.execute_query(query)
-        self.sierra_client.close_connection()
-        unprocessed_sierra_df = pd.DataFrame(
-            data=sierra_raw_data, columns=_SIERRA_COLUMNS)
-        unprocessed_sierra_df['patron_id_plaintext'] = unprocessed_sierra_df[
-            'patron_id_plaintext'].astype('Int64').astype('string')
+        patrons or for recently updated patrons.
 
-        # Check that the number of records with the same timestamp does not
-        # exceed the batch size, which would cause the poller to stall.
-        if len(unprocessed_sierra_df) == int(
-            os.environ['ACTIVE_PATRON_BATCH_SIZE']) and (
-            (mode == PipelineMode.NEW_PATRONS and
-                min(unprocessed_sierra_df['creation_timestamp']) ==
-                max(unprocessed_sierra_df['creation_timestamp'])) or
-            (mode == PipelineMode.UPDATED_PATRONS and
-                min(unprocessed_sierra_df['last_updated_timestamp']) ==
-                max(unprocessed_sierra_df['last_updated_timestamp']))):
-            self.logger.error('Too many records found with the same timestamp')
-            raise PipelineControllerError(
-                'Too many records found with the same timestamp')
+        Returns the last Sierra record in the batch (or None if there were no
+        records) and the number of patrons in the batch.
+        """
+        if self.two_phase_sierra_fetch:
+            sierra_dfs = self._query_sierra_two_phase(mode)
+        else:
+            query, query_params = self._build_active_patrons_query(
+                mode, self.poller_state)
+            sierra_dfs = self._query_sierra(
+                query, query_params, _SIERRA_COLUMNS)
+
+        last_record = None
+        patron_count = 0
+        for unprocessed_sierra_df in sierra_dfs:
+            self._prefetch_next_batch(mode, unprocessed_sierra_df)
+            processed_record = self._process_active_patrons(
+                mode, unprocessed_sierra_df)
+            if processed_record is not None:
+                last_record = processed_record
+            patron_count += unprocessed_sierra_df[
+                'patron_id_plaintext'].nunique()
+            if self.geocoding_deferred:
+                break
+        return last_record, patron_count
 
+    def _process_active_patrons(self, mode, unprocessed_sierra_df):
+        """
+        Runs a dataframe of newly created or recently updated patrons from
+        Sierra through the rest of the pipeline and returns its last record.
+        If the geocoding of any patron was deferred, that patron and every
+        patron after it are held back, and the last record before them (or
+        None) is returned instead.
+        """
         # Remove records for any patron ids that have already been processed
-        unseen_records_mask = ~unprocessed_sierra_df[
-            'patron_id_plaintext'].isin(self.processed_ids)
+        # by a different pipeline mode during this session
+        unseen_records_mask = self._unprocessed_mask(
+            mode, unprocessed_sierra_df)
         processed_df = unprocessed_sierra_df[unseen_records_mask].reset_index(
             drop=True)
 
-        # If there are no unprocessed patron ids left, return. Otherwise,
-        # update the total set of processed ids.
+        # If there are no unprocessed patron ids left, move the cursor past
+        # this batch. Otherwise, update the total set of processed ids.
+        last_record = unprocessed_sierra_df.iloc[-1]
         if len(processed_df) == 0:
-            return None
-        self.processed_ids.update(processed_df['patron_id_plaintext'])
+            return last_record
+        self._add_processed_ids(processed_df['patron_id_plaintext'])
 
-        # Reduce the dataframe to only one row per patron_id, keeping the row
-        # with the lowest display_order and patron_record_address_type_id
+        # Sierra returns the address with the lowest display_order and
+        # patron_record_address_type_id for each patron, so this only guards
+        # against a patron appearing more than once
         distinct_records_mask = ~processed_df.duplicated('patron_id_plaintext',
                                                          keep='first')
         processed_df = processed_df[distinct_records_mask].reset_index(
@@ -192,9 +330,8 @@ class PipelineController:
             processed_df['city'].fillna('') + '_' +
             processed_df['region'].fillna('') + '_' +
             processed_df['postal_code'].fillna('')).astype('string')
-        with ThreadPoolExecutor() as executor:
-            processed_df['address_hash'] = list(executor.map(
-                obfuscate, processed_df['address_hash_plaintext']))
+        processed_df['address_hash'] = self._obfuscate(
+            processed_df['address_hash_plaintext'])
 
         # For every (patron id + address) hash found in Redshift, use the geoid
         # and obfuscated patron id found there
@@ -214,8 +351,20 @@ class PipelineController:
             ['address', 'city', 'region', 'postal_code',
              'patron_id_plaintext']]
         if len(unknown_patrons_df) > 0:
-            geocoded_df = self._process_unknown_patrons(unknown_patrons_df)
-            processed_df.update(geocoded_df)
+            geocoded_future = None
+            if self.async_census_geocoder:
+                # Geocode in the background while the initial patron home
+                # library codes are looked up in Redshift
+                address_df = self._obfuscate_unknown_patrons(
+                    unknown_patrons_df)
+                processed_df.update(address_df[['patron_id']])
+                geocoded_future = self.executor_registry.get(
+                    'blocking_io').submit(self._geocode_unknown_patrons,
+                                          address_df)
+            else:
+                geocoded_df = self._process_unknown_patrons(
+                    unknown_patrons_df)
+                processed_df.update(geocoded_df)
             if mode == PipelineMode.UPDATED_PATRONS:
                 unknown_iphlc_mask = pd.isnull(
                     processed_df['initial_patron_home_library_code'])
@@ -225,6 +374,16 @@ class PipelineController:
                                  'initial_patron_home_library_code'] = \
                     processed_df.loc[unknown_iphlc_mask, 'patron_id'].map(
                         iphlc_map)
+            if geocoded_future is not None:
+                geocoded_df = geocoded_future.result()
+                processed_df.update(geocoded_df)
+            deferred_mask = geocoded_df['geocoding_deferred'].reindex(
+                processed_df.index, fill_value=False)
+            if deferred_mask.any():
+                processed_df, last_record = self._hold_back_deferred_patrons(
+                    unprocessed_sierra_df, processed_df, deferred_mask)
+                if len(processed_df) == 0:
+                    return last_record
 
         # Modify the data to match what's expected by the PatronInfo Avro
         # schema, encode it, and send it to Kinesis
@@ -243,52 +402,74 @@ class PipelineController:
         if not self.ignore_kinesis:
             self.kinesis_client.send_records(encoded_records)
 
-        return unprocessed_sierra_df.iloc[-1]
+        return last_record
+
+    def _hold_back_deferred_patrons(self, unprocessed_sierra_df, processed_df,
+                                    deferred_mask):
+        """
+        Drops the first patron whose geocoding was deferred, and every patron
+        after it, from processed_df so that they're processed by a later run.
+        Returns the remaining patrons and the last Sierra record before the
+        first held back patron (or None if there isn't one).
+        """
+        first_deferred = deferred_mask.to_numpy().argmax()
+        held_back_ids = processed_df['patron_id_plaintext'].iloc[
+            first_deferred:]
+        self.logger.warning(
+            'Census geocoder circuit is open -- holding back ({}) patrons '
+            'until it is available'.format(len(held_back_ids)))
+        self.geocoding_deferred = True
+        self._discard_processed_ids(held_back_ids)
+        first_held_back = unprocessed_sierra_df['patron_id_plaintext'].eq(
+            held_back_ids.iloc[0]).to_numpy().argmax()
+        last_record = unprocessed_sierra_df.iloc[first_held_back - 1] if (
+            first_held_back > 0) else None
+        return processed_df.iloc[:first_deferred], last_record
 
     def _run_deleted_patrons_single_iteration(self):
         """
-        Runs the full pipeline a single time for recently deleted patrons
-        """
-        # Get data from Sierra
-        query = build_deleted_patrons_query(self.poller_state['deletion_date'],
-                                            self.now)
-        self.sierra_client.connect()
-        sierra_raw_data = self.sierra_client.execute_query(query)
-        self.sierra_client.close_connection()
-        unprocessed_sierra_df = pd.DataFrame(
-            data=sierra_raw_data,
-            columns=['patron_id_plaintext', 'deletion_date_et'])
-        unprocessed_sierra_df['patron_id_plaintext'] = unprocessed_sierra_df[
-            'patron_id_plaintext'].astype('Int64').astype('string')
+        Runs the full pipeline a single time for recently deleted patrons.
 
-        # Check that the number of records with the same date does not exceed
-        # the batch size, which would cause the poller to stall.
-        if len(unprocessed_sierra_df) == int(
-                os.environ['DELETED_PATRON_BATCH_SIZE']) and (
-            min(unprocessed_sierra_df['deletion_date_et']) ==
-                max(unprocessed_sierra_df['deletion_date_et'])):
-            self.logger.error('Too many records found with the same date')
-            raise PipelineControllerError(
-                'Too many records found with the same date')
+        Returns the last Sierra record in the batch (or None if there were no
+        records) and the number of patrons in the batch.
+        """
+        query, query_params = build_deleted_patrons_query(
+            self.poller_state['deletion_date'],
+            self.poller_state.get('deletion_id', 0), self.now)
+        last_record = None
+        patron_count = 0
+        for unprocessed_sierra_df in self._query_sierra(
+                query, query_params,
+                ['patron_id_plaintext', 'deletion_date_et']):
+            self._prefetch_next_batch(
+                PipelineMode.DELETED_PATRONS, unprocessed_sierra_df)
+            last_record = self._process_deleted_patrons(unprocessed_sierra_df)
+            patron_count += len(unprocessed_sierra_df)
+        return last_record, patron_count
 
+    def _process_deleted_patrons(self, unprocessed_sierra_df):
+        """
+        Runs a dataframe of recently deleted patrons from Sierra through the
+        rest of the pipeline and returns its last record
+        """
         # Remove records for any patron ids that have already been processed
-        unseen_records_mask = ~unprocessed_sierra_df[
-            'patron_id_plaintext'].isin(self.processed_ids)
+        # by a different pipeline mode during this session
+        unseen_records_mask = self._unprocessed_mask(
+            PipelineMode.DELETED_PATRONS, unprocessed_sierra_df)
         processed_df = unprocessed_sierra_df[unseen_records_mask].reset_index(
             drop=True)
 
-        # If there are no unprocessed patron ids left, return. Otherwise,
-        # update the total set of processed ids
+        # If there are no unprocessed patron ids left, move the cursor past
+        # this batch. Otherwise, update the total set of processed ids
         if len(processed_df) == 0:
-            return None
-        self.processed_ids.update(processed_df['patron_id_plaintext'])
+            return unprocessed_sierra_df.iloc[-1]
+        self._add_processed_ids(processed_df['patron_id_plaintext'])
 
         # Obfuscate the patron ids using bcrypt
         self.logger.info('Obfuscating ({}) patron ids'.format(
             len(processed_df)))
-        with ThreadPoolExecutor() as executor:
-            processed_df['patron_id'] = list(executor.map(
-                obfuscate, processed_df['patron_id_plaintext']))
+        processed_df['patron_id'] = self._obfuscate(
+            processed_df['patron_id_plaintext'])
 
         # Take the existing data in Redshift for each deleted patron and merge
         # it with the deletion date
@@ -308,19 +489,206 @@ class PipelineController:
 
         return unprocessed_sierra_df.iloc[-1]
 
+    def _unprocessed_mask(self, mode, sierra_df):
+        """
+        Returns whether each record's patron id hasn't been processed by any
+        pipeline mode this session. When modes run concurrently, updated
+        patrons created after the new patrons mode's cursor are also skipped,
+        since that mode will process them, as it would have already if the
+        modes were run one after another.
+        """
+        if self.session_state is None:
+            return ~sierra_df['patron_id_plaintext'].isin(self.processed_ids)
+        unseen_mask = self.session_state.unseen_mask(
+            sierra_df['patron_id_plaintext'])
+        if mode == PipelineMode.UPDATED_PATRONS:
+            unseen_mask &= ~self.session_state.pending_new_patrons_mask(
+                sierra_df)
+        return unseen_mask
+
+    def _add_processed_ids(self, patron_ids):
+        if self.session_state is None:
+            self.processed_ids.update(patron_ids)
+        else:
+            self.session_state.add_processed_ids(patron_ids)
+
+    def _discard_processed_ids(self, patron_ids):
+        if self.session_state is None:
+            self.processed_ids.difference_update(patron_ids)
+        else:
+            self.session_state.discard_processed_ids(patron_ids)
+
+    def _obfuscate(self, values):
+        """
+        Obfuscates every value using bcrypt, first checking the obfuscation
+        cache if there is one
+        """
+        if self.obfuscation_cache is None:
+            return self._obfuscate_uncached(values)
+        return self.obfuscation_cache.obfuscate(
+            values, self._obfuscate_uncached)
+
+    def _obfuscate_uncached(self, values):
+        return self.obfuscation_engine.map(obfuscate, values)
+
+    def _query_sierra(self, query, query_params, columns):
+        """
+        Queries Sierra with the parameterized query and yields the results as
+        dataframes. By default the
+        full result set is fetched at once and yielded as a single dataframe.
+        If SIERRA_FETCH_SIZE is set, the results are instead streamed from a
+        server-side cursor and yielded in dataframes of at most that many
+        rows so that memory use does not grow with the batch size. The
+        dataframes are indexed by their position in the full result set.
+        """
+        if self.sierra_fetch_size is None:
+            sierra_raw_data = self._fetch_sierra_batch(query, query_params)
+            if len(sierra_raw_data) > 0:
+                yield self._build_sierra_df(sierra_raw_data, columns, 0)
+            return
+
+        # The cursor is held past the end of the transaction so that Sierra
+        # does not drop the session for being idle in a transaction while a
+        # chunk is being geocoded
+        self.logger.info(
+            'Streaming Sierra results in chunks of {}'.format(
+                self.sierra_fetch_size))
+        sierra_conn = self.sierra_connection.acquire().conn
+        cursor = sierra_conn.cursor(
+            name='patron_info_poller_cursor', withhold=True)
+        try:
+            cursor.execute(query, query_params)
+            sierra_conn.commit()
+            rows_fetched = 0
+            while True:
+                sierra_raw_data = cursor.fetchmany(self.sierra_fetch_size)
+                if len(sierra_raw_data) == 0:
+                    break
+                yield self._build_sierra_df(
+                    sierra_raw_data, columns, rows_fetched)
+                rows_fetched += len(sierra_raw_data)
+        finally:
+            cursor.close()
+
+    def _query_sierra_two_phase(self, mode):
+        """
+        Queries Sierra in two phases: first for only the ids and timestamps of
+        the next batch of patrons, and then for the full data of only those
+        patrons that haven't already been processed this session. Yields
+        dataframes with the same rows and columns as a single query would,
+        except that the rows for already processed patrons only contain their
+        ids and timestamps.
+        """
+        query, query_params = self._build_active_patrons_query(
+            mode, self.poller_state)
+        for patron_ids_df in self._query_sierra(
+                query, query_params, _SIERRA_ID_COLUMNS):
+            unseen_ids = patron_ids_df.loc[
+                self._unprocessed_mask(mode, patron_ids_df),
+                'patron_id_plaintext']
+            self.logger.info(
+                'Querying Sierra for ({unseen}/{total}) unprocessed '
+                'patrons'.format(unseen=len(unseen_ids),
+                                 total=len(patron_ids_df)))
+            if len(unseen_ids) == 0:
+                yield patron_ids_df.reindex(columns=_SIERRA_COLUMNS)
+                continue
+
+            # The cursor is based on the timestamps from the first phase, so
+            # those are kept in case a record changed between the two queries
+            details_query, details_query_params = \
+                build_active_patron_details_query(mode, unseen_ids)
+            sierra_raw_data = self.sierra_connection.execute_query(
+                details_query, details_query_params, prepare=True)
+            details_df = self._build_sierra_df(
+                sierra_raw_data, _SIERRA_COLUMNS, 0).drop(
+                columns=_SIERRA_ID_COLUMNS[1:])
+            sierra_df = patron_ids_df.merge(
+                details_df, how='left', on='patron_id_plaintext')
+            sierra_df.index = patron_ids_df.index
+            yield sierra_df[_SIERRA_COLUMNS]
+
+    def _build_active_patrons_query(self, mode, poller_state):
+        if self.two_phase_sierra_fetch:
+            return build_active_patron_ids_query(mode, poller_state, self.now)
+        else:
+            return build_active_patrons_query(mode, poller_state, self.now)
+
+    def _fetch_sierra_batch(self, query, query_params):
+        """
+        Returns the full results of the query, using the prefetched batch if
+        it was prefetched for the same query and parameters. The query is
+        prepared on the server, since only its parameters change from batch
+        to batch.
+        """
+        if self.prefetched_batch is not None:
+            prefetched_query, prefetched_future = self.prefetched_batch
+            self.prefetched_batch = None
+            if prefetched_query == (query, query_params):
+                self.logger.info('Using prefetched Sierra batch')
+                return prefetched_future.result()
+            self.logger.warning(
+                'Poller state does not match the prefetched Sierra batch -- '
+                'discarding it')
+            prefetched_future.cancel()
+        return self.sierra_connection.execute_query(
+            query, query_params, prepare=True)
+
+    def _prefetch_next_batch(self, mode, sierra_df):
+        """
+        If prefetching is enabled and the batch was full, starts querying
+        Sierra for the batch after sierra_df in the background. The query is
+        built from the state that will be cached once sierra_df is processed,
+        so the prefetched batch is only used if that state is committed.
+        """
+        if self.prefetch_executor is None or sierra_df[
+                'patron_id_plaintext'].nunique() < self._get_batch_size(mode):
+            return
+
+        next_state = self._get_next_poller_state(mode, sierra_df.iloc[-1])
+        if mode == PipelineMode.DELETED_PATRONS:
+            query, query_params = build_deleted_patrons_query(
+                next_state['deletion_date'], next_state['deletion_id'],
+                self.now)
+        else:
+            query, query_params = self._build_active_patrons_query(
+                mode, next_state)
+        self.logger.info('Prefetching next Sierra batch')
+        self.prefetched_batch = ((query, query_params),
+                                 self.prefetch_executor.submit(
+            self.prefetch_sierra_connection.execute_query, query,
+            query_params, prepare=True))
+
+    def _get_batch_size(self, mode):
+        if mode == PipelineMode.DELETED_PATRONS:
+            return int(os.environ['DELETED_PATRON_BATCH_SIZE'])
+        else:
+            return int(os.environ['ACTIVE_PATRON_BATCH_SIZE'])
+
+    def _discard_prefetched_batch(self):
+        if self.prefetched_batch is not None:
+            prefetched_future = self.prefetched_batch[1]
+            self.prefetched_batch = None
+            if not prefetched_future.cancel():
+                # Wait for the unused query so its connection can be closed
+                prefetched_future.exception()
+
+    def _build_sierra_df(self, sierra_raw_data, columns, start_index):
+        sierra_df = pd.DataFrame(
+            data=sierra_raw_data, columns=columns, index=pd.RangeIndex(
+                start_index, start_index + len(sierra_raw_data)))
+        sierra_df['patron_id_plaintext'] = sierra_df[
+            'patron_id_plaintext'].astype('Int64').astype('string')
+        return sierra_df
+
     def _find_known_addresses(self, all_patrons_df):
         """
         Checks if any of the (patron id + address) hashes already appear in
         Redshift. If they do, take the geoid and obfuscated patron id from
         Redshift and join it with the original Sierra dataframe.
         """
-        address_hashes_str = "','".join(
-            all_patrons_df['address_hash'].to_string(index=False).split())
-        address_hashes_str = "'" + address_hashes_str + "'"
-        self.redshift_client.connect()
-        redshift_raw_data = self.redshift_client.execute_query(
-            build_redshift_address_query(address_hashes_str))
-        self.redshift_client.close_connection()
+        redshift_raw_data = self._query_redshift(
+            build_redshift_address_query, all_patrons_df['address_hash'])
         redshift_df = pd.DataFrame(
             data=redshift_raw_data, dtype='string',
             columns=['address_hash', 'patron_id', 'geoid',
@@ -335,13 +703,8 @@ class PipelineController:
         Finds the Redshift data for recently deleted patrons and joins it with
         the deletion date from Sierra.
         """
-        patron_ids_str = "','".join(
-            deleted_patrons_df['patron_id'].to_string(index=False).split())
-        patron_ids_str = "'" + patron_ids_str + "'"
-        self.redshift_client.connect()
-        redshift_raw_data = self.redshift_client.execute_query(
-            build_redshift_patron_query(patron_ids_str))
-        self.redshift_client.close_connection()
+        redshift_raw_data = self._query_redshift(
+            build_redshift_patron_query, deleted_patrons_df['patron_id'])
         redshift_df = pd.DataFrame(
             data=redshift_raw_data, columns=_REDSHIFT_COLUMNS)
 
@@ -349,21 +712,62 @@ class PipelineController:
                                                    on='patron_id')
         return full_patrons_df
 
+    def _query_redshift(self, build_query, keys):
+        """
+        Looks up the distinct keys in Redshift using the given query builder.
+        Up to REDSHIFT_TEMP_TABLE_THRESHOLD keys are sent as an IN list. Above
+        that, the keys are loaded into a session temp table in chunks and
+        joined against, which keeps very large statements off the leader node.
+        """
+        keys = list(dict.fromkeys(keys))
+        if len(keys) <= self.redshift_temp_table_threshold:
+            return self.redshift_connection.execute_parameterized_query(
+                *build_query(keys))
+
+        self.logger.info(
+            'Loading ({}) keys into a Redshift temp table'.format(len(keys)))
+        temp_table = 'lookup_keys_{}'.format(uuid.uuid4().hex)
+
+        def _query_with_temp_table(client):
+            client.execute_transaction(
+                build_redshift_temp_table_queries(temp_table, keys))
+            try:
+                return client.execute_query(
+                    build_query(keys, temp_table=temp_table)[0])
+            finally:
+                client.execute_transaction([
+                    (build_redshift_drop_temp_table_query(temp_table), None)])
+
+        return self.redshift_connection.run_with_retry(_query_with_temp_table)
+
     def _process_unknown_patrons(self, unknown_patrons_df):
         """
         Takes a dataframe of patrons whose addresses have not already been
-        geocoded, obfuscates their patron ids, sends them to the census
-        geocoder API and then, if that's unsuccessful, to the NYC geocoder.
+        geocoded, obfuscates their patron ids, and geocodes their addresses
+        (using the geocode cache if there is one).
+        """
+        return self._geocode_unknown_patrons(
+            self._obfuscate_unknown_patrons(unknown_patrons_df))
+
+    def _obfuscate_unknown_patrons(self, unknown_patrons_df):
+        """
+        Returns a copy of the dataframe with the patron ids obfuscated using
+        bcrypt
         """
-        # Obfuscate the patron ids using bcrypt
         address_df = unknown_patrons_df.copy()
         self.logger.info('Obfuscating ({}) patron ids'.format(
             len(address_df)))
-        with ThreadPoolExecutor() as executor:
-            address_df['patron_id'] = list(executor.map(
-                obfuscate, address_df['patron_id_plaintext']))
+        address_df['patron_id'] = self._obfuscate(
+            address_df['patron_id_plaintext'])
+        return address_df
 
-        # Get geoids from census geocoder API
+    def _geocode_unknown_patrons(self, address_df):
+        """
+        Takes a dataframe of patrons with obfuscated patron ids and returns
+        their patron ids, their geoids, and whether their geocoding was
+        deferred because the census geocoder's circuit breaker was open
+        """
+        address_df = address_df.copy()
         address_df[['address', 'city', 'region', 'postal_code']] = address_df[
             ['address', 'city', 'region', 'postal_code']].replace(
             r'\'|"|\\', '', regex=True).fillna('')
@@ -371,10 +775,146 @@ class PipelineController:
             address_df['address'] + ' ' + address_df['city'] + ' ' +
             address_df['region'] + ' ' + address_df['postal_code']).str.strip()
         input_df = address_df[address_df['full_address'].str.len() > 0]
+        address_df['geocoding_deferred'] = False
         if len(input_df) == 0:
             address_df['geoid'] = None
-            return address_df[['patron_id', 'geoid']]
-        geoids = self.census_geocoder_client.get_geoids(input_df)
+            return address_df[_GEOCODED_COLUMNS]
+
+        if self.geocode_cache is None:
+            address_df['geoid'], deferred_indices = self._geocode_addresses(
+                input_df)
+            address_df.loc[deferred_indices, 'geocoding_deferred'] = True
+            return address_df[_GEOCODED_COLUMNS]
+
+        # Only geocode the addresses that aren't already in the geocode cache
+        # and haven't recently failed to geocode, and then cache the results
+        address_keys = input_df.apply(
+            lambda row: canonicalize_address(
+                row['address'], row['city'], row['region'],
+                row['postal_code']), axis=1)
+        cached_geoids = self.geocode_cache.get_geoids(address_keys)
+        geoids = address_keys.map(cached_geoids).astype(object)
+        uncached_keys = address_keys[geoids.isnull()]
+        failed_keys = self.geocode_cache.get_failures(uncached_keys)
+        uncached_keys = uncached_keys[~uncached_keys.isin(failed_keys)]
+        if len(uncached_keys) > 0:
+            new_geoids, bypassed_indices = self._geocode_addresses(
+                input_df.loc[uncached_keys.index])
+            new_geoids = new_geoids.reindex(uncached_keys.index)
+            geoids.update(new_geoids)
+            address_df.loc[bypassed_indices, 'geocoding_deferred'] = True
+            # Addresses that weren't sent to the census geocoder because its
+            # circuit was open aren't known failures
+            geocoded_mask = new_geoids.notnull()
+            failed_mask = ~geocoded_mask & ~new_geoids.index.isin(
+                bypassed_indices)
+            self.geocode_cache.set_geoids(dict(zip(
+                uncached_keys[geocoded_mask], new_geoids[geocoded_mask])))
+            self.geocode_cache.set_failures(list(uncached_keys[failed_mask]))
+        address_df['geoid'] = geoids
+        return address_df[_GEOCODED_COLUMNS]
+
+    def _geocode_addresses(self, input_df):
+        """
+        Geocodes the addresses and returns a series of geoids (or None)
+        indexed to match input_df, along with the indices of any addresses
+        that couldn't be sent to the census geocoder because its circuit
+        breaker was open.
+
+        By default, addresses are sent to the census geocoder API and then,
+        if that's unsuccessful, to the NYC geocoder. If there is a ZIP routing
+        index, addresses with NYC ZIP codes are instead sent to the NYC
+        geocoder first, and only the addresses it can't geocode and those
+        outside NYC are sent to the census geocoder. In hedged mode, NYC
+        addresses are sent to both geocoders at the same time instead.
+        """
+        if self.hedge_nyc_geocoding:
+            return self._geocode_hedged_addresses(input_df)
+        if self.zip_routing_index is None:
+            return self._geocode_with_census_geocoder(input_df, True)
+
+        nyc_mask = self.zip_routing_index.is_nyc(input_df['postal_code'])
+        self.logger.info(
+            'Routing ({nyc}) NYC addresses to the NYC geocoder first and '
+            '({other}) other addresses to the census geocoder'.format(
+                nyc=nyc_mask.sum(), other=(~nyc_mask).sum()))
+        geoids = pd.Series(None, index=input_df.index, dtype=object)
+        if nyc_mask.any():
+            geoids = self._geocode_routable_addresses(
+                input_df[nyc_mask].apply(reformat_malformed_address, axis=1),
+                geoids)
+        census_df = input_df[geoids.isnull()]
+        if len(census_df) == 0:
+            return geoids, pd.Index([])
+        census_geoids, bypassed_indices = self._geocode_with_census_geocoder(
+            census_df, False)
+        geoids.update(census_geoids)
+        return geoids, bypassed_indices
+
+    def _geocode_hedged_addresses(self, input_df):
+        """
+        Sends the routable addresses with NYC ZIP codes to the NYC geocoder
+        and, in the background, to the census geocoder API at the same time,
+        so that a slow census geocoder doesn't hold up addresses the NYC
+        geocoder can geocode on its own. Each NYC address is given whichever
+        valid geoid comes back first. The other addresses are sent to the
+        census geocoder API meanwhile. Returns the geoids and the indices of
+        the addresses that couldn't be geocoded because the census
+        geocoder's circuit breaker was open.
+        """
+        nyc_df = input_df[self.zip_routing_index.is_nyc(
+            input_df['postal_code'])]
+        if len(nyc_df) > 0:
+            nyc_df = nyc_df.apply(reformat_malformed_address, axis=1)
+            nyc_df = nyc_df[self._is_routable(nyc_df)]
+        if len(nyc_df) == 0:
+            return self._geocode_with_census_geocoder(input_df, False)
+
+        self.logger.info(
+            'Sending ({}) NYC addresses to the NYC and census geocoders at '
+            'the same time'.format(len(nyc_df)))
+        hedge = GeosupportHedge(
+            self.nyc_geocoder_client, nyc_df, _NYC_ADDRESS_COLUMNS,
+            self.executor_registry.get('geosupport'))
+        # The census request gets a pool of its own, since this may be
+        # running on a blocking_io worker
+        census_future = self.executor_registry.get(
+            'hedged_census_geocoder').submit(
+            self._geocode_with_census_geocoder, input_df.loc[nyc_df.index],
+            False)
+        geoids = pd.Series(None, index=input_df.index, dtype=object)
+        bypassed_indices = pd.Index([])
+        other_df = input_df.drop(index=nyc_df.index)
+        if len(other_df) > 0:
+            try:
+                other_geoids, bypassed_indices = \
+                    self._geocode_with_census_geocoder(other_df, False)
+            except Exception:
+                hedge.cancel()
+                census_future.cancel()
+                raise
+            geoids.update(other_geoids)
+        nyc_geoids, nyc_bypassed_indices = hedge.race(census_future)
+        geoids.update(nyc_geoids)
+        return geoids, bypassed_indices.append(nyc_bypassed_indices)
+
+    def _geocode_with_census_geocoder(self, input_df, nyc_fallback):
+        """
+        Sends the addresses to the census geocoder API and then, if
+        nyc_fallback is true and that's unsuccessful, to the NYC geocoder.
+        Returns the geoids and the indices of the addresses that couldn't be
+        sent to the census geocoder because its circuit breaker was open.
+        """
+        # Get geoids from census geocoder API
+        try:
+            geoids = self._geocode_unique_addresses(
+                self.census_geocoder_client, input_df,
+                _CENSUS_ADDRESS_COLUMNS,
+                executor=self.executor_registry.get('census_geocoder'))
+        except CensusGeocoderCircuitOpenError:
+            return self._bypass_census_geocoder(
+                input_df, pd.Series(None, index=input_df.index, dtype=object),
+                nyc_fallback)
 
         # For addresses that weren't geocoded, reformat them and try again.
         # Sending two requests is also recommended by the API because it
@@ -383,45 +923,102 @@ class PipelineController:
         # https://www2.census.gov/geo/pdfs/maps-data/data/Census_Geocoder_FAQ.pdf
         retry_indices = geoids[geoids.isnull()].index
         if len(retry_indices) == 0:
-            address_df['geoid'] = geoids
-            return address_df[['patron_id', 'geoid']]
+            return geoids, pd.Index([])
         input_df = input_df.loc[retry_indices]
         input_df = input_df.apply(reformat_malformed_address, axis=1)
-        geoids.update(self.census_geocoder_client.get_geoids(input_df))
+        try:
+            geoids.update(self._geocode_unique_addresses(
+                self.census_geocoder_client, input_df,
+                _CENSUS_ADDRESS_COLUMNS,
+                executor=self.executor_registry.get('census_geocoder')))
+        except CensusGeocoderCircuitOpenError:
+            return self._bypass_census_geocoder(input_df, geoids, nyc_fallback)
+        if nyc_fallback:
+            geoids = self._geocode_routable_addresses(input_df, geoids)
+        return geoids, pd.Index([])
 
-        # Send addresses that still aren't geocoded to the NYC geocoder
+    def _bypass_census_geocoder(self, input_df, geoids, nyc_fallback):
+        """
+        Handles addresses that couldn't be sent to the census geocoder because
+        its circuit breaker is open. With the geosupport circuit open action,
+        the routable addresses (that haven't already been sent to it) are sent
+        straight to the NYC geocoder. Returns the updated geoids and the
+        indices of the addresses that are still without geoids, whose
+        geocoding is deferred.
+        """
+        if nyc_fallback and self.census_circuit_open_action == 'geosupport':
+            self.logger.warning(
+                'Census geocoder circuit is open -- sending ({}) addresses '
+                'straight to the NYC geocoder'.format(len(input_df)))
+            if 'house_number' not in input_df.columns:
+                input_df = input_df.apply(reformat_malformed_address, axis=1)
+            geoids = self._geocode_routable_addresses(input_df, geoids)
+        else:
+            self.logger.warning(
+                'Census geocoder circuit is open -- deferring ({}) '
+                'addresses'.format(len(input_df)))
+        return geoids, input_df.index[geoids[input_df.index].isnull()]
+
+    def _geocode_routable_addresses(self, input_df, geoids):
+        """
+        Sends the reformatted addresses that don't have geoids yet and have a
+        house number, street name, and postal code to the NYC geocoder and
+        returns the updated geoids
+        """
         retry_indices = geoids[geoids.isnull()].index
         if len(retry_indices) == 0:
-            address_df['geoid'] = geoids
-            return address_df[['patron_id', 'geoid']]
-        input_df = input_df.loc[retry_indices]
-        input_df = input_df[
-            (input_df['house_number'].str.len() > 0) &
-            (input_df['street_name'].str.len() > 0) &
-            (input_df['postal_code'].str.len() > 0)]
+            return geoids
+        input_df = input_df.loc[input_df.index.intersection(retry_indices)]
+        input_df = input_df[self._is_routable(input_df)]
         if len(input_df) == 0:
-            address_df['geoid'] = geoids
-            return address_df[['patron_id', 'geoid']]
+            return geoids
 
-        geoids.update(self.nyc_geocoder_client.get_geoids(input_df))
+        geoids.update(self._geocode_unique_addresses(
+            self.nyc_geocoder_client, input_df, _NYC_ADDRESS_COLUMNS,
+            executor=self.executor_registry.get('geosupport')))
         self.logger.info(
             'Successfully geocoded {success}/{total} non-empty addresses'
             .format(success=len(geoids[geoids.notnull()]), total=len(geoids)))
-        address_df['geoid'] = geoids
-        return address_df[['patron_id', 'geoid']]
+        return geoids
+
+    def _is_routable(self, input_df):
+        """
+        Returns whether each reformatted address has the house number, street
+        name, and postal code the NYC geocoder needs
+        """
+        return ((input_df['house_number'].str.len() > 0) &
+                (input_df['street_name'].str.len() > 0) &
+                (input_df['postal_code'].str.len() > 0))
+
+    def _geocode_unique_addresses(self, geocoder_client, input_df, columns,
+                                  **kwargs):
+        """
+        Sends a single row for each distinct combination of the given address
+        columns to the geocoder client and fans each resulting geoid back out
+        to every row with that address. Returns a series of geoids (or None)
+        indexed to match input_df.
+        """
+        address_ids = input_df.groupby(
+            columns, sort=False, dropna=False).ngroup()
+        unique_df = input_df[~address_ids.duplicated()]
+        self.logger.info(
+            'Collapsed ({total}) addresses into ({unique}) unique addresses '
+            '({ratio:.0%} of requests saved)'.format(
+                total=len(input_df), unique=len(unique_df),
+                ratio=1 - len(unique_df)/len(input_df)))
+        unique_geoids = geocoder_client.get_geoids(
+            unique_df, **kwargs).reindex(unique_df.index)
+        geoids_by_address_id = pd.Series(
+            unique_geoids.values, index=address_ids[unique_df.index].values)
+        return address_ids.map(geoids_by_address_id).rename('geoid')
 
     def _find_initial_patron_home_library_codes(self, unknown_iphlc_series):
         """
         Finds the initial patron home library code for existing patrons whose
         addresses could not be found in Redshift
         """
-        patron_ids_str = "','".join(
-            unknown_iphlc_series.to_string(index=False).split())
-        patron_ids_str = "'" + patron_ids_str + "'"
-        self.redshift_client.connect()
-        redshift_raw_data = self.redshift_client.execute_query(
-            build_redshift_iphlc_query(patron_ids_str))
-        self.redshift_client.close_connection()
+        redshift_raw_data = self._query_redshift(
+            build_redshift_iphlc_query, unknown_iphlc_series)
 
         iphlc_map = {row[0]: row[1] for row in redshift_raw_data}
         missing_patron_ids = set(unknown_iphlc_series).difference(
@@ -436,10 +1033,13 @@ class PipelineController:
 
     def _get_poller_state(self, batch_number):
         """
-        Retrieves the poller state from the S3 cache, the config, or the local
-        memory
+        Retrieves the poller state from the checkpoint file, the S3 cache, the
+        config, or the local memory
         """
-        if not self.ignore_cache:
+        if self.checkpoint_file is not None:
+            with open(self.checkpoint_file, 'r') as checkpoint_stream:
+                return json.load(checkpoint_stream)
+        elif not self.ignore_cache:
             return self.s3_client.fetch_cache()
         elif batch_number == 1:
             return {'creation_dt': os.environ.get('STARTING_CREATION_DT',
@@ -451,21 +1051,60 @@ class PipelineController:
         else:
             return self.poller_state
 
-    def _set_poller_state(self, mode, last_processed_data):
+    def _get_next_poller_state(self, mode, last_processed_data):
         """
-        Sets the poller state locally and in the S3 cache if appropriate
+        Returns a copy of the poller state advanced past the last processed
+        record. The state is a (timestamp, patron id) cursor pointing at the
+        last record processed, so the next batch starts strictly after it.
         """
+        next_state = copy.deepcopy(self.poller_state)
+        last_patron_id = int(last_processed_data['patron_id_plaintext'])
         if (mode == PipelineMode.NEW_PATRONS):
-            self.poller_state['creation_dt'] = last_processed_data[
+            next_state['creation_dt'] = last_processed_data[
                 'creation_timestamp'].isoformat()
+            next_state['creation_id'] = last_patron_id
         elif (mode == PipelineMode.UPDATED_PATRONS):
-            self.poller_state['update_dt'] = last_processed_data[
+            next_state['update_dt'] = last_processed_data[
                 'last_updated_timestamp'].isoformat()
+            next_state['update_id'] = last_patron_id
         elif (mode == PipelineMode.DELETED_PATRONS):
-            self.poller_state['deletion_date'] = last_processed_data[
+            next_state['deletion_date'] = last_processed_data[
                 'deletion_date_et'].isoformat()
-        if not self.ignore_cache:
+            next_state['deletion_id'] = last_patron_id
+        return next_state
+
+    def _set_poller_state(self, mode, last_processed_data):
+        """
+        Sets the poller state locally and in the S3 cache if appropriate
+        """
+        self.poller_state = self._get_next_poller_state(
+            mode, last_processed_data)
+        if self.checkpoint_file is not None:
+            write_json_atomically(self.checkpoint_file, self.poller_state)
+        if self.ignore_cache:
+            return
+        if self.poller_state_lock is None:
             self.s3_client.set_cache(self.poller_state)
+            return
+
+        # Merge this mode's fields into the latest cached state so that the
+        # fields set by concurrently running modes aren't overwritten
+        with self.poller_state_lock:
+            cached_state = self.s3_client.fetch_cache()
+            for field in _POLLER_STATE_FIELDS[mode]:
+                cached_state[field] = self.poller_state[field]
+            self.s3_client.set_cache(cached_state)
+
+
+def write_json_atomically(path, data):
+    """
+    Writes data to a JSON file by replacing it, so that an interrupted write
+    never leaves a partial file behind
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as temp_stream:
+        json.dump(data, temp_stream)
+    os.replace(temp_path, path)
 
 
 class PipelineControllerError(Exception):
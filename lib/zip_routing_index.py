@@ -0,0 +1,34 @@
+import csv
+import os
+
+from nypl_py_utils.functions.log_helper import create_log
+
+_DEFAULT_ZIP_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data',
+    'nyc_zip_boroughs.csv')
+
+
+class ZipRoutingIndex:
+    """
+    Index of the ZIP codes in the five boroughs, loaded from a csv file with
+    zip_code and borough columns (data/nyc_zip_boroughs.csv by default), used
+    to decide which geocoder an address should be sent to first
+    """
+
+    def __init__(self, zip_file=None):
+        self.logger = create_log('zip_routing_index')
+        zip_file = zip_file or _DEFAULT_ZIP_FILE
+        with open(zip_file, 'r', newline='') as zip_stream:
+            self.boroughs_by_zip = {
+                row['zip_code']: row['borough']
+                for row in csv.DictReader(zip_stream)}
+        self.logger.info('Loaded ({count}) NYC ZIP codes from {file}'.format(
+            count=len(self.boroughs_by_zip), file=zip_file))
+
+    def is_nyc(self, postal_codes):
+        """
+        Takes a series of postal codes and returns a boolean series of whether
+        each one's 5-digit ZIP code is in NYC
+        """
+        return postal_codes.str.slice(stop=5).isin(
+            self.boroughs_by_zip.keys()).fillna(False).astype(bool)
@@ -1,17 +1,24 @@
 import os
 import pytz
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from helpers.pipeline_mode import PipelineMode
+from lib.concurrent_session_state import ConcurrentSessionState
 from lib.pipeline_controller import PipelineController
 from nypl_py_utils.functions.config_helper import load_env_file
 from nypl_py_utils.functions.log_helper import create_log
+from threading import Lock
 
 
 def main():
     load_env_file(os.environ['ENVIRONMENT'], 'config/{}.yaml')
     now = datetime.now(pytz.utc).isoformat()
     logger = create_log(__name__)
+    if os.environ.get('RUN_MODES_CONCURRENTLY', False) == 'True':
+        run_modes_concurrently(now, logger)
+        return
+
     controller = PipelineController(now)
 
     logger.info('Starting new patrons pipeline run')
@@ -24,5 +31,37 @@ def main():
     controller.run_pipeline(PipelineMode.DELETED_PATRONS)
 
 
+def run_modes_concurrently(now, logger):
+    """
+    Runs each pipeline mode in its own worker thread with its own controller,
+    and therefore its own database connections. The controllers share a lock
+    so that each one only updates its own fields of the cached poller state,
+    and a ConcurrentSessionState so that, as when the modes run one after
+    another, no patron is processed by more than one mode and updated
+    patrons that the new patrons mode has yet to reach are left for it.
+    """
+    logger.info('Starting new, updated, and deleted patrons pipeline runs '
+                'concurrently')
+    poller_state_lock = Lock()
+    session_state = ConcurrentSessionState()
+    with ThreadPoolExecutor(max_workers=len(PipelineMode)) as executor:
+        futures = [executor.submit(_run_single_mode, now, mode,
+                                   poller_state_lock, session_state)
+                   for mode in PipelineMode]
+        for future in futures:
+            future.result()
+
+
+def _run_single_mode(now, mode, poller_state_lock, session_state):
+    try:
+        controller = PipelineController(
+            now, poller_state_lock=poller_state_lock,
+            session_state=session_state)
+        controller.run_pipeline(mode)
+    finally:
+        if mode == PipelineMode.NEW_PATRONS:
+            session_state.release_new_patrons_cursor()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,95 @@
+import json
+import pytest
+import threading
+
+from lib.adaptive_chunk_sizer import AdaptiveChunkSizer
+
+
+class TestAdaptiveChunkSizer:
+
+    @pytest.fixture
+    def test_instance(self):
+        return AdaptiveChunkSizer(1000, target_seconds=60)
+
+    def test_additive_increase(self, test_instance):
+        test_instance.record_success(1000, 10)
+        assert test_instance.chunk_size == 1250
+
+        test_instance.record_success(1250, 10)
+        assert test_instance.chunk_size == 1500
+
+    def test_return_to_best_chunk_size(self, test_instance):
+        test_instance.record_success(1000, 10)
+        test_instance.record_success(1250, 50)
+
+        assert test_instance.chunk_size == 1000
+
+    def test_multiplicative_decrease(self, test_instance):
+        test_instance.record_success(1000, 61)
+        assert test_instance.chunk_size == 500
+
+        test_instance.record_failure(300)
+        assert test_instance.chunk_size == 250
+        assert test_instance.state['failure_rate'] == pytest.approx(0.3)
+
+    def test_chunk_size_limits(self):
+        test_instance = AdaptiveChunkSizer(20000, target_seconds=60)
+        assert test_instance.chunk_size == 10000
+
+        for _ in range(10):
+            test_instance.record_failure(1)
+        assert test_instance.chunk_size == 100
+
+    def test_state_persistence(self, tmp_path):
+        state_file = str(tmp_path / 'chunk_sizer.json')
+        test_instance = AdaptiveChunkSizer(1000, 60, state_file)
+        test_instance.record_success(1000, 10)
+        test_instance.save_state()
+
+        with open(state_file, 'r') as state_stream:
+            assert json.load(state_stream)['chunk_size'] == 1250
+        assert AdaptiveChunkSizer(1000, 60, state_file).chunk_size == 1250
+
+    def test_concurrent_state_saves(self, tmp_path):
+        state_file = str(tmp_path / 'chunk_sizer.json')
+        instances = [AdaptiveChunkSizer(1000, 60, state_file)
+                     for _ in range(8)]
+        errors = []
+
+        def save_state(instance):
+            try:
+                for _ in range(20):
+                    instance.save_state()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save_state, args=(instance,))
+                   for instance in instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every writer used its own temp file, and none were left behind
+        assert errors == []
+        assert [path.name for path in tmp_path.iterdir()] == [
+            'chunk_sizer.json']
+        assert AdaptiveChunkSizer(1000, 60, state_file).chunk_size == 1000
+
+    def test_loaded_state_is_clamped(self, tmp_path):
+        state_file = tmp_path / 'chunk_sizer.json'
+        state_file.write_text(json.dumps(
+            {'chunk_size': 50000, 'best_chunk_size': 20000}))
+
+        test_instance = AdaptiveChunkSizer(1000, 60, str(state_file))
+
+        assert test_instance.chunk_size == 10000
+        assert test_instance.state['best_chunk_size'] == 10000
+
+    def test_log_state(self, test_instance, caplog):
+        test_instance.record_success(1000, 10)
+
+        test_instance.log_state()
+
+        assert ('Census geocoder chunk size: 1250 rows (latency 10s, 100.0 '
+                'rows/s, 0% failure rate over 1 requests)') in caplog.text
@@ -1,7 +1,8 @@
 import pandas as pd
 
 from collections import OrderedDict
-from helpers.address_helper import reformat_malformed_address
+from helpers.address_helper import (canonicalize_address,
+                                    reformat_malformed_address)
 from pandas.testing import assert_series_equal
 from usaddress import RepeatedLabelError
 
@@ -144,3 +145,18 @@ class TestAddressHelper:
 
         assert_series_equal(
             reformat_malformed_address(input_row), output_row)
+
+    def test_canonicalize_address(self):
+        assert canonicalize_address(
+            '123 Real Avenue, Apt 4B', 'New York', 'ny', '11111-2222') == \
+            '123|REAL AVE|NEW YORK|NY|11111'
+        assert canonicalize_address(
+            '123 REAL AVE APT 1', 'NEW YORK', 'NY', '11111') == \
+            '123|REAL AVE|NEW YORK|NY|11111'
+        assert canonicalize_address(
+            '45 West 4th St.', 'Brooklyn', 'NY', '11201') == \
+            '45|W 4TH ST|BROOKLYN|NY|11201'
+
+    def test_canonicalize_unparseable_address(self):
+        assert canonicalize_address(
+            'P.O. Box 5', 'Bronx', 'NY', '10451') == 'P O BOX 5 BRONX NY 10451'
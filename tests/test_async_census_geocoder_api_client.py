@@ -0,0 +1,129 @@
+import aiohttp
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+
+from aiohttp import web
+from lib import AsyncCensusGeocoderApiClient
+from lib.circuit_breaker import CircuitBreaker
+from pandas.testing import assert_series_equal
+from tests.test_census_geocoder_api_client import _ADDRESS_DF, _API_RESPONSE
+from tests.test_helpers import TestHelpers
+
+_GEOIDS = pd.Series(
+    ['00111222222', np.nan, '44555666666', np.nan, np.nan],
+    name='geoid', index=[0, 1, 2, 3, 4])
+_GEOIDS.index.name = 'index'
+
+
+class TestAsyncCensusGeocoderApiClient:
+
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+
+    @pytest.fixture
+    def test_instance(self):
+        test_instance = AsyncCensusGeocoderApiClient()
+        yield test_instance
+        test_instance.close()
+
+    def test_get_geoids(self, test_instance, mocker):
+        mocked_post = mocker.patch(
+            'lib.async_census_geocoder_api_client.AsyncCensusGeocoderApiClient._post',  # noqa: E501
+            return_value=bytes(_API_RESPONSE, 'utf-8'))
+
+        assert_series_equal(test_instance.get_geoids(_ADDRESS_DF), _GEOIDS)
+        assert mocked_post.call_args.args[0] == (
+            '4,123 good address,New York,NY,11111\n'
+            '3,456 bad address,Brooklyn,NY,22222\n'
+            '2,789 good address,Staten Island,NY,33333-4444\n'
+            '1,012 bad address,Bronx,NY,55555-6666\n'
+            '0,345 tie address,Queens,NY,77777\n')
+
+    def test_get_geoids_chunked(self, test_instance, mocker):
+        test_instance.chunk_size = 2
+        mocked_post = mocker.patch(
+            'lib.async_census_geocoder_api_client.AsyncCensusGeocoderApiClient._post',  # noqa: E501
+            side_effect=lambda address_csv: bytes(''.join(
+                _API_RESPONSE.split('\n')[int(line.split(',')[0])] + '\n'
+                for line in address_csv.splitlines()), 'utf-8'))
+
+        geoids = test_instance.get_geoids(_ADDRESS_DF)
+
+        assert mocked_post.call_count == 3
+        assert_series_equal(geoids.sort_index(), _GEOIDS,
+                            check_index_type=False)
+
+    def test_post_with_retries(self, test_instance, mocker):
+        mocked_sleep = mocker.patch(
+            'lib.async_census_geocoder_api_client.asyncio.sleep')
+        mocked_post = mocker.patch(
+            'lib.async_census_geocoder_api_client.AsyncCensusGeocoderApiClient._post',  # noqa: E501
+            side_effect=[aiohttp.ClientConnectionError,
+                         TimeoutError, bytes(_API_RESPONSE, 'utf-8')])
+
+        assert_series_equal(test_instance.get_geoids(_ADDRESS_DF), _GEOIDS)
+        assert mocked_post.call_count == 3
+        mocked_sleep.assert_called_once_with(8)
+
+    def test_send_request_with_split(self, test_instance, mocker):
+        _BIG_ADDRESS_DF = _ADDRESS_DF.reindex(list(range(2000)))
+        mocker.patch('lib.async_census_geocoder_api_client.asyncio.sleep')
+        mocker.patch(
+            'lib.async_census_geocoder_api_client.AsyncCensusGeocoderApiClient._post',  # noqa: E501
+            side_effect=[aiohttp.ClientConnectionError] * 3 + [
+                bytes('\n'.join(_API_RESPONSE.split('\n')[:2]), 'utf-8'),
+                bytes('\n'.join(_API_RESPONSE.split('\n')[2:]), 'utf-8')])
+
+        assert_series_equal(
+            test_instance.get_geoids(_BIG_ADDRESS_DF), _GEOIDS)
+
+    def test_send_request_unexpected_error_reopens_circuit(
+            self, test_instance, mocker):
+        test_instance.circuit_breaker = CircuitBreaker('Test', 2, 0)
+        test_instance.circuit_breaker.state = CircuitBreaker.OPEN
+        test_instance.circuit_breaker.opened_at = 0
+        mocker.patch(
+            'lib.async_census_geocoder_api_client.AsyncCensusGeocoderApiClient._post',  # noqa: E501
+            side_effect=ValueError)
+
+        with pytest.raises(ValueError):
+            test_instance.get_geoids(_ADDRESS_DF)
+        assert test_instance.circuit_breaker.state == CircuitBreaker.OPEN
+
+    def test_post_to_server(self, test_instance, mocker):
+        async def handle(request):
+            form = await request.post()
+            assert request.query['benchmark'] == 'test_geocoder_benchmark'
+            assert form['addressFile'].filename == 'input_addresses.csv'
+            return web.Response(text=_API_RESPONSE)
+
+        async def start_server():
+            app = web.Application()
+            app.router.add_post('/', handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            return runner, runner.addresses[0][1]
+
+        loop = test_instance._get_loop()
+        runner, port = _run(loop, start_server())
+        mocker.patch.dict('os.environ', {
+            'GEOCODER_API_BASE_URL': 'http://127.0.0.1:{}/'.format(port)})
+
+        try:
+            assert_series_equal(
+                test_instance.get_geoids(_ADDRESS_DF), _GEOIDS)
+        finally:
+            _run(loop, runner.cleanup())
+
+
+def _run(loop, coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
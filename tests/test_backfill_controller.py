@@ -0,0 +1,163 @@
+import json
+import os
+import pytest
+
+from helpers.pipeline_mode import PipelineMode
+from lib.backfill_controller import (BackfillController,
+                                     BackfillControllerError,
+                                     build_time_windows)
+from tests.test_helpers import TestHelpers
+
+_NOW = '2023-01-01T00:00:00+00:00'
+
+
+class TestBackfillController:
+
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+
+    @pytest.fixture
+    def test_instance(self, mocker, tmp_path):
+        mocker.patch('lib.backfill_controller.S3Client')
+        os.environ['BACKFILL_SHARDS'] = '2'
+        os.environ['BACKFILL_CHECKPOINT_DIR'] = str(tmp_path)
+        os.environ['STARTING_CREATION_DT'] = '2022-12-31T00:00:00+00:00'
+        yield BackfillController(_NOW)
+        del os.environ['BACKFILL_SHARDS']
+        del os.environ['BACKFILL_CHECKPOINT_DIR']
+        del os.environ['STARTING_CREATION_DT']
+
+    def _complete_shard(self, mode, window_end, checkpoint_file):
+        with open(checkpoint_file, 'r') as checkpoint_stream:
+            checkpoint = json.load(checkpoint_stream)
+        checkpoint['complete'] = True
+        with open(checkpoint_file, 'w') as checkpoint_stream:
+            json.dump(checkpoint, checkpoint_stream)
+
+    def test_build_time_windows(self):
+        assert build_time_windows(
+            '2022-12-31T00:00:00+00:00', _NOW, 4) == [
+            ('2022-12-31T00:00:00+00:00', '2022-12-31T06:00:00+00:00'),
+            ('2022-12-31T06:00:00+00:00', '2022-12-31T12:00:00+00:00'),
+            ('2022-12-31T12:00:00+00:00', '2022-12-31T18:00:00+00:00'),
+            ('2022-12-31T18:00:00+00:00', _NOW)]
+
+    def test_build_time_windows_bad_range(self):
+        with pytest.raises(BackfillControllerError):
+            build_time_windows(_NOW, '2022-12-31T00:00:00+00:00', 2)
+
+    def test_deleted_patrons_not_supported(self):
+        os.environ['BACKFILL_MODE'] = 'DELETED_PATRONS'
+        with pytest.raises(BackfillControllerError):
+            BackfillController(_NOW)
+        del os.environ['BACKFILL_MODE']
+
+    def test_run_backfill(self, test_instance, mocker, tmp_path):
+        mock_executor = mocker.patch(
+            'lib.backfill_controller.ProcessPoolExecutor')
+        mock_executor.return_value.__enter__.return_value.submit.side_effect \
+            = lambda fn, *args: self._complete_shard(*args) or \
+            mocker.MagicMock()
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {
+            'creation_dt': '2020-01-01', 'creation_id': 5,
+            'update_dt': '2020-01-01', 'update_id': 6}
+        mocker.patch('lib.backfill_controller.S3Client',
+                     return_value=mock_s3_client)
+
+        test_instance.run_backfill()
+
+        submit = mock_executor.return_value.__enter__.return_value.submit
+        assert submit.call_count == 2
+        assert submit.call_args_list[0].args[1:] == (
+            PipelineMode.NEW_PATRONS, '2022-12-31T12:00:00+00:00',
+            str(tmp_path / 'shard_0.json'))
+        assert submit.call_args_list[1].args[1:] == (
+            PipelineMode.NEW_PATRONS, _NOW, str(tmp_path / 'shard_1.json'))
+        with open(tmp_path / 'shard_1.json', 'r') as checkpoint_stream:
+            assert json.load(checkpoint_stream) == {
+                'creation_dt': '2022-12-31T12:00:00+00:00', 'creation_id': 0,
+                'complete': True}
+        mock_s3_client.set_cache.assert_called_once_with({
+            'creation_dt': _NOW, 'creation_id': 0,
+            'update_dt': '2020-01-01', 'update_id': 6})
+
+    def test_run_backfill_with_deferred_geocoding(
+            self, test_instance, mocker, tmp_path):
+        def mock_run_pipeline(mode):
+            # The first shard commits part of its window and then defers the
+            # rest, while the second shard finishes
+            controller = mock_controller_class.return_value
+            checkpoint_file = mock_controller_class.call_args.kwargs[
+                'checkpoint_file']
+            controller.geocoding_deferred = checkpoint_file.endswith(
+                'shard_0.json')
+            if controller.geocoding_deferred:
+                with open(checkpoint_file, 'w') as checkpoint_stream:
+                    json.dump({'creation_dt': '2022-12-31T06:00:00+00:00',
+                               'creation_id': 7}, checkpoint_stream)
+
+        mock_controller_class = mocker.patch(
+            'lib.backfill_controller.PipelineController')
+        mock_controller_class.return_value.run_pipeline.side_effect = \
+            mock_run_pipeline
+        mock_executor = mocker.patch(
+            'lib.backfill_controller.ProcessPoolExecutor')
+        mock_executor.return_value.__enter__.return_value.submit.side_effect \
+            = lambda fn, *args: fn(*args) or mocker.MagicMock()
+        mock_s3_client = mocker.patch('lib.backfill_controller.S3Client')
+
+        with pytest.raises(BackfillControllerError):
+            test_instance.run_backfill()
+
+        with open(tmp_path / 'shard_0.json', 'r') as checkpoint_stream:
+            assert json.load(checkpoint_stream) == {
+                'creation_dt': '2022-12-31T06:00:00+00:00', 'creation_id': 7}
+        with open(tmp_path / 'shard_1.json', 'r') as checkpoint_stream:
+            assert json.load(checkpoint_stream)['complete']
+        mock_s3_client.return_value.set_cache.assert_not_called()
+
+    def test_merge_poller_state_keeps_newer_cursor(
+            self, test_instance, mocker):
+        mock_s3_client = mocker.MagicMock()
+        mocker.patch('lib.backfill_controller.S3Client',
+                     return_value=mock_s3_client)
+
+        mock_s3_client.fetch_cache.return_value = {
+            'creation_dt': '2023-01-02T00:00:00+00:00', 'creation_id': 5}
+        test_instance._merge_poller_state(_NOW)
+        mock_s3_client.set_cache.assert_not_called()
+
+        mock_s3_client.fetch_cache.return_value = {
+            'creation_dt': '2022-12-31T19:00:00-05:00', 'creation_id': 5}
+        test_instance._merge_poller_state(_NOW)
+        mock_s3_client.set_cache.assert_not_called()
+
+        mock_s3_client.fetch_cache.return_value = {
+            'creation_dt': '2022-12-31T12:00:00+00:00', 'creation_id': 5}
+        test_instance._merge_poller_state(_NOW)
+        mock_s3_client.set_cache.assert_called_once_with({
+            'creation_dt': _NOW, 'creation_id': 0})
+
+    def test_run_backfill_resumes_and_waits_for_shards(
+            self, test_instance, mocker, tmp_path):
+        mock_executor = mocker.patch(
+            'lib.backfill_controller.ProcessPoolExecutor')
+        mock_s3_client = mocker.patch('lib.backfill_controller.S3Client')
+        test_instance._load_or_create_plan()
+        self._complete_shard(None, None, str(tmp_path / 'shard_0.json'))
+
+        # The second shard is interrupted, so the poller state isn't advanced
+        with pytest.raises(BackfillControllerError):
+            BackfillController('2024-01-01T00:00:00+00:00').run_backfill()
+
+        submit = mock_executor.return_value.__enter__.return_value.submit
+        submit.assert_called_once()
+        assert submit.call_args.args[2] == _NOW
+        mock_executor.assert_called_once_with(max_workers=1)
+        mock_s3_client.assert_not_called()
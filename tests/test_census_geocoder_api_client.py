@@ -1,8 +1,11 @@
 import numpy as np
+import os
 import pandas as pd
 import pytest
 
-from lib import CensusGeocoderApiClient
+from concurrent.futures import Future
+from lib import CensusGeocoderApiClient, CensusGeocoderCircuitOpenError
+from lib.circuit_breaker import CircuitBreaker
 from pandas.testing import assert_series_equal
 from requests.exceptions import ConnectionError
 from tests.test_helpers import TestHelpers
@@ -73,3 +76,116 @@ class TestCensusGeocoderApiClient:
             text=_API_RESPONSE)
 
         assert_series_equal(test_instance.get_geoids(_ADDRESS_DF), _GEOIDS)
+
+    def test_send_request_with_retries_unterminated_response(
+            self, requests_mock, test_instance):
+        _BIG_ADDRESS_DF = _ADDRESS_DF.reindex(list(range(2000)))
+        _FIRST_RESPONSE = '\n'.join(_API_RESPONSE.split('\n')[:2])
+        _SECOND_RESPONSE = '\n'.join(_API_RESPONSE.split('\n')[2:])
+
+        requests_mock.post(
+            'https://test_geocoder_url?benchmark=test_geocoder_benchmark&vintage=test_geocoder_vintage',  # noqa: E501
+            [{'exc': ConnectionError},
+             {'text': _FIRST_RESPONSE, 'status_code': 200},
+             {'text': _SECOND_RESPONSE, 'status_code': 200}])
+
+        assert test_instance._send_request(
+            _BIG_ADDRESS_DF) == bytes(_API_RESPONSE, 'utf-8')
+
+    def test_get_geoids_chunked(self, requests_mock, test_instance, mocker):
+        _GEOIDS = pd.Series(
+            ['00111222222', np.nan, '44555666666', np.nan, np.nan],
+            name='geoid', index=[0, 1, 2, 3, 4])
+        test_instance.chunk_size = 2
+        mocked_send_request = mocker.patch(
+            'lib.census_geocoder_api_client.CensusGeocoderApiClient._send_request',  # noqa: E501
+            side_effect=lambda chunk: bytes(''.join(
+                _API_RESPONSE.split('\n')[i] + '\n'
+                for i in chunk.index), 'utf-8'))
+
+        geoids = test_instance.get_geoids(_ADDRESS_DF)
+
+        assert mocked_send_request.call_count == 3
+        assert sorted(len(call.args[0]) for call in
+                      mocked_send_request.call_args_list) == [1, 2, 2]
+        assert_series_equal(geoids.sort_index(), _GEOIDS, check_names=False,
+                            check_index_type=False)
+
+    def test_get_geoids_chunked_with_executor(self, requests_mock,
+                                              test_instance, mocker):
+        test_instance.chunk_size = 3
+        mocker.patch(
+            'lib.census_geocoder_api_client.CensusGeocoderApiClient._send_request',  # noqa: E501
+            side_effect=lambda chunk: bytes(''.join(
+                _API_RESPONSE.split('\n')[i] + '\n'
+                for i in chunk.index), 'utf-8'))
+        mock_executor = mocker.MagicMock()
+        mock_executor.submit.side_effect = \
+            lambda fn, chunk: _completed_future(fn(chunk))
+
+        geoids = test_instance.get_geoids(_ADDRESS_DF, executor=mock_executor)
+
+        assert mock_executor.submit.call_count == 2
+        assert sorted(geoids.index) == [0, 1, 2, 3, 4]
+
+    def test_chunk_size_capped_at_api_limit(self, test_instance):
+        _BIG_ADDRESS_DF = _ADDRESS_DF.reindex(list(range(25000)))
+        assert [len(chunk) for chunk in test_instance._split_into_chunks(
+            _BIG_ADDRESS_DF)] == [10000, 10000, 5000]
+
+        os.environ['GEOCODER_API_CHUNK_SIZE'] = '20000'
+        assert CensusGeocoderApiClient().chunk_size == 10000
+        del os.environ['GEOCODER_API_CHUNK_SIZE']
+
+    def test_send_request_with_adaptive_chunking(self, requests_mock,
+                                                 test_instance, mocker):
+        _BIG_ADDRESS_DF = _ADDRESS_DF.reindex(list(range(1000)))
+        test_instance.chunk_sizer = mocker.MagicMock()
+        test_instance.chunk_sizer.chunk_size = 250
+        test_instance.chunk_sizer.min_chunk_size = 100
+        requests_mock.post(
+            'https://test_geocoder_url?benchmark=test_geocoder_benchmark&vintage=test_geocoder_vintage',  # noqa: E501
+            [{'exc': ConnectionError}] +
+            [{'text': line, 'status_code': 200}
+             for line in _API_RESPONSE.split('\n')[:4]])
+
+        assert test_instance._send_request(_BIG_ADDRESS_DF) == bytes(
+            '\n'.join(_API_RESPONSE.split('\n')[:4]), 'utf-8')
+        test_instance.chunk_sizer.record_failure.assert_called_once()
+        assert [call.args[0] for call in
+                test_instance.chunk_sizer.record_success.call_args_list] == [
+            250, 250, 250, 250]
+
+    def test_send_request_circuit_breaker(self, requests_mock, test_instance):
+        _BIG_ADDRESS_DF = _ADDRESS_DF.reindex(list(range(4000)))
+        test_instance.circuit_breaker = CircuitBreaker('Test', 2, 300)
+        mocked_post = requests_mock.post(
+            'https://test_geocoder_url?benchmark=test_geocoder_benchmark&vintage=test_geocoder_vintage',  # noqa: E501
+            exc=ConnectionError)
+
+        with pytest.raises(CensusGeocoderCircuitOpenError):
+            test_instance._send_request(_BIG_ADDRESS_DF)
+        assert mocked_post.call_count == 2
+
+        with pytest.raises(CensusGeocoderCircuitOpenError):
+            test_instance.get_geoids(_ADDRESS_DF)
+        assert mocked_post.call_count == 2
+
+    def test_send_request_unexpected_error_reopens_circuit(
+            self, requests_mock, test_instance):
+        test_instance.circuit_breaker = CircuitBreaker('Test', 2, 0)
+        test_instance.circuit_breaker.state = CircuitBreaker.OPEN
+        test_instance.circuit_breaker.opened_at = 0
+        requests_mock.post(
+            'https://test_geocoder_url?benchmark=test_geocoder_benchmark&vintage=test_geocoder_vintage',  # noqa: E501
+            exc=ValueError)
+
+        with pytest.raises(ValueError):
+            test_instance._send_request(_ADDRESS_DF)
+        assert test_instance.circuit_breaker.state == CircuitBreaker.OPEN
+
+
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.census_response_helper import parse_census_geoids
+from io import BytesIO
+from pandas.testing import assert_series_equal
+
+_MESSY_RESPONSE = (
+    '"0","123 good address, New York, NY, 11111","Match","Exact","123 matched address, New York, NY, 11111-9999","-0.00000001,1.11111110","123456789","R","00","111","222222","3333"\n'  # noqa: E501
+    '"1","456 bad address, Brooklyn, NY, 22222","No_Match"\n'
+    '"2","1 ""Quoted"" Place, Apt ""B"", Staten Island, NY, 33333","Match","Non_Exact","1 QUOTED PL, STATEN ISLAND, NY, 33333","-74.1,40.6","987654321","L","36","085","012345","1000"\r\n'  # noqa: E501
+    '"3","12 Café Ñandú Rd, Bronx, NY, 10451","Tie"\r\n'
+    '"4","PO Box 5,, , ,","No_Match"\n'
+    '"5","789 good address, Queens, NY, 11375","Match","Exact","789 MATCHED ADDRESS, QUEENS, NY, 11375","-73.8,40.7","111111111","R","36","081","071600","2001"')  # noqa: E501
+
+_EXPECTED_GEOIDS = pd.Series(
+    ['00111222222', np.nan, '36085012345', np.nan, np.nan, '36081071600'],
+    name='geoid', index=pd.Index([0, 1, 2, 3, 4, 5], name='index'))
+
+
+def _parse_with_pandas(raw_response):
+    """The previous parser, used as a reference for fidelity"""
+    response_df = pd.read_csv(BytesIO(raw_response), header=None,
+                              dtype=str, index_col=0, engine='python',
+                              names=['index', 'input_address', 'match',
+                                     'match_type', 'matched_address',
+                                     'coordinates', 'tigerline_id',
+                                     'tigerline_side', 'state_id',
+                                     'county_id', 'tract_id', 'block_id'])
+    return (response_df['state_id'] + response_df['county_id'] +
+            response_df['tract_id']).rename('geoid')
+
+
+class TestCensusResponseHelper:
+
+    def test_parse_census_geoids(self):
+        assert_series_equal(
+            parse_census_geoids([_MESSY_RESPONSE.encode('utf-8')]),
+            _EXPECTED_GEOIDS)
+
+    def test_matches_pandas_parser(self):
+        raw_response = _MESSY_RESPONSE.encode('utf-8')
+
+        assert_series_equal(parse_census_geoids([raw_response]),
+                            _parse_with_pandas(raw_response))
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 64])
+    def test_parse_streamed_chunks(self, chunk_size):
+        # Chunk boundaries fall inside lines, quoted fields, and multi-byte
+        # characters
+        raw_response = _MESSY_RESPONSE.encode('utf-8')
+        chunks = [raw_response[i:i + chunk_size]
+                  for i in range(0, len(raw_response), chunk_size)]
+
+        assert_series_equal(parse_census_geoids(chunks), _EXPECTED_GEOIDS)
+
+    def test_parse_empty_response(self):
+        geoids = parse_census_geoids([b''])
+
+        assert len(geoids) == 0
+        assert geoids.name == 'geoid'
+
+    def test_parse_non_numeric_index(self):
+        geoids = parse_census_geoids(
+            [b'"a1","1 A St, New York, NY, 10001","No_Match"\n'])
+
+        assert list(geoids.index) == ['a1']
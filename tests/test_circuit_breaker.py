@@ -0,0 +1,56 @@
+import pytest
+
+from lib.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker:
+
+    @pytest.fixture
+    def test_instance(self):
+        return CircuitBreaker('Test', failure_threshold=2, reset_seconds=10)
+
+    def test_trips_after_consecutive_failures(self, test_instance, caplog):
+        test_instance.record_failure()
+        test_instance.record_success()
+        test_instance.record_failure()
+        assert test_instance.allow_request()
+
+        test_instance.record_failure()
+
+        assert test_instance.state == CircuitBreaker.OPEN
+        assert not test_instance.allow_request()
+        assert 'Test circuit is open after (2) consecutive failures' in \
+            caplog.text
+
+    def test_half_open_probe_success(self, test_instance, mocker):
+        mock_time = mocker.patch('lib.circuit_breaker.time.monotonic')
+        mock_time.return_value = 100
+        test_instance.record_failure()
+        test_instance.record_failure()
+
+        mock_time.return_value = 109
+        assert not test_instance.allow_request()
+        mock_time.return_value = 110
+        assert test_instance.allow_request()
+        assert test_instance.state == CircuitBreaker.HALF_OPEN
+        assert not test_instance.allow_request()
+
+        test_instance.record_success()
+        assert test_instance.state == CircuitBreaker.CLOSED
+        assert test_instance.allow_request()
+
+    def test_half_open_probe_failure(self, test_instance, mocker):
+        mock_time = mocker.patch('lib.circuit_breaker.time.monotonic')
+        mock_time.return_value = 100
+        test_instance.record_failure()
+        test_instance.record_failure()
+        mock_time.return_value = 110
+        assert test_instance.allow_request()
+
+        test_instance.record_failure()
+
+        assert test_instance.state == CircuitBreaker.OPEN
+        mock_time.return_value = 119
+        assert not test_instance.allow_request()
+        mock_time.return_value = 120
+        assert test_instance.allow_request()
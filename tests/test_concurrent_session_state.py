@@ -0,0 +1,45 @@
+import datetime
+import pandas as pd
+
+from lib.concurrent_session_state import ConcurrentSessionState
+from zoneinfo import ZoneInfo
+
+_SIERRA_DF = pd.DataFrame(
+    {'patron_id_plaintext': ['1', '2', '3', '4'],
+     'creation_timestamp': [
+        datetime.datetime(2021, 1, 1, 0, 0, 0,
+                          tzinfo=ZoneInfo('America/New_York')),
+        datetime.datetime(2021, 1, 2, 0, 0, 0,
+                          tzinfo=ZoneInfo('America/New_York')),
+        datetime.datetime(2021, 1, 2, 0, 0, 0,
+                          tzinfo=ZoneInfo('America/New_York')),
+        datetime.datetime(2021, 1, 3, 0, 0, 0,
+                          tzinfo=ZoneInfo('America/New_York'))]},
+    index=[3, 2, 1, 0])
+
+
+class TestConcurrentSessionState:
+
+    def test_processed_ids(self):
+        test_instance = ConcurrentSessionState()
+        test_instance.add_processed_ids(pd.Series(['1', '3']))
+
+        assert list(test_instance.unseen_mask(
+            _SIERRA_DF['patron_id_plaintext'])) == [False, True, False, True]
+
+        test_instance.discard_processed_ids(pd.Series(['3']))
+        assert list(test_instance.unseen_mask(
+            _SIERRA_DF['patron_id_plaintext'])) == [False, True, True, True]
+
+    def test_pending_new_patrons_mask(self):
+        test_instance = ConcurrentSessionState()
+        test_instance.set_new_patrons_cursor('2021-01-02T05:00:00+00:00', 2)
+
+        assert list(test_instance.pending_new_patrons_mask(_SIERRA_DF)) == [
+            False, False, True, True]
+
+    def test_pending_new_patrons_mask_without_cursor(self):
+        test_instance = ConcurrentSessionState()
+        test_instance.release_new_patrons_cursor()
+
+        assert not test_instance.pending_new_patrons_mask(_SIERRA_DF).any()
@@ -0,0 +1,135 @@
+import psycopg
+import pytest
+
+from lib import DatabaseConnectionManager, DatabaseConnectionManagerError
+from nypl_py_utils.classes.postgresql_client import PostgreSQLClientError
+
+
+class TestDatabaseConnectionManager:
+
+    @pytest.fixture
+    def test_instance(self, mocker):
+        return DatabaseConnectionManager(mocker.MagicMock(), 'Test')
+
+    def test_reuses_connection(self, test_instance):
+        test_instance.client.execute_query.side_effect = [[(1,)], [(2,)]]
+
+        assert test_instance.execute_query('QUERY 1') == [(1,)]
+        assert test_instance.execute_query('QUERY 2', ['param']) == [(2,)]
+
+        test_instance.client.connect.assert_called_once()
+        test_instance.client.execute_query.assert_any_call(
+            'QUERY 2', ['param'])
+        test_instance.client.close_connection.assert_not_called()
+        assert test_instance.connection_count == 1
+        assert test_instance.reuse_count == 1
+
+    def test_autocommit(self, mocker):
+        test_instance = DatabaseConnectionManager(
+            mocker.MagicMock(), 'Test', autocommit=True)
+
+        test_instance.acquire()
+
+        assert test_instance.client.conn.autocommit is True
+
+    def test_liveness_check_reconnects(self, test_instance):
+        test_instance.liveness_check_seconds = 0
+        test_instance.acquire()
+        test_instance.client.conn.cursor.return_value.execute.side_effect = \
+            Exception('server closed the connection')
+
+        test_instance.acquire()
+
+        assert test_instance.client.connect.call_count == 2
+        test_instance.client.close_connection.assert_called_once()
+        assert test_instance.connection_count == 2
+        assert test_instance.reuse_count == 0
+
+    def test_liveness_check_passes(self, test_instance):
+        test_instance.liveness_check_seconds = 0
+        test_instance.acquire()
+        test_instance.acquire()
+
+        test_instance.client.connect.assert_called_once()
+        test_instance.client.conn.cursor.return_value.execute.\
+            assert_called_once_with('SELECT 1;')
+        assert test_instance.reuse_count == 1
+
+    def test_reconnects_on_lost_connection(self, test_instance):
+        test_instance.client.execute_query.side_effect = [
+            PostgreSQLClientError('connection lost'), [(1,)]]
+        test_instance.client.conn.closed = True
+
+        assert test_instance.execute_query('QUERY') == [(1,)]
+
+        assert test_instance.client.connect.call_count == 2
+        assert test_instance.client.execute_query.call_count == 2
+
+    def test_raises_query_error_on_live_connection(self, test_instance):
+        test_instance.client.execute_query.side_effect = \
+            PostgreSQLClientError('syntax error')
+
+        with pytest.raises(PostgreSQLClientError):
+            test_instance.execute_query('QUERY')
+
+        test_instance.client.connect.assert_called_once()
+        test_instance.client.execute_query.assert_called_once_with('QUERY')
+
+    def test_close(self, test_instance):
+        test_instance.close()
+        test_instance.client.close_connection.assert_not_called()
+
+        test_instance.acquire()
+        test_instance.acquire()
+        test_instance.close()
+
+        test_instance.client.close_connection.assert_called_once()
+        assert not test_instance.is_connected
+        assert test_instance.reuse_count == 0
+
+    def test_execute_parameterized_query(self, test_instance):
+        mock_cursor = test_instance.client.conn.cursor.return_value
+        mock_cursor.fetchall.return_value = [(1,)]
+
+        assert test_instance.execute_parameterized_query(
+            'QUERY %s', ['param']) == [(1,)]
+
+        mock_cursor.execute.assert_called_once_with('QUERY %s', ['param'])
+        mock_cursor.close.assert_called_once()
+        test_instance.client.execute_query.assert_not_called()
+
+    def test_execute_parameterized_query_error(self, test_instance):
+        mock_cursor = test_instance.client.conn.cursor.return_value
+        mock_cursor.execute.side_effect = [Exception('syntax error'), None]
+        test_instance.client.conn.closed = False
+
+        with pytest.raises(DatabaseConnectionManagerError):
+            test_instance.execute_parameterized_query('QUERY %s', ['param'])
+
+        test_instance.client.conn.rollback.assert_called_once()
+        test_instance.client.connect.assert_called_once()
+
+    def test_reconnects_when_rollback_raises(self, test_instance):
+        # The client's execute_query lets the raw driver error from its own
+        # rollback escape when the connection dies mid-query
+        test_instance.client.execute_query.side_effect = [
+            psycopg.OperationalError('the connection is lost'), [(1,)]]
+        test_instance.client.conn.closed = True
+
+        assert test_instance.execute_query('QUERY') == [(1,)]
+
+        assert test_instance.client.connect.call_count == 2
+
+    def test_execute_parameterized_query_rollback_error(self, test_instance):
+        mock_cursor = test_instance.client.conn.cursor.return_value
+        mock_cursor.execute.side_effect = [
+            psycopg.OperationalError('the connection is lost'), None]
+        mock_cursor.fetchall.return_value = [(1,)]
+        test_instance.client.conn.rollback.side_effect = \
+            psycopg.OperationalError('the connection is lost')
+        test_instance.client.conn.closed = True
+
+        assert test_instance.execute_parameterized_query(
+            'QUERY %s', ['param']) == [(1,)]
+
+        assert test_instance.client.connect.call_count == 2
@@ -0,0 +1,84 @@
+import logging
+import os
+import pytest
+import threading
+import time
+
+from lib.executor_registry import ExecutorRegistry, ExecutorRegistryError
+
+
+class TestExecutorRegistry:
+
+    @pytest.fixture
+    def test_instance(self):
+        os.environ['OBFUSCATION_WORKERS'] = '3'
+        os.environ['GEOSUPPORT_WORKERS'] = '1'
+        registry = ExecutorRegistry()
+        yield registry
+        registry.shutdown()
+        del os.environ['OBFUSCATION_WORKERS']
+        del os.environ['GEOSUPPORT_WORKERS']
+
+    def test_get(self, test_instance):
+        pool = test_instance.get('cpu_hashing')
+
+        assert test_instance.get('cpu_hashing') is pool
+        assert pool._max_workers == 3
+        assert test_instance.get('blocking_io')._max_workers == 4
+        assert test_instance.get('geosupport')._max_workers == 1
+        assert test_instance.get('hedged_census_geocoder') is not (
+            test_instance.get('census_geocoder'))
+
+    def test_get_from_many_threads(self, test_instance, mocker):
+        # Creating a pool is slowed down so that every thread requests it
+        # before the first one is created
+        pool_class = mocker.patch(
+            'lib.executor_registry.InstrumentedThreadPoolExecutor',
+            side_effect=lambda **kwargs: time.sleep(0.05) or object())
+        pools = []
+        threads = [threading.Thread(
+            target=lambda: pools.append(test_instance.get('blocking_io')))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pool_class.assert_called_once()
+        assert all(pool is pools[0] for pool in pools)
+        test_instance.pools = {}
+
+    def test_get_unknown_pool(self, test_instance):
+        with pytest.raises(ExecutorRegistryError):
+            test_instance.get('bad_pool')
+
+    def test_shutdown(self, test_instance):
+        pool = test_instance.get('blocking_io')
+        test_instance.shutdown()
+
+        assert test_instance.pools == {}
+        assert test_instance.get('blocking_io') is not pool
+
+    def test_stats(self, test_instance):
+        pool = test_instance.get('geosupport')
+        release = threading.Event()
+        futures = [pool.submit(release.wait) for _ in range(3)]
+        release.set()
+        for future in futures:
+            future.result()
+
+        stats = pool.reset_stats()
+        assert stats['completed_tasks'] == 3
+        assert stats['queue_depth'] == 0
+        assert stats['peak_queue_depth'] >= 2
+        assert 0 <= stats['utilization'] <= 1
+        assert pool.reset_stats()['completed_tasks'] == 0
+
+    def test_log_stats(self, test_instance, caplog):
+        list(test_instance.get('cpu_hashing').map(str, range(5)))
+
+        with caplog.at_level(logging.INFO):
+            test_instance.log_stats()
+
+        assert 'Executor pool cpu_hashing: (5) tasks, queue depth 0' in \
+            caplog.text
@@ -0,0 +1,95 @@
+import os
+import pytest
+
+from lib import GeocodeCache
+from tests.test_helpers import TestHelpers
+
+
+class TestGeocodeCache:
+
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        os.environ['BCRYPT_SALT'] = 'test_salt'
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        del os.environ['BCRYPT_SALT']
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return GeocodeCache(str(tmp_path / 'geocodes.db'), ttl_seconds=100,
+                            max_entries=2, failure_ttl_seconds=10)
+
+    def test_get_and_set_geoids(self, test_instance):
+        assert test_instance.get_geoids(['1|A ST', '2|B ST']) == {}
+
+        test_instance.set_geoids({'1|A ST': '11111', '2|B ST': '22222'})
+
+        assert test_instance.get_geoids(['1|A ST', '3|C ST', '1|A ST']) == {
+            '1|A ST': '11111'}
+        assert test_instance.hits == 1
+        assert test_instance.lookups == 4
+
+    def test_addresses_not_stored(self, test_instance):
+        test_instance.set_geoids({'1|A ST': '11111'})
+
+        digest, geoid, _ = test_instance.conn.execute(
+            'SELECT * FROM geocodes;').fetchone()
+        assert 'A ST' not in digest
+        assert geoid == '11111'
+
+    def test_ttl(self, test_instance, mocker):
+        mock_time = mocker.patch('lib.geocode_cache.time.time')
+        mock_time.return_value = 1000
+        test_instance.set_geoids({'1|A ST': '11111'})
+
+        mock_time.return_value = 1100
+        assert test_instance.get_geoids(['1|A ST']) == {'1|A ST': '11111'}
+        mock_time.return_value = 1101
+        assert test_instance.get_geoids(['1|A ST']) == {}
+
+        test_instance.set_geoids({'2|B ST': '22222'})
+        assert test_instance.conn.execute(
+            'SELECT COUNT(*) FROM geocodes;').fetchone()[0] == 1
+
+    def test_size_eviction(self, test_instance, mocker):
+        mock_time = mocker.patch('lib.geocode_cache.time.time')
+        for i in range(1, 4):
+            mock_time.return_value = 1000 + i
+            test_instance.set_geoids({'{}|A ST'.format(i): str(i)})
+
+        assert test_instance.get_geoids(['1|A ST', '2|A ST', '3|A ST']) == {
+            '2|A ST': '2', '3|A ST': '3'}
+
+    def test_failures(self, test_instance, mocker):
+        mock_time = mocker.patch('lib.geocode_cache.time.time')
+        mock_time.return_value = 1000
+        test_instance.set_failures(['1|A ST', '2|B ST'])
+
+        mock_time.return_value = 1010
+        assert test_instance.get_failures(['1|A ST', '3|C ST']) == {'1|A ST'}
+        assert test_instance.get_geoids(['1|A ST']) == {}
+        mock_time.return_value = 1011
+        assert test_instance.get_failures(['1|A ST']) == set()
+
+    def test_set_geoids_clears_failures(self, test_instance):
+        test_instance.set_failures(['1|A ST'])
+        test_instance.set_geoids({'1|A ST': '11111'})
+
+        assert test_instance.get_failures(['1|A ST']) == set()
+        assert test_instance.get_geoids(['1|A ST']) == {'1|A ST': '11111'}
+
+    def test_log_stats(self, test_instance, caplog):
+        test_instance.set_geoids({'1|A ST': '11111'})
+        test_instance.set_failures(['2|B ST'])
+        test_instance.get_geoids(['1|A ST', '2|B ST'])
+        test_instance.get_failures(['2|B ST'])
+
+        test_instance.log_stats()
+
+        assert 'Geocode cache hit rate: 1/2 (50%)' in caplog.text
+        assert 'Skipped geocoding (1) distinct addresses' in caplog.text
+        assert test_instance.lookups == 0
+        assert test_instance.failure_hits == 0
@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from concurrent.futures import Future
+from lib.geosupport_hedge import GeosupportHedge
+
+_ADDRESS_DF = pd.DataFrame(
+    {'house_number': ['1', '1', '2', '3'],
+     'street_name': ['A St', 'A St', 'B St', 'C St'],
+     'postal_code': ['10451', '10451', '10451', '10451']},
+    index=[5, 2, 7, 1], dtype='string')
+
+
+def _future(result=None):
+    future = Future()
+    if result is not None:
+        future.set_result(result)
+    return future
+
+
+class TestGeosupportHedge:
+
+    @pytest.fixture
+    def futures(self):
+        return {5: _future('36005000100'), 7: _future(),
+                1: _future()}
+
+    @pytest.fixture
+    def test_instance(self, mocker, futures):
+        mock_client = mocker.MagicMock()
+        mock_client.submit_geoids.return_value = list(futures.values())
+        test_instance = GeosupportHedge(
+            mock_client, _ADDRESS_DF,
+            ['house_number', 'street_name', 'postal_code'], 'executor')
+        assert list(mock_client.submit_geoids.call_args.args[0].index) == [
+            5, 7, 1]
+        assert mock_client.submit_geoids.call_args.args[1] == 'executor'
+        return test_instance
+
+    def test_race_census_first(self, test_instance, futures):
+        futures[1].set_result('36005000400')
+        census_future = _future((pd.Series(
+            ['36005999999', None, '36005000300', None],
+            index=[5, 2, 7, 1], dtype=object), pd.Index([])))
+
+        geoids, bypassed_indices = test_instance.race(census_future)
+
+        # The finished NYC geocoder request wins for both rows sharing it,
+        # the census geoid wins for row 7, and row 1 is filled in by the NYC
+        # geocoder
+        assert list(geoids) == [
+            '36005000100', '36005000100', '36005000300', '36005000400']
+        assert len(bypassed_indices) == 0
+        assert futures[7].cancelled()
+        assert test_instance.nyc_wins == 3
+        assert test_instance.census_wins == 1
+
+    def test_race_nyc_first(self, test_instance, futures):
+        futures[7].set_result('36005000300')
+        futures[1].set_result('36005000400')
+        census_future = _future()
+
+        geoids, bypassed_indices = test_instance.race(census_future)
+
+        # The census geocoder request isn't waited on
+        assert list(geoids) == [
+            '36005000100', '36005000100', '36005000300', '36005000400']
+        assert len(bypassed_indices) == 0
+        assert census_future.cancelled()
+        assert test_instance.census_wins == 0
+
+    def test_race_without_geoid(self, test_instance, futures):
+        futures[7].set_result(None)
+        futures[1].set_result(None)
+        census_future = _future((pd.Series(
+            [None, None, '36005000300', None], index=[5, 2, 7, 1],
+            dtype=object), pd.Index([1])))
+
+        geoids, bypassed_indices = test_instance.race(census_future)
+
+        assert list(geoids[:3]) == [
+            '36005000100', '36005000100', '36005000300']
+        assert pd.isnull(geoids[1])
+        assert list(bypassed_indices) == [1]
+
+    def test_cancel(self, test_instance, futures):
+        test_instance.cancel()
+
+        assert futures[7].cancelled()
+        assert futures[1].cancelled()
@@ -1,3 +1,4 @@
+import os
 import pytest
 import main
 
@@ -33,3 +34,29 @@ class TestMain:
             mocker.call(PipelineMode.NEW_PATRONS),
             mocker.call(PipelineMode.UPDATED_PATRONS),
             mocker.call(PipelineMode.DELETED_PATRONS)])
+
+    def test_main_concurrent_modes(self, test_instance, mocker):
+        os.environ['RUN_MODES_CONCURRENTLY'] = 'True'
+        mock_pipeline_controller = mocker.MagicMock()
+        mock_controller_initializer = mocker.patch(
+            'main.PipelineController', return_value=mock_pipeline_controller)
+        main.main()
+
+        assert mock_controller_initializer.call_count == 3
+        poller_state_locks = {
+            call.kwargs['poller_state_lock']
+            for call in mock_controller_initializer.call_args_list}
+        assert len(poller_state_locks) == 1
+        session_states = {
+            call.kwargs['session_state']
+            for call in mock_controller_initializer.call_args_list}
+        assert len(session_states) == 1
+        mock_controller_initializer.assert_called_with(
+            '2023-01-01T01:23:45+00:00',
+            poller_state_lock=poller_state_locks.pop(),
+            session_state=session_states.pop())
+        mock_pipeline_controller.run_pipeline.assert_has_calls([
+            mocker.call(PipelineMode.NEW_PATRONS),
+            mocker.call(PipelineMode.UPDATED_PATRONS),
+            mocker.call(PipelineMode.DELETED_PATRONS)], any_order=True)
+        del os.environ['RUN_MODES_CONCURRENTLY']
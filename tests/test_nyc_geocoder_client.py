@@ -1,8 +1,11 @@
+import os
 import pandas as pd
 import pytest
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from geosupport.error import GeosupportError
-from lib import NycGeocoderClient
+from lib import NycGeocoderClient, NycGeocoderClientError
+from lib.nyc_geocoder_client import _geocode, _resolve_row_futures
 from pandas.testing import assert_series_equal
 
 
@@ -22,41 +25,49 @@ class TestNycGeocoderClient:
         mocker.patch('geosupport.Geosupport')
         return NycGeocoderClient()
 
-    def test_geocode_address(self, test_instance):
+    def test_geocode(self, test_instance):
         test_instance.geosupport.address.return_value = {
             'First Borough Name': 'BRONX',
             '2020 Census Tract': '123456'}
 
-        assert test_instance._geocode_address(
-            (5, _ADDRESS_DF.loc[5])) == (5, '36005123456')
+        assert _geocode(
+            test_instance.geosupport, '123', 'ave', '11111') == '36005123456'
         test_instance.geosupport.address.assert_called_once_with(
             house_number='123', street_name='ave', zip_code='11111',
             street_name_normalization='C')
 
-    def test_geocode_address_no_tract(self, test_instance):
+    def test_geocode_no_tract(self, test_instance):
         test_instance.geosupport.address.return_value = {
             'First Borough Name': 'NOT A BOROUGH',
             '2020 Census Tract': '123456'}
 
-        assert test_instance._geocode_address(
-            (5, _ADDRESS_DF.loc[5])) == (5, None)
+        assert _geocode(
+            test_instance.geosupport, '123', 'ave', '11111') is None
 
-    def test_geocode_address_error(self, test_instance):
+    def test_geocode_error(self, test_instance):
         test_instance.geosupport.address.side_effect = GeosupportError('error')
 
-        assert test_instance._geocode_address(
-            (5, _ADDRESS_DF.loc[5])) == (5, None)
+        assert _geocode(
+            test_instance.geosupport, '123', 'ave', '11111') is None
 
     def test_get_geoids(self, test_instance, mocker):
-        test_instance.geosupport.address.side_effect = [
-            {'First Borough Name': 'BRONX', '2020 Census Tract': '123456'},
-            {'First Borough Name': 'BROOKLYN', '2010 Census Tract': '789012'},
-            {'First Borough Name': 'MANHATTAN', '2000 Census Tract': '345678'},
-            {'First Borough Name': 'QUEENS', '1990 Census Tract': '901234'},
-            {'First Borough Name': 'STATEN IS',
-             '2020 Census Tract': '567890', '2010 Census Tract': '999999'},
-            {'First Borough Name': 'BRONX'}
-        ]
+        # Keyed on the house number, since the addresses are geocoded on
+        # several threads in no particular order
+        results = {
+            '123': {'First Borough Name': 'BRONX',
+                    '2020 Census Tract': '123456'},
+            '456': {'First Borough Name': 'BROOKLYN',
+                    '2010 Census Tract': '789012'},
+            '789': {'First Borough Name': 'MANHATTAN',
+                    '2000 Census Tract': '345678'},
+            '01-23': {'First Borough Name': 'QUEENS',
+                      '1990 Census Tract': '901234'},
+            '4': {'First Borough Name': 'STATEN IS',
+                  '2020 Census Tract': '567890',
+                  '2010 Census Tract': '999999'},
+            '5': {'First Borough Name': 'BRONX'}}
+        test_instance.geosupport.address.side_effect = \
+            lambda house_number, **kwargs: results[house_number]
 
         assert_series_equal(test_instance.get_geoids(_ADDRESS_DF), pd.Series(
             ['36005123456', '36047789012', '36061345678', '36081901234',
@@ -75,3 +86,107 @@ class TestNycGeocoderClient:
             mocker.call(house_number='5', street_name='rd',
                         zip_code='77777', street_name_normalization='C'),
         ], any_order=True)
+
+    def test_get_geoids_with_executor(self, test_instance):
+        test_instance.geosupport.address.return_value = {
+            'First Borough Name': 'BRONX', '2020 Census Tract': '123456'}
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert_series_equal(
+                test_instance.get_geoids(_ADDRESS_DF.loc[[5, 4]],
+                                         executor=executor),
+                pd.Series(['36005123456', '36005123456'], index=[5, 4],
+                          name='geoid'))
+
+    def test_submit_geoids(self, test_instance):
+        test_instance.geosupport.address.return_value = {
+            'First Borough Name': 'BRONX', '2020 Census Tract': '123456'}
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            futures = test_instance.submit_geoids(_ADDRESS_DF.loc[[5, 4]],
+                                                  executor)
+            assert [future.result() for future in futures] == [
+                '36005123456', '36005123456']
+
+    def test_get_geoids_with_processes(self, mocker):
+        os.environ['GEOSUPPORT_BACKEND'] = 'process'
+        os.environ['GEOSUPPORT_CHUNK_SIZE'] = '2'
+        mock_geosupport = mocker.patch('geosupport.Geosupport')
+        mock_geosupport.return_value.address.return_value = {
+            'First Borough Name': 'BRONX', '2020 Census Tract': '123456'}
+
+        # Threads stand in for worker processes, which can't see the mocks
+        def mock_process_pool_executor(mp_context, **kwargs):
+            assert mp_context.get_start_method() == 'spawn'
+            return ThreadPoolExecutor(**kwargs)
+
+        mocker.patch('lib.nyc_geocoder_client.ProcessPoolExecutor',
+                     new=mock_process_pool_executor)
+        test_instance = NycGeocoderClient()
+
+        assert_series_equal(
+            test_instance.get_geoids(_ADDRESS_DF.loc[[5, 4, 3]],
+                                     executor='ignored'),
+            pd.Series(['36005123456', '36005123456', '36005123456'],
+                      index=[5, 4, 3], name='geoid', dtype=object))
+        mock_geosupport.return_value.address.assert_any_call(
+            house_number='789', street_name='blvd', zip_code='33333-4444',
+            street_name_normalization='C')
+        assert test_instance.process_pool is not None
+        test_instance.close()
+        assert test_instance.process_pool is None
+
+        del os.environ['GEOSUPPORT_BACKEND']
+        del os.environ['GEOSUPPORT_CHUNK_SIZE']
+
+    def test_submit_geoids_with_processes(self, mocker):
+        os.environ['GEOSUPPORT_BACKEND'] = 'process'
+        os.environ['GEOSUPPORT_CHUNK_SIZE'] = '2'
+        mock_geosupport = mocker.patch('geosupport.Geosupport')
+        mock_geosupport.return_value.address.side_effect = \
+            lambda house_number, **kwargs: {
+                'First Borough Name': 'BRONX',
+                '2020 Census Tract': house_number.zfill(6)}
+        mocker.patch('lib.nyc_geocoder_client.ProcessPoolExecutor',
+                     new=lambda mp_context, **kwargs: ThreadPoolExecutor(
+                         **kwargs))
+        test_instance = NycGeocoderClient()
+
+        futures = test_instance.submit_geoids(_ADDRESS_DF.loc[[5, 4, 3]],
+                                              executor='ignored')
+
+        assert [future.result() for future in futures] == [
+            '36005000123', '36005000456', '36005000789']
+        test_instance.close()
+
+        del os.environ['GEOSUPPORT_BACKEND']
+        del os.environ['GEOSUPPORT_CHUNK_SIZE']
+
+    def test_resolve_row_futures(self):
+        chunk_future = Future()
+        row_futures = [Future(), Future()]
+        row_futures[0].cancel()
+        chunk_future.set_result(['36005000100', '36005000200'])
+
+        _resolve_row_futures(row_futures, chunk_future)
+
+        assert row_futures[0].cancelled()
+        assert row_futures[1].result() == '36005000200'
+
+    def test_unknown_backend(self, mocker):
+        os.environ['GEOSUPPORT_BACKEND'] = 'bad_backend'
+        mocker.patch('geosupport.Geosupport')
+
+        with pytest.raises(NycGeocoderClientError):
+            NycGeocoderClient()
+
+        del os.environ['GEOSUPPORT_BACKEND']
+
+    def test_get_geoids_empty(self, test_instance):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            geoids = test_instance.get_geoids(_ADDRESS_DF.iloc[:0],
+                                              executor=executor)
+
+        assert len(geoids) == 0
+        assert geoids.name == 'geoid'
+        test_instance.geosupport.address.assert_not_called()
@@ -0,0 +1,109 @@
+import os
+import pytest
+import threading
+
+from lib import ObfuscationCache
+from tests.test_helpers import TestHelpers
+
+
+def _fake_obfuscate_all(values):
+    return ['obfuscated_' + value for value in values]
+
+
+class TestObfuscationCache:
+
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        os.environ['BCRYPT_SALT'] = 'test_salt'
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        del os.environ['BCRYPT_SALT']
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return ObfuscationCache(str(tmp_path / 'cache.db'), lru_size=2)
+
+    def test_obfuscate(self, test_instance, mocker):
+        mock_obfuscate_all = mocker.MagicMock(side_effect=_fake_obfuscate_all)
+
+        assert test_instance.obfuscate(
+            ['1', '2', '1'], mock_obfuscate_all) == [
+            'obfuscated_1', 'obfuscated_2', 'obfuscated_1']
+        assert test_instance.obfuscate(
+            ['2', '3'], mock_obfuscate_all) == [
+            'obfuscated_2', 'obfuscated_3']
+
+        assert mock_obfuscate_all.call_args_list == [
+            mocker.call(['1', '2']), mocker.call(['3'])]
+        assert test_instance.memory_hits == 1
+        assert test_instance.disk_hits == 0
+        assert test_instance.misses == 4
+        assert list(test_instance.lru.values()) == [
+            'obfuscated_2', 'obfuscated_3']
+
+    def test_obfuscate_from_disk(self, test_instance, mocker):
+        test_instance.obfuscate(['1', '2', '3'], _fake_obfuscate_all)
+        mock_obfuscate_all = mocker.MagicMock()
+
+        assert test_instance.obfuscate(['1'], mock_obfuscate_all) == [
+            'obfuscated_1']
+
+        mock_obfuscate_all.assert_not_called()
+        assert test_instance.disk_hits == 1
+
+    def test_plaintext_not_stored(self, test_instance):
+        test_instance.obfuscate(['12345'], _fake_obfuscate_all)
+
+        digest, obfuscated = test_instance.conn.execute(
+            'SELECT digest, obfuscated FROM obfuscations;').fetchone()
+        assert '12345' not in digest
+        assert obfuscated == 'obfuscated_12345'
+
+    def test_snapshot(self, test_instance, mocker, tmp_path):
+        snapshot_file = str(tmp_path / 'snapshot.db')
+        test_instance.snapshot_file = snapshot_file
+        test_instance.obfuscate(['1', '2'], _fake_obfuscate_all)
+        test_instance.close()
+        assert test_instance.conn is None
+        assert test_instance.misses == 0
+
+        warm_instance = ObfuscationCache(
+            str(tmp_path / 'new_cache.db'), snapshot_file=snapshot_file)
+        mock_obfuscate_all = mocker.MagicMock()
+        assert warm_instance.obfuscate(['2', '1'], mock_obfuscate_all) == [
+            'obfuscated_2', 'obfuscated_1']
+        mock_obfuscate_all.assert_not_called()
+        assert warm_instance.disk_hits == 2
+
+    def test_concurrent_snapshots(self, tmp_path):
+        snapshot_file = str(tmp_path / 'snapshot.db')
+        errors = []
+
+        def save_snapshot(cache_file):
+            instance = ObfuscationCache(cache_file)
+            instance.obfuscate(['1', '2'], _fake_obfuscate_all)
+            try:
+                instance.save_snapshot(snapshot_file)
+            except Exception as e:
+                errors.append(e)
+            instance.close()
+
+        threads = [threading.Thread(
+            target=save_snapshot,
+            args=(str(tmp_path / 'cache_{}.db'.format(i)),))
+            for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every writer used its own temp file, and none were left behind
+        assert errors == []
+        assert not list(tmp_path.glob('snapshot.db.*'))
+        warm_instance = ObfuscationCache(
+            str(tmp_path / 'new_cache.db'), snapshot_file=snapshot_file)
+        assert warm_instance.obfuscate(['1'], None) == ['obfuscated_1']
+        warm_instance.close()
@@ -0,0 +1,96 @@
+import os
+import pytest
+
+from lib.obfuscation_engine import (ObfuscationEngine, ObfuscationEngineError,
+                                    ProcessObfuscationEngine,
+                                    SerialObfuscationEngine,
+                                    ThreadObfuscationEngine,
+                                    create_obfuscation_engine, get_cpu_quota)
+
+
+class TestObfuscationEngine:
+
+    def test_serial_engine(self):
+        assert SerialObfuscationEngine().map(str.upper, ['a', 'b']) == [
+            'A', 'B']
+
+    def test_thread_engine(self):
+        engine = ThreadObfuscationEngine(2)
+        assert engine.map(str.upper, ['a', 'b', 'c']) == ['A', 'B', 'C']
+        assert engine.executor is not None
+        engine.close()
+        assert engine.executor is None
+
+    def test_process_engine(self):
+        engine = ProcessObfuscationEngine(2, chunk_size=2)
+        values = [str(i) for i in range(7)]
+        assert engine.map(str.upper, values) == values
+        assert engine.executor._mp_context.get_start_method() == 'spawn'
+        engine.close()
+
+    def test_process_engine_small_input(self):
+        engine = ProcessObfuscationEngine(2, chunk_size=10)
+        assert engine.map(str.upper, ['a']) == ['A']
+        assert engine.executor is None
+
+    def test_process_engine_spreads_input_across_workers(self, mocker):
+        engine = ProcessObfuscationEngine(3, chunk_size=2000)
+        engine.executor = mocker.MagicMock()
+        engine.executor.map.side_effect = map
+        values = [str(i) for i in range(10)]
+
+        assert engine.map(str.upper, values) == values
+        assert [len(chunk) for chunk in
+                engine.executor.map.call_args.args[2]] == [4, 4, 2]
+
+    def test_engine_is_abstract(self):
+        with pytest.raises(TypeError):
+            ObfuscationEngine(1)
+
+    def test_create_obfuscation_engine(self):
+        os.environ['OBFUSCATION_ENGINE'] = 'process'
+        os.environ['OBFUSCATION_WORKERS'] = '3'
+        os.environ['OBFUSCATION_CHUNK_SIZE'] = '100'
+        engine = create_obfuscation_engine()
+        assert isinstance(engine, ProcessObfuscationEngine)
+        assert engine.workers == 3
+        assert engine.chunk_size == 100
+
+        os.environ['OBFUSCATION_ENGINE'] = 'bad_engine'
+        with pytest.raises(ObfuscationEngineError):
+            create_obfuscation_engine()
+
+        del os.environ['OBFUSCATION_ENGINE']
+        del os.environ['OBFUSCATION_WORKERS']
+        del os.environ['OBFUSCATION_CHUNK_SIZE']
+
+    def test_get_cpu_quota_v2(self, tmp_path, mocker):
+        mocker.patch('lib.obfuscation_engine.os.cpu_count', return_value=8)
+        (tmp_path / 'cpu.max').write_text('150000 100000\n')
+        assert get_cpu_quota(str(tmp_path)) == 2
+
+        (tmp_path / 'cpu.max').write_text('max 100000\n')
+        assert get_cpu_quota(str(tmp_path)) == 8
+
+    def test_get_cpu_quota_v1(self, tmp_path, mocker):
+        mocker.patch('lib.obfuscation_engine.os.cpu_count', return_value=8)
+        (tmp_path / 'cpu').mkdir()
+        (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('400000\n')
+        (tmp_path / 'cpu' / 'cpu.cfs_period_us').write_text('100000\n')
+        assert get_cpu_quota(str(tmp_path)) == 4
+
+        (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('-1\n')
+        assert get_cpu_quota(str(tmp_path)) == 8
+
+    def test_get_cpu_quota_no_cgroup(self, tmp_path, mocker):
+        mocker.patch('lib.obfuscation_engine.os.cpu_count', return_value=8)
+        assert get_cpu_quota(str(tmp_path)) == 8
+
+    def test_thread_engine_with_registry(self, mocker):
+        mock_registry = mocker.MagicMock()
+        mock_registry.get.return_value.map.return_value = iter(['A'])
+        engine = ThreadObfuscationEngine(2, mock_registry)
+
+        assert engine.map(str.upper, ['a']) == ['A']
+        mock_registry.get.assert_called_once_with('cpu_hashing')
+        assert engine.executor is None
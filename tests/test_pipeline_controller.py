@@ -6,7 +6,12 @@ import os
 import pandas as pd
 import pytest
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Lock
 from helpers.pipeline_mode import PipelineMode
+from lib import CensusGeocoderCircuitOpenError
+from lib.concurrent_session_state import ConcurrentSessionState
+from lib.geocode_cache import GeocodeCache
 from lib.pipeline_controller import PipelineController, PipelineControllerError
 from pandas.testing import assert_frame_equal, assert_series_equal
 from tests.test_helpers import TestHelpers
@@ -85,6 +90,9 @@ _LAST_DELETED_SIERRA_ROW = pd.Series(
      'deletion_date_et': datetime.date(2022, 3, 3)},
     name=2)
 
+_QUERY_PARAMS = {'param': 'value'}
+_REDSHIFT_QUERY_PARAMS = ['value']
+
 _REDSHIFT_ADDRESS_RESULTS = [
     ['addr_hash_9', 'obfuscated_patron_9', '99999999999', 'zz'],
     ['addr_hash_8', 'obfuscated_patron_8', '88888888888', 'yy']]
@@ -108,7 +116,8 @@ _GEOCODER_INPUT = pd.DataFrame(
 
 _GEOID_OUTPUT = pd.DataFrame(
     {'patron_id': ['obfuscated_5', 'obfuscated_6', 'obfuscated_4'],
-     'geoid': ['67890', None, '12345']}, index=[1, 2, 0])
+     'geoid': ['67890', None, '12345'],
+     'geocoding_deferred': [False, False, False]}, index=[1, 2, 0])
 
 _NEW_AVRO_ENCODER_INPUT = [
     {'patron_id': 'obfuscated_4', 'address_hash': 'obfuscated_1',
@@ -243,7 +252,8 @@ _ALL_GEOIDS = pd.DataFrame({
                   'obfuscated_4', 'obfuscated_5', 'obfuscated_6',
                   'obfuscated_7'],
     'geoid': ['00111222222', np.nan, '99000111111', '3344455555',
-              '66777888888', np.nan, np.nan]},
+              '66777888888', np.nan, np.nan],
+    'geocoding_deferred': False},
     index=[1, 0, 3, 2, 4, 10, 5])
 
 
@@ -268,15 +278,30 @@ class TestMain:
         mocker.patch('lib.pipeline_controller.AvroEncoder')
         return PipelineController('2023-01-01 12:34:56+00:00')
 
+    def test_redshift_temp_table_threshold_too_large(self, mocker):
+        os.environ['REDSHIFT_TEMP_TABLE_THRESHOLD'] = '40000'
+        mocker.patch('lib.pipeline_controller.S3Client')
+        mocker.patch('lib.pipeline_controller.PostgreSQLClient')
+        mocker.patch('lib.pipeline_controller.RedshiftClient')
+        mocker.patch('lib.pipeline_controller.CensusGeocoderApiClient')
+        mocker.patch('lib.pipeline_controller.NycGeocoderClient')
+        mocker.patch('lib.pipeline_controller.KinesisClient')
+        mocker.patch('lib.pipeline_controller.AvroEncoder')
+
+        with pytest.raises(PipelineControllerError):
+            PipelineController('2023-01-01 12:34:56+00:00')
+        del os.environ['REDSHIFT_TEMP_TABLE_THRESHOLD']
+
     def test_run_new_patrons_pipeline(self, test_instance, mocker):
         os.environ['MAX_BATCHES'] = '3'
         test_instance.has_max_batches = True
 
         mocker.patch(
             'lib.pipeline_controller.PipelineController._run_active_patrons_single_iteration',  # noqa: E501
-            side_effect=[pd.Series({
+            side_effect=[(pd.Series({
+                'patron_id_plaintext': str(i),
                 'creation_timestamp': pd.Timestamp(
-                    _CREATION_DT.format(i), tz='America/New_York')}, name=3)
+                    _CREATION_DT.format(i), tz='America/New_York')}), 4)
                 for i in range(2, 5)])
 
         test_instance.s3_client.fetch_cache.side_effect = [
@@ -292,7 +317,7 @@ class TestMain:
         test_instance._run_active_patrons_single_iteration.assert_called_with(
             PipelineMode.NEW_PATRONS)
         test_instance.s3_client.set_cache.assert_has_calls([mocker.call(
-            {'creation_dt': _CREATION_DT.format(i),
+            {'creation_dt': _CREATION_DT.format(i), 'creation_id': i,
              'update_dt': _UPDATE_DT.format(1),
              'deletion_date': _DELETION_DATE.format(1)}) for i in range(2, 5)]
         )
@@ -300,19 +325,47 @@ class TestMain:
         test_instance.kinesis_client.close.assert_called_once()
         del os.environ['MAX_BATCHES']
 
+    def test_run_pipeline_ends_when_geocoding_deferred(
+            self, test_instance, mocker):
+        def mock_single_iteration(mode):
+            test_instance.geocoding_deferred = True
+            return pd.Series({
+                'patron_id_plaintext': '2',
+                'creation_timestamp': pd.Timestamp(
+                    _CREATION_DT.format(2), tz='America/New_York')}), 4
+
+        mocker.patch(
+            'lib.pipeline_controller.PipelineController._run_active_patrons_single_iteration',  # noqa: E501
+            side_effect=mock_single_iteration)
+        test_instance.s3_client.fetch_cache.return_value = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+
+        test_instance.run_pipeline(PipelineMode.NEW_PATRONS)
+
+        test_instance._run_active_patrons_single_iteration.assert_called_once()
+        test_instance.s3_client.set_cache.assert_called_once_with(
+            {'creation_dt': _CREATION_DT.format(2), 'creation_id': 2,
+             'update_dt': _UPDATE_DT.format(1),
+             'deletion_date': _DELETION_DATE.format(1)})
+
     def test_run_updated_patrons_pipeline(self, test_instance, mocker):
         mocker.patch(
             'lib.pipeline_controller.PipelineController._run_active_patrons_single_iteration',  # noqa: E501
             side_effect=[
-                pd.Series({'last_updated_timestamp':
-                           pd.Timestamp(_UPDATE_DT.format(2), tz='America/New_York')},  # noqa: E501
-                          name=3),
-                pd.Series({'last_updated_timestamp':
-                           pd.Timestamp(_UPDATE_DT.format(3), tz='America/New_York')},  # noqa: E501
-                          name=3),
-                pd.Series({'last_updated_timestamp':
-                           pd.Timestamp(_UPDATE_DT.format(4), tz='America/New_York')},  # noqa: E501
-                          name=1)])
+                (pd.Series({'patron_id_plaintext': '2',
+                            'last_updated_timestamp':
+                            pd.Timestamp(_UPDATE_DT.format(2), tz='America/New_York')}),  # noqa: E501
+                 4),
+                (pd.Series({'patron_id_plaintext': '3',
+                            'last_updated_timestamp':
+                            pd.Timestamp(_UPDATE_DT.format(3), tz='America/New_York')}),  # noqa: E501
+                 4),
+                (pd.Series({'patron_id_plaintext': '4',
+                            'last_updated_timestamp':
+                            pd.Timestamp(_UPDATE_DT.format(4), tz='America/New_York')}),  # noqa: E501
+                 2)])
 
         test_instance.s3_client.fetch_cache.side_effect = [
             {'creation_dt': _CREATION_DT.format(1),
@@ -328,7 +381,7 @@ class TestMain:
             PipelineMode.UPDATED_PATRONS)
         test_instance.s3_client.set_cache.assert_has_calls([mocker.call(
             {'creation_dt': _CREATION_DT.format(1),
-             'update_dt': _UPDATE_DT.format(i),
+             'update_dt': _UPDATE_DT.format(i), 'update_id': i,
              'deletion_date': _DELETION_DATE.format(1)}) for i in range(2, 5)]
         )
         test_instance.s3_client.close.assert_called_once()
@@ -341,18 +394,24 @@ class TestMain:
         mocker.patch(
             'lib.pipeline_controller.PipelineController._run_deleted_patrons_single_iteration',  # noqa: E501
             side_effect=[
-                pd.Series({'deletion_date_et':
-                           datetime.datetime.strptime(_DELETION_DATE.format(2),
-                                                      '%Y-%m-%d').date()},
-                          name=2),
-                pd.Series({'deletion_date_et':
-                           datetime.datetime.strptime(_DELETION_DATE.format(3),
-                                                      '%Y-%m-%d').date()},
-                          name=2),
-                pd.Series({'deletion_date_et':
-                           datetime.datetime.strptime(_DELETION_DATE.format(4),
-                                                      '%Y-%m-%d').date()},
-                          name=1)])
+                (pd.Series({'patron_id_plaintext': '2',
+                            'deletion_date_et':
+                            datetime.datetime.strptime(
+                                _DELETION_DATE.format(2),
+                                '%Y-%m-%d').date()}),
+                 3),
+                (pd.Series({'patron_id_plaintext': '3',
+                            'deletion_date_et':
+                            datetime.datetime.strptime(
+                                _DELETION_DATE.format(3),
+                                '%Y-%m-%d').date()}),
+                 3),
+                (pd.Series({'patron_id_plaintext': '4',
+                            'deletion_date_et':
+                            datetime.datetime.strptime(
+                                _DELETION_DATE.format(4),
+                                '%Y-%m-%d').date()}),
+                 2)])
 
         test_instance.s3_client.fetch_cache.side_effect = [
             {'creation_dt': _CREATION_DT.format(1),
@@ -367,8 +426,8 @@ class TestMain:
         test_instance.s3_client.set_cache.assert_has_calls([mocker.call(
             {'creation_dt': _CREATION_DT.format(1),
              'update_dt': _UPDATE_DT.format(1),
-             'deletion_date': _DELETION_DATE.format(i)}) for i in range(2, 5)]
-        )
+             'deletion_date': _DELETION_DATE.format(i), 'deletion_id': i})
+            for i in range(2, 5)])
         test_instance.s3_client.close.assert_called_once()
         test_instance.kinesis_client.close.assert_called_once()
         del os.environ['MAX_BATCHES']
@@ -381,7 +440,7 @@ class TestMain:
         test_instance.sierra_client.execute_query.return_value = []
 
         mocker.patch('lib.pipeline_controller.build_active_patrons_query',
-                     return_value='NEW PATRONS QUERY')
+                     return_value=('NEW PATRONS QUERY', _QUERY_PARAMS))
 
         test_instance.run_pipeline(PipelineMode.NEW_PATRONS)
 
@@ -398,7 +457,7 @@ class TestMain:
         test_instance.sierra_client.execute_query.return_value = []
 
         mocker.patch('lib.pipeline_controller.build_deleted_patrons_query',
-                     return_value='DELETED PATRONS QUERY')
+                     return_value=('DELETED PATRONS QUERY', _QUERY_PARAMS))
 
         test_instance.run_pipeline(PipelineMode.DELETED_PATRONS)
 
@@ -422,18 +481,20 @@ class TestMain:
             'lib.pipeline_controller.PipelineController._process_unknown_patrons',  # noqa: E501
             return_value=_GEOID_OUTPUT)
         mocker.patch('lib.pipeline_controller.build_active_patrons_query',
-                     return_value='ACTIVE PATRONS QUERY')
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.obfuscate', side_effect=[
             'obfuscated_{}'.format(i) for i in range(1, 7)])
 
-        assert_series_equal(
+        last_record, patron_count = \
             test_instance._run_active_patrons_single_iteration(
-                PipelineMode.NEW_PATRONS), _LAST_NEW_SIERRA_ROW)
+                PipelineMode.NEW_PATRONS)
+        assert_series_equal(last_record, _LAST_NEW_SIERRA_ROW)
+        assert patron_count == 3
 
         test_instance.sierra_client.connect.assert_called_once()
         test_instance.sierra_client.execute_query.assert_called_once_with(
-            'ACTIVE PATRONS QUERY')
-        test_instance.sierra_client.close_connection.assert_called_once()
+            'ACTIVE PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.sierra_client.close_connection.assert_not_called()
 
         mocked_unknown_patrons_method.assert_called_once()
         assert_frame_equal(mocked_unknown_patrons_method.call_args.args[0],
@@ -448,6 +509,72 @@ class TestMain:
         test_instance.kinesis_client.send_records.assert_called_once_with(
             _ENCODED_RECORDS[:3])
 
+    def test_run_new_patrons_single_iteration_async_geocoder(
+            self, test_instance, mocker):
+        test_instance.async_census_geocoder = True
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+
+        test_instance.sierra_client.execute_query.return_value = \
+            _ACTIVE_SIERRA_RESULTS
+
+        test_instance.avro_encoder.encode_batch.return_value = \
+            _ENCODED_RECORDS[:3]
+        mocked_geocode_method = mocker.patch(
+            'lib.pipeline_controller.PipelineController._geocode_unknown_patrons',  # noqa: E501
+            return_value=_GEOID_OUTPUT)
+        mocker.patch('lib.pipeline_controller.build_active_patrons_query',
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
+        mocker.patch('lib.pipeline_controller.obfuscate', side_effect=[
+            'obfuscated_{}'.format(i) for i in range(1, 7)])
+
+        test_instance._run_active_patrons_single_iteration(
+            PipelineMode.NEW_PATRONS)
+
+        mocked_geocode_method.assert_called_once()
+        assert_frame_equal(
+            mocked_geocode_method.call_args.args[0].drop(
+                columns=['patron_id']), _GEOCODER_INPUT)
+        assert test_instance.avro_encoder.encode_batch.call_args.args[
+            0] == _NEW_AVRO_ENCODER_INPUT
+        test_instance.kinesis_client.send_records.assert_called_once_with(
+            _ENCODED_RECORDS[:3])
+
+    def test_run_new_patrons_single_iteration_deferred(
+            self, test_instance, mocker):
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+        test_instance.sierra_client.execute_query.return_value = \
+            _ACTIVE_SIERRA_RESULTS
+        test_instance.avro_encoder.encode_batch.return_value = \
+            _ENCODED_RECORDS[:1]
+        geoid_output = _GEOID_OUTPUT.copy()
+        geoid_output.loc[1, ['geoid', 'geocoding_deferred']] = [None, True]
+        mocker.patch(
+            'lib.pipeline_controller.PipelineController._process_unknown_patrons',  # noqa: E501
+            return_value=geoid_output)
+        mocker.patch('lib.pipeline_controller.build_active_patrons_query',
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
+        mocker.patch('lib.pipeline_controller.obfuscate', side_effect=[
+            'obfuscated_{}'.format(i) for i in range(1, 7)])
+
+        last_record, _ = test_instance._run_active_patrons_single_iteration(
+            PipelineMode.NEW_PATRONS)
+
+        # The patrons from the first deferred one on are held back, and the
+        # cursor only moves past the patron before them
+        assert test_instance.geocoding_deferred
+        assert last_record.name == 0
+        assert test_instance.processed_ids == {'123'}
+        assert test_instance.avro_encoder.encode_batch.call_args.args[
+            0] == _NEW_AVRO_ENCODER_INPUT[:1]
+        test_instance.kinesis_client.send_records.assert_called_once_with(
+            _ENCODED_RECORDS[:1])
+
     def test_run_updated_patrons_single_iteration(self, test_instance, mocker):
         test_instance.processed_ids = {'777'}
         test_instance.poller_state = {
@@ -457,7 +584,8 @@ class TestMain:
 
         test_instance.sierra_client.execute_query.return_value = \
             _ACTIVE_SIERRA_RESULTS + _EXTRA_SIERRA_RESULTS
-        test_instance.redshift_client.execute_query.side_effect = \
+        test_instance.redshift_client.conn.cursor.return_value.fetchall.\
+            side_effect = \
             [_REDSHIFT_ADDRESS_RESULTS, _REDSHIFT_IPHLC_RESULTS]
 
         test_instance.avro_encoder.encode_batch.return_value = \
@@ -466,29 +594,35 @@ class TestMain:
             'lib.pipeline_controller.PipelineController._process_unknown_patrons',  # noqa: E501
             return_value=_GEOID_OUTPUT)
         mocker.patch('lib.pipeline_controller.build_active_patrons_query',
-                     return_value='ACTIVE PATRONS QUERY')
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.build_redshift_address_query',
-                     return_value='REDSHIFT ADDRESS QUERY')
+                     return_value=(
+                         'REDSHIFT ADDRESS QUERY', _REDSHIFT_QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.build_redshift_iphlc_query',
-                     return_value='REDSHIFT IPHLC QUERY')
+                     return_value=(
+                         'REDSHIFT IPHLC QUERY', _REDSHIFT_QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.obfuscate', side_effect=[
             'obfuscated_1', 'obfuscated_2', 'obfuscated_3', 'addr_hash_9',
             'addr_hash_8', 'obfuscated_4', 'obfuscated_5', 'obfuscated_6'])
 
-        assert_series_equal(
+        last_record, patron_count = \
             test_instance._run_active_patrons_single_iteration(
-                PipelineMode.UPDATED_PATRONS), _LAST_UPDATED_SIERRA_ROW)
+                PipelineMode.UPDATED_PATRONS)
+        assert_series_equal(last_record, _LAST_UPDATED_SIERRA_ROW)
+        assert patron_count == 6
 
         test_instance.sierra_client.connect.assert_called_once()
         test_instance.sierra_client.execute_query.assert_called_once_with(
-            'ACTIVE PATRONS QUERY')
-        test_instance.sierra_client.close_connection.assert_called_once()
+            'ACTIVE PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.sierra_client.close_connection.assert_not_called()
 
-        assert test_instance.redshift_client.connect.call_count == 2
-        test_instance.redshift_client.execute_query.assert_has_calls([
-            mocker.call('REDSHIFT ADDRESS QUERY'),
-            mocker.call('REDSHIFT IPHLC QUERY')])
-        assert test_instance.redshift_client.close_connection.call_count == 2
+        test_instance.redshift_client.connect.assert_called_once()
+        test_instance.redshift_client.conn.cursor.return_value.execute.\
+            assert_has_calls([
+                mocker.call('REDSHIFT ADDRESS QUERY', _REDSHIFT_QUERY_PARAMS),
+                mocker.call('REDSHIFT IPHLC QUERY', _REDSHIFT_QUERY_PARAMS)])
+        test_instance.redshift_client.close_connection.assert_not_called()
+        assert test_instance.redshift_connection.reuse_count == 1
 
         mocked_unknown_patrons_method.assert_called_once()
         assert_frame_equal(mocked_unknown_patrons_method.call_args.args[0],
@@ -511,31 +645,35 @@ class TestMain:
 
         test_instance.sierra_client.execute_query.return_value = \
             _DELETED_SIERRA_RESULTS
-        test_instance.redshift_client.execute_query.return_value = \
+        test_instance.redshift_client.conn.cursor.return_value.fetchall.\
+            return_value = \
             _REDSHIFT_PATRON_RESULTS
 
         test_instance.avro_encoder.encode_batch.return_value = \
             _ENCODED_RECORDS[:2]
         mocker.patch('lib.pipeline_controller.build_deleted_patrons_query',
-                     return_value='DELETED PATRONS QUERY')
+                     return_value=('DELETED PATRONS QUERY', _QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.build_redshift_patron_query',
-                     return_value='REDSHIFT PATRON QUERY')
+                     return_value=(
+                         'REDSHIFT PATRON QUERY', _REDSHIFT_QUERY_PARAMS))
         mocker.patch('lib.pipeline_controller.obfuscate', side_effect=[
             'obfuscated_patron_{}'.format(i) for i in range(1, 4)])
 
-        assert_series_equal(
-            test_instance._run_deleted_patrons_single_iteration(),
-            _LAST_DELETED_SIERRA_ROW)
+        last_record, patron_count = \
+            test_instance._run_deleted_patrons_single_iteration()
+        assert_series_equal(last_record, _LAST_DELETED_SIERRA_ROW)
+        assert patron_count == 3
 
         test_instance.sierra_client.connect.assert_called_once()
         test_instance.sierra_client.execute_query.assert_called_once_with(
-            'DELETED PATRONS QUERY')
-        test_instance.sierra_client.close_connection.assert_called_once()
+            'DELETED PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.sierra_client.close_connection.assert_not_called()
 
         test_instance.redshift_client.connect.assert_called_once()
-        test_instance.redshift_client.execute_query.assert_called_once_with(
-            'REDSHIFT PATRON QUERY')
-        test_instance.redshift_client.close_connection.assert_called_once()
+        test_instance.redshift_client.conn.cursor.return_value.execute.\
+            assert_called_once_with('REDSHIFT PATRON QUERY',
+                                    _REDSHIFT_QUERY_PARAMS)
+        test_instance.redshift_client.close_connection.assert_not_called()
 
         # This input check implicitly tests that the Sierra and Redshift
         # dataframes have been joined and the datatypes have been converted
@@ -546,6 +684,179 @@ class TestMain:
         test_instance.kinesis_client.send_records.assert_called_once_with(
             _ENCODED_RECORDS[:2])
 
+    def test_run_active_patrons_single_iteration_streamed(
+            self, test_instance, mocker):
+        test_instance.sierra_fetch_size = 3
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+
+        mock_cursor = test_instance.sierra_client.conn.cursor.return_value
+        mock_cursor.fetchmany.side_effect = [
+            _ACTIVE_SIERRA_RESULTS[:3], _ACTIVE_SIERRA_RESULTS[3:], []]
+        mocked_process_method = mocker.patch(
+            'lib.pipeline_controller.PipelineController._process_active_patrons',  # noqa: E501
+            side_effect=['first chunk', _LAST_NEW_SIERRA_ROW])
+        mocker.patch('lib.pipeline_controller.build_active_patrons_query',
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
+
+        last_record, patron_count = \
+            test_instance._run_active_patrons_single_iteration(
+                PipelineMode.NEW_PATRONS)
+        assert last_record.equals(_LAST_NEW_SIERRA_ROW)
+        assert patron_count == 3
+
+        test_instance.sierra_client.connect.assert_called_once()
+        test_instance.sierra_client.conn.cursor.assert_called_once_with(
+            name='patron_info_poller_cursor', withhold=True)
+        mock_cursor.execute.assert_called_once_with(
+            'ACTIVE PATRONS QUERY', _QUERY_PARAMS)
+        mock_cursor.fetchmany.assert_has_calls([mocker.call(3)] * 3)
+        mock_cursor.close.assert_called_once()
+        test_instance.sierra_client.execute_query.assert_not_called()
+        test_instance.sierra_client.close_connection.assert_not_called()
+
+        assert mocked_process_method.call_count == 2
+        first_chunk = mocked_process_method.call_args_list[0].args[1]
+        second_chunk = mocked_process_method.call_args_list[1].args[1]
+        assert list(first_chunk.index) == [0, 1, 2]
+        assert list(first_chunk['patron_id_plaintext']) == [
+            '123', '456', '456']
+        assert list(second_chunk.index) == [3]
+        assert list(second_chunk['patron_id_plaintext']) == ['789']
+
+    def test_unprocessed_mask_with_session_state(self, test_instance):
+        test_instance.session_state = ConcurrentSessionState()
+        test_instance.session_state.add_processed_ids(['456'])
+        test_instance.session_state.set_new_patrons_cursor(
+            '2020-12-29T00:00:00-05:00', 0)
+        sierra_df = pd.DataFrame(
+            [[row[0], row[11]] for row in _ACTIVE_SIERRA_RESULTS],
+            columns=['patron_id_plaintext', 'creation_timestamp']).astype(
+            {'patron_id_plaintext': 'string'})
+
+        # Patron 123 was created after the new patrons mode's cursor, so it's
+        # left for that mode
+        assert list(test_instance._unprocessed_mask(
+            PipelineMode.UPDATED_PATRONS, sierra_df)) == [
+            False, False, False, True]
+        assert list(test_instance._unprocessed_mask(
+            PipelineMode.NEW_PATRONS, sierra_df)) == [True, False, False, True]
+
+        test_instance._add_processed_ids(['123'])
+        assert test_instance.processed_ids == set()
+        assert '123' in test_instance.session_state.processed_ids
+
+    def test_run_active_patrons_single_iteration_two_phase(
+            self, test_instance, mocker):
+        test_instance.two_phase_sierra_fetch = True
+        test_instance.processed_ids = {'456'}
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+
+        patron_id_results = [[row[0], row[10], row[9], row[11]] for row in (
+            _ACTIVE_SIERRA_RESULTS[0], _ACTIVE_SIERRA_RESULTS[1],
+            _ACTIVE_SIERRA_RESULTS[3])]
+        test_instance.sierra_client.execute_query.side_effect = [
+            patron_id_results,
+            [_ACTIVE_SIERRA_RESULTS[0], _ACTIVE_SIERRA_RESULTS[3]]]
+        mocked_ids_query_builder = mocker.patch(
+            'lib.pipeline_controller.build_active_patron_ids_query',
+            return_value=('PATRON IDS QUERY', _QUERY_PARAMS))
+        mocked_details_query_builder = mocker.patch(
+            'lib.pipeline_controller.build_active_patron_details_query',
+            return_value=('PATRON DETAILS QUERY', _QUERY_PARAMS))
+        mocked_process_method = mocker.patch(
+            'lib.pipeline_controller.PipelineController._process_active_patrons',  # noqa: E501
+            side_effect=lambda mode, df: df.iloc[-1])
+
+        last_record, patron_count = \
+            test_instance._run_active_patrons_single_iteration(
+                PipelineMode.NEW_PATRONS)
+        assert last_record['patron_id_plaintext'] == '789'
+        assert patron_count == 3
+
+        mocked_ids_query_builder.assert_called_once_with(
+            PipelineMode.NEW_PATRONS, test_instance.poller_state,
+            '2023-01-01 12:34:56+00:00')
+        assert mocked_details_query_builder.call_args.args[0] == \
+            PipelineMode.NEW_PATRONS
+        assert list(mocked_details_query_builder.call_args.args[1]) == [
+            '123', '789']
+        test_instance.sierra_client.execute_query.assert_has_calls([
+            mocker.call('PATRON IDS QUERY', _QUERY_PARAMS, prepare=True),
+            mocker.call('PATRON DETAILS QUERY', _QUERY_PARAMS, prepare=True)])
+
+        sierra_df = mocked_process_method.call_args.args[1]
+        assert list(sierra_df.columns) == list(_LAST_NEW_SIERRA_ROW.index)
+        assert list(sierra_df.index) == [0, 1, 2]
+        assert list(sierra_df['patron_id_plaintext']) == ['123', '456', '789']
+        assert list(sierra_df['address'].fillna('')) == ['address1', '', '']
+        assert sierra_df.loc[1, 'creation_timestamp'] == \
+            _ACTIVE_SIERRA_RESULTS[1][-1]
+
+    def test_prefetch_deleted_patrons_batch(self, test_instance, mocker):
+        test_instance.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        test_instance.prefetch_sierra_connection = mocker.MagicMock()
+        test_instance.prefetch_sierra_connection.execute_query.return_value = \
+            [[444, datetime.date(2022, 4, 4)]]
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1),
+            'update_dt': _UPDATE_DT.format(1),
+            'deletion_date': _DELETION_DATE.format(1)}
+
+        test_instance.sierra_client.execute_query.return_value = \
+            _DELETED_SIERRA_RESULTS
+        mocker.patch(
+            'lib.pipeline_controller.build_deleted_patrons_query',
+            side_effect=lambda date, id, now: (
+                'QUERY {} {}'.format(date, id), _QUERY_PARAMS))
+        mocked_process_method = mocker.patch(
+            'lib.pipeline_controller.PipelineController._process_deleted_patrons',  # noqa: E501
+            side_effect=lambda df: df.iloc[-1])
+
+        # The first batch is full, so the next batch should be prefetched
+        last_record, _ = \
+            test_instance._run_deleted_patrons_single_iteration()
+        test_instance.prefetch_executor.shutdown()
+        test_instance.sierra_client.execute_query.assert_called_once_with(
+            'QUERY 2021-03-01 0', _QUERY_PARAMS, prepare=True)
+        test_instance.prefetch_sierra_connection.execute_query.\
+            assert_called_once_with('QUERY 2022-03-03 333', _QUERY_PARAMS,
+                                    prepare=True)
+
+        # Once the state is committed, the prefetched batch is used
+        test_instance._set_poller_state(
+            PipelineMode.DELETED_PATRONS, last_record)
+        last_record, patron_count = \
+            test_instance._run_deleted_patrons_single_iteration()
+        assert last_record['patron_id_plaintext'] == '444'
+        assert patron_count == 1
+        test_instance.sierra_client.execute_query.assert_called_once()
+        assert mocked_process_method.call_count == 2
+        assert test_instance.prefetched_batch is None
+
+    def test_prefetched_batch_discarded_on_state_mismatch(
+            self, test_instance, mocker):
+        mock_future = mocker.MagicMock()
+        test_instance.prefetch_executor = mocker.MagicMock()
+        test_instance.prefetched_batch = (('OTHER QUERY', _QUERY_PARAMS),
+                                          mock_future)
+        test_instance.sierra_client.execute_query.return_value = []
+
+        assert list(test_instance._query_sierra(
+            'DELETED PATRONS QUERY', _QUERY_PARAMS,
+            ['patron_id_plaintext'])) == []
+
+        mock_future.result.assert_not_called()
+        mock_future.cancel.assert_called_once()
+        test_instance.sierra_client.execute_query.assert_called_once_with(
+            'DELETED PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.prefetch_executor.submit.assert_not_called()
+
     def test_run_active_pipeline_same_timestamp_records(
             self, test_instance, mocker):
         SAME_TIME_RESULTS = copy.deepcopy(_ACTIVE_SIERRA_RESULTS)
@@ -553,6 +864,7 @@ class TestMain:
             record[-1] = datetime.datetime(
                 2021, 1, 1, 0, 0, 0, tzinfo=ZoneInfo('America/New_York'))
 
+        test_instance.processed_ids = {'123', '456', '789'}
         test_instance.poller_state = {
             'creation_dt': _CREATION_DT.format(1),
             'update_dt': _UPDATE_DT.format(1),
@@ -561,16 +873,19 @@ class TestMain:
         test_instance.sierra_client.execute_query.return_value = \
             SAME_TIME_RESULTS
         mocker.patch('lib.pipeline_controller.build_active_patrons_query',
-                     return_value='ACTIVE PATRONS QUERY')
+                     return_value=('ACTIVE PATRONS QUERY', _QUERY_PARAMS))
 
-        with pytest.raises(PipelineControllerError):
+        last_record, patron_count = \
             test_instance._run_active_patrons_single_iteration(
                 PipelineMode.NEW_PATRONS)
+        assert last_record['patron_id_plaintext'] == '789'
+        assert patron_count == 3
 
         test_instance.sierra_client.connect.assert_called_once()
         test_instance.sierra_client.execute_query.assert_called_once_with(
-            'ACTIVE PATRONS QUERY')
-        test_instance.sierra_client.close_connection.assert_called_once()
+            'ACTIVE PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.sierra_client.close_connection.assert_not_called()
+        test_instance.avro_encoder.encode_batch.assert_not_called()
 
     def test_run_deleted_pipeline_same_timestamp_records(
             self, test_instance, mocker):
@@ -578,6 +893,7 @@ class TestMain:
         for record in SAME_DATE_RESULTS:
             record[-1] = datetime.date(2021, 1, 1)
 
+        test_instance.processed_ids = {'111', '222', '333'}
         test_instance.poller_state = {
             'creation_dt': _CREATION_DT.format(1),
             'update_dt': _UPDATE_DT.format(1),
@@ -585,16 +901,22 @@ class TestMain:
 
         test_instance.sierra_client.execute_query.return_value = \
             SAME_DATE_RESULTS
-        mocker.patch('lib.pipeline_controller.build_deleted_patrons_query',
-                     return_value='DELETED PATRONS QUERY')
+        mocked_query_builder = mocker.patch(
+            'lib.pipeline_controller.build_deleted_patrons_query',
+            return_value=('DELETED PATRONS QUERY', _QUERY_PARAMS))
 
-        with pytest.raises(PipelineControllerError):
+        last_record, patron_count = \
             test_instance._run_deleted_patrons_single_iteration()
+        assert last_record['patron_id_plaintext'] == '333'
+        assert patron_count == 3
 
+        mocked_query_builder.assert_called_once_with(
+            _DELETION_DATE.format(1), 0, '2023-01-01 12:34:56+00:00')
         test_instance.sierra_client.connect.assert_called_once()
         test_instance.sierra_client.execute_query.assert_called_once_with(
-            'DELETED PATRONS QUERY')
-        test_instance.sierra_client.close_connection.assert_called_once()
+            'DELETED PATRONS QUERY', _QUERY_PARAMS, prepare=True)
+        test_instance.sierra_client.close_connection.assert_not_called()
+        test_instance.avro_encoder.encode_batch.assert_not_called()
 
     def test_process_unknown_patrons(self, test_instance, mocker):
         def mock_reformat_malformed_address(address_row):
@@ -623,8 +945,272 @@ class TestMain:
             test_instance.nyc_geocoder_client.get_geoids.call_args[0][0],
             _NYC_INPUT, check_like=True)
 
+    def test_geocode_unique_addresses(self, test_instance, mocker, caplog):
+        input_df = pd.DataFrame(
+            {'house_number': ['1', '1', '2', '1'],
+             'street_name': ['A St', 'A St', 'A St', 'A St'],
+             'postal_code': ['10451', '10451', '10451', '10452']},
+            index=[5, 2, 7, 1], dtype='string')
+        mock_client = mocker.MagicMock()
+        mock_client.get_geoids.return_value = pd.Series(
+            [None, '11111111111', '22222222222'], index=[1, 5, 7])
+
+        with caplog.at_level(logging.INFO):
+            geoids = test_instance._geocode_unique_addresses(
+                mock_client, input_df,
+                ['house_number', 'street_name', 'postal_code'],
+                executor='executor')
+
+        assert_frame_equal(mock_client.get_geoids.call_args.args[0],
+                           input_df.loc[[5, 7, 1]])
+        assert mock_client.get_geoids.call_args.kwargs == {
+            'executor': 'executor'}
+        assert list(geoids.index) == [5, 2, 7, 1]
+        assert list(geoids[:3]) == [
+            '11111111111', '11111111111', '22222222222']
+        assert pd.isnull(geoids[1])
+        assert ('Collapsed (4) addresses into (3) unique addresses (25% of '
+                'requests saved)') in caplog.text
+
+    def test_geocode_addresses_circuit_open(self, test_instance, mocker):
+        input_df = pd.DataFrame(
+            {'address': ['1 A St', 'PO Box 5'],
+             'city': ['Bronx', 'Hoboken'],
+             'region': ['NY', 'NJ'],
+             'postal_code': ['10451', '07030'],
+             'full_address': ['1 A St Bronx NY 10451',
+                              'PO Box 5 Hoboken NJ 07030']},
+            index=[3, 1], dtype='string')
+
+        def mock_reformat_malformed_address(address_row):
+            address_row['house_number'] = (
+                address_row['address'][:1] if address_row['region'] == 'NY'
+                else '')
+            address_row['street_name'] = 'A St'
+            return address_row
+
+        mocker.patch('lib.pipeline_controller.reformat_malformed_address',
+                     new=mock_reformat_malformed_address)
+        test_instance.census_geocoder_client.get_geoids.side_effect = \
+            CensusGeocoderCircuitOpenError('open')
+        test_instance.nyc_geocoder_client.get_geoids.return_value = \
+            pd.Series(['36005000100'], index=[3])
+
+        geoids, bypassed_indices = test_instance._geocode_addresses(input_df)
+        assert geoids.isnull().all()
+        assert list(bypassed_indices) == [3, 1]
+        test_instance.nyc_geocoder_client.get_geoids.assert_not_called()
+
+        test_instance.census_circuit_open_action = 'geosupport'
+        geoids, bypassed_indices = test_instance._geocode_addresses(input_df)
+
+        assert geoids[3] == '36005000100'
+        assert pd.isnull(geoids[1])
+        assert list(bypassed_indices) == [1]
+        assert list(test_instance.nyc_geocoder_client.get_geoids.call_args
+                    .args[0].index) == [3]
+
+    def test_geocode_addresses_zip_routing(self, test_instance, mocker):
+        input_df = pd.DataFrame(
+            {'address': ['1 A St', '2 B St', '3 C St'],
+             'city': ['Bronx', 'Hoboken', 'Bronx'],
+             'region': ['NY', 'NJ', 'NY'],
+             'postal_code': ['10451', '07030', '10451-1234']},
+            index=[3, 1, 2], dtype='string')
+
+        def mock_reformat_malformed_address(address_row):
+            address_row['house_number'] = address_row['address'][:1]
+            address_row['street_name'] = address_row['address'][2:]
+            return address_row
+
+        mocker.patch('lib.pipeline_controller.reformat_malformed_address',
+                     new=mock_reformat_malformed_address)
+        test_instance.zip_routing_index = mocker.MagicMock()
+        test_instance.zip_routing_index.is_nyc.return_value = pd.Series(
+            [True, False, True], index=[3, 1, 2])
+        test_instance.nyc_geocoder_client.get_geoids.return_value = \
+            pd.Series(['36005000100', None], index=[3, 2])
+        test_instance.census_geocoder_client.get_geoids.side_effect = [
+            pd.Series([None, '34017000200'], index=[2, 1]),
+            pd.Series([None], index=[2])]
+
+        geoids, bypassed_indices = test_instance._geocode_addresses(input_df)
+
+        assert list(geoids.index) == [3, 1, 2]
+        assert list(geoids[:2]) == ['36005000100', '34017000200']
+        assert pd.isnull(geoids[2])
+        assert len(bypassed_indices) == 0
+        test_instance.nyc_geocoder_client.get_geoids.assert_called_once()
+        assert list(test_instance.nyc_geocoder_client.get_geoids.call_args
+                    .args[0].index) == [3, 2]
+        assert list(test_instance.census_geocoder_client.get_geoids
+                    .call_args_list[0].args[0].index) == [1, 2]
+
+    def test_geocode_addresses_hedged(self, test_instance, mocker):
+        input_df = pd.DataFrame(
+            {'address': ['1 A St', '2 B St', '3 C St', '4 D St'],
+             'city': ['Bronx', 'Hoboken', 'Bronx', 'Bronx'],
+             'region': ['NY', 'NJ', 'NY', 'NY'],
+             'postal_code': ['10451', '07030', '10451', '10451']},
+            index=[3, 1, 2, 0], dtype='string')
+
+        def mock_reformat_malformed_address(address_row):
+            address_row['house_number'] = address_row['address'][:1]
+            address_row['street_name'] = address_row['address'][2:]
+            return address_row
+
+        mocker.patch('lib.pipeline_controller.reformat_malformed_address',
+                     new=mock_reformat_malformed_address)
+        test_instance.hedge_nyc_geocoding = True
+        test_instance.zip_routing_index = mocker.MagicMock()
+        test_instance.zip_routing_index.is_nyc.return_value = pd.Series(
+            [True, False, True, True], index=[3, 1, 2, 0])
+        nyc_futures = [Future(), Future(), Future()]
+        nyc_futures[0].set_result('36005000100')
+        nyc_futures[2].set_result('36005000400')
+        test_instance.nyc_geocoder_client.submit_geoids.return_value = \
+            nyc_futures
+        census_geoids = {3: '36005999999', 1: '34017000200',
+                         2: '36005000300', 0: None}
+        test_instance.census_geocoder_client.get_geoids.side_effect = \
+            lambda address_df, **kwargs: pd.Series(
+                [census_geoids[index] for index in address_df.index],
+                index=address_df.index, dtype=object)
+
+        geoids, bypassed_indices = test_instance._geocode_addresses(input_df)
+
+        assert list(geoids.index) == [3, 1, 2, 0]
+        assert list(geoids) == ['36005000100', '34017000200', '36005000300',
+                                '36005000400']
+        assert len(bypassed_indices) == 0
+        assert nyc_futures[1].cancelled()
+        assert list(test_instance.nyc_geocoder_client.submit_geoids
+                    .call_args.args[0].index) == [3, 2, 0]
+        test_instance.nyc_geocoder_client.get_geoids.assert_not_called()
+        # The NYC addresses are sent to the census geocoder separately from
+        # the other addresses
+        assert sorted(list(call.args[0].index) for call in (
+            test_instance.census_geocoder_client.get_geoids.call_args_list
+        )) == [[0], [1], [3, 2, 0]]
+        # The NYC addresses' census request doesn't use the blocking I/O pool,
+        # which the caller may be running on
+        pools = test_instance.executor_registry.pools
+        assert 'hedged_census_geocoder' in pools
+        assert 'blocking_io' not in pools
+        test_instance.executor_registry.shutdown()
+
+    def test_geocode_addresses_hedged_nyc_first(self, test_instance, mocker):
+        input_df = pd.DataFrame(
+            {'address': ['1 A St', '2 B St'],
+             'city': ['Bronx', 'Hoboken'],
+             'region': ['NY', 'NJ'],
+             'postal_code': ['10451', '07030']},
+            index=[3, 1], dtype='string')
+
+        def mock_reformat_malformed_address(address_row):
+            address_row['house_number'] = address_row['address'][:1]
+            address_row['street_name'] = address_row['address'][2:]
+            return address_row
+
+        def mock_census_geoids(address_df, **kwargs):
+            # The census geocoder doesn't respond for the NYC address until
+            # the test is over
+            if 3 in address_df.index:
+                census_released.wait()
+            return pd.Series(['34017000200'] * len(address_df),
+                             index=address_df.index)
+
+        mocker.patch('lib.pipeline_controller.reformat_malformed_address',
+                     new=mock_reformat_malformed_address)
+        census_released = Event()
+        test_instance.hedge_nyc_geocoding = True
+        test_instance.zip_routing_index = mocker.MagicMock()
+        test_instance.zip_routing_index.is_nyc.return_value = pd.Series(
+            [True, False], index=[3, 1])
+        nyc_future = Future()
+        nyc_future.set_result('36005000100')
+        test_instance.nyc_geocoder_client.submit_geoids.return_value = [
+            nyc_future]
+        test_instance.census_geocoder_client.get_geoids.side_effect = \
+            mock_census_geoids
+
+        geoids, bypassed_indices = test_instance._geocode_addresses(input_df)
+
+        assert list(geoids) == ['36005000100', '34017000200']
+        assert len(bypassed_indices) == 0
+        census_released.set()
+        test_instance.executor_registry.shutdown()
+
+    def test_process_unknown_patrons_with_geocode_cache(
+            self, test_instance, mocker):
+        address_df = pd.DataFrame(
+            {'address': ['1 A St', '2 B St', '3 C St', '4 D St', None],
+             'city': ['Bronx', 'Bronx', 'Bronx', 'Bronx', None],
+             'region': ['NY', 'NY', 'NY', 'NY', None],
+             'postal_code': ['10451', '10451', '10451', '10451', None],
+             'patron_id_plaintext': ['patid1', 'patid2', 'patid3', 'patid4',
+                                     'patid5']},
+            index=[3, 2, 1, 4, 0], dtype='string')
+        mocker.patch('lib.pipeline_controller.obfuscate',
+                     side_effect=lambda value: 'obfuscated_' + value)
+        test_instance.geocode_cache = mocker.MagicMock()
+        test_instance.geocode_cache.get_geoids.return_value = {
+            '1|A ST|BRONX|NY|10451': '11111111111'}
+        test_instance.geocode_cache.get_failures.return_value = {
+            '4|D ST|BRONX|NY|10451'}
+        mocked_geocode_method = mocker.patch(
+            'lib.pipeline_controller.PipelineController._geocode_addresses',
+            return_value=(pd.Series(['22222222222', None], index=[2, 1]),
+                          pd.Index([])))
+
+        geoids_df = test_instance._process_unknown_patrons(address_df)
+
+        assert list(geoids_df['geoid'][:2]) == ['11111111111', '22222222222']
+        assert geoids_df['geoid'][2:].isnull().all()
+        assert list(mocked_geocode_method.call_args.args[0].index) == [2, 1]
+        test_instance.geocode_cache.set_geoids.assert_called_once_with(
+            {'2|B ST|BRONX|NY|10451': '22222222222'})
+        test_instance.geocode_cache.set_failures.assert_called_once_with(
+            ['3|C ST|BRONX|NY|10451'])
+
+    def test_process_unknown_patrons_with_geocode_cache_circuit_open(
+            self, test_instance, mocker, tmp_path):
+        address_df = pd.DataFrame(
+            {'address': ['1 A St', '2 B St'],
+             'city': ['Bronx', 'Hoboken'],
+             'region': ['NY', 'NJ'],
+             'postal_code': ['10451', '07030'],
+             'patron_id_plaintext': ['patid1', 'patid2']},
+            index=[3, 1], dtype='string')
+        mocker.patch('lib.pipeline_controller.obfuscate',
+                     side_effect=lambda value: 'obfuscated_' + value)
+        os.environ['BCRYPT_SALT'] = 'test_salt'
+        test_instance.geocode_cache = GeocodeCache(
+            str(tmp_path / 'geocodes.db'), 3600, 100, 3600)
+        test_instance.census_circuit_open_action = 'geosupport'
+        test_instance.census_geocoder_client.get_geoids.side_effect = \
+            CensusGeocoderCircuitOpenError('open')
+        test_instance.nyc_geocoder_client.get_geoids.return_value = \
+            pd.Series(['36005000100'], index=[3])
+
+        geoids_df = test_instance._process_unknown_patrons(address_df)
+
+        assert geoids_df.loc[3, 'geoid'] == '36005000100'
+        assert pd.isnull(geoids_df.loc[1, 'geoid'])
+        assert list(geoids_df['geocoding_deferred']) == [False, True]
+        # Only the address the NYC geocoder found is cached, and the deferred
+        # address isn't cached as a failure
+        assert test_instance.geocode_cache.get_geoids(
+            ['1|A ST|BRONX|NY|10451', '2|B ST|HOBOKEN|NJ|07030']) == {
+                '1|A ST|BRONX|NY|10451': '36005000100'}
+        assert test_instance.geocode_cache.get_failures(
+            ['2|B ST|HOBOKEN|NJ|07030']) == set()
+        test_instance.geocode_cache.close()
+        del os.environ['BCRYPT_SALT']
+
     def test_find_iphlc_missing_patrons(self, test_instance, mocker, caplog):
-        test_instance.redshift_client.execute_query.return_value = \
+        test_instance.redshift_client.conn.cursor.return_value.fetchall.\
+            return_value = \
             [['123', 'aa'], ['789', 'bb']]
 
         with caplog.at_level(logging.WARNING):
@@ -634,3 +1220,103 @@ class TestMain:
 
         assert ('The following updated patrons could not be found in '
                 'Redshift: [\'012\', \'456\']') in caplog.text
+
+    def test_query_redshift_with_temp_table(self, test_instance, mocker):
+        test_instance.redshift_temp_table_threshold = 2
+        test_instance.redshift_client.execute_query.return_value = [
+            ['obfuscated_1', 'aa']]
+        mocker.patch('lib.pipeline_controller.uuid.uuid4').return_value.hex = \
+            '1'
+        mocked_query_builder = mocker.patch(
+            'lib.pipeline_controller.build_redshift_iphlc_query',
+            return_value=('REDSHIFT JOIN QUERY', None))
+
+        assert test_instance._query_redshift(
+            mocked_query_builder,
+            pd.Series(['obfuscated_1', 'obfuscated_2', 'obfuscated_3',
+                       'obfuscated_1'])) == [['obfuscated_1', 'aa']]
+
+        mocked_query_builder.assert_called_once_with(
+            ['obfuscated_1', 'obfuscated_2', 'obfuscated_3'],
+            temp_table='lookup_keys_1')
+        test_instance.redshift_client.execute_transaction.assert_has_calls([
+            mocker.call([
+                ('CREATE TEMP TABLE lookup_keys_1 (lookup_key VARCHAR(256));',
+                 None),
+                ('INSERT INTO lookup_keys_1 VALUES (%s),(%s),(%s);',
+                 ['obfuscated_1', 'obfuscated_2', 'obfuscated_3'])]),
+            mocker.call([('DROP TABLE lookup_keys_1;', None)])])
+        test_instance.redshift_client.execute_query.assert_called_once_with(
+            'REDSHIFT JOIN QUERY')
+        test_instance.redshift_client.connect.assert_called_once()
+
+    def test_query_redshift_below_temp_table_threshold(
+            self, test_instance, mocker):
+        test_instance.redshift_client.conn.cursor.return_value.fetchall.\
+            return_value = [['obfuscated_1', 'aa']]
+        mocked_query_builder = mocker.patch(
+            'lib.pipeline_controller.build_redshift_iphlc_query',
+            return_value=('REDSHIFT IPHLC QUERY', _REDSHIFT_QUERY_PARAMS))
+
+        assert test_instance._query_redshift(
+            mocked_query_builder, pd.Series(['obfuscated_1'])) == [
+            ['obfuscated_1', 'aa']]
+
+        mocked_query_builder.assert_called_once_with(['obfuscated_1'])
+        test_instance.redshift_client.execute_transaction.assert_not_called()
+
+    def test_obfuscate_with_cache(self, test_instance, mocker):
+        test_instance.obfuscation_cache = mocker.MagicMock()
+        test_instance.obfuscation_cache.obfuscate.side_effect = \
+            lambda values, obfuscate_all: obfuscate_all(values)
+        mocker.patch('lib.pipeline_controller.obfuscate',
+                     side_effect=lambda value: 'obfuscated_' + value)
+
+        assert test_instance._obfuscate(pd.Series(['1', '2'])) == [
+            'obfuscated_1', 'obfuscated_2']
+        test_instance.obfuscation_cache.obfuscate.assert_called_once()
+
+    def test_set_poller_state_with_lock(self, test_instance):
+        test_instance.poller_state_lock = Lock()
+        test_instance.poller_state = {
+            'creation_dt': _CREATION_DT.format(1), 'creation_id': 1,
+            'update_dt': _UPDATE_DT.format(1), 'update_id': 1,
+            'deletion_date': _DELETION_DATE.format(1), 'deletion_id': 1}
+        test_instance.s3_client.fetch_cache.return_value = {
+            'creation_dt': _CREATION_DT.format(5), 'creation_id': 5,
+            'update_dt': _UPDATE_DT.format(1), 'update_id': 1,
+            'deletion_date': _DELETION_DATE.format(5), 'deletion_id': 5}
+
+        test_instance._set_poller_state(
+            PipelineMode.UPDATED_PATRONS, pd.Series({
+                'patron_id_plaintext': '2',
+                'last_updated_timestamp': datetime.datetime.fromisoformat(
+                    _UPDATE_DT.format(2))}))
+
+        test_instance.s3_client.set_cache.assert_called_once_with({
+            'creation_dt': _CREATION_DT.format(5), 'creation_id': 5,
+            'update_dt': _UPDATE_DT.format(2), 'update_id': 2,
+            'deletion_date': _DELETION_DATE.format(5), 'deletion_id': 5})
+        assert test_instance.poller_state['creation_dt'] == \
+            _CREATION_DT.format(1)
+
+    def test_poller_state_checkpoint_file(self, test_instance, tmp_path):
+        checkpoint_file = str(tmp_path / 'checkpoint.json')
+        test_instance.checkpoint_file = checkpoint_file
+        test_instance.ignore_cache = True
+        with open(checkpoint_file, 'w') as checkpoint_stream:
+            checkpoint_stream.write(
+                '{{"creation_dt": "{}", "creation_id": 1}}'.format(
+                    _CREATION_DT.format(1)))
+
+        test_instance.poller_state = test_instance._get_poller_state(2)
+        test_instance._set_poller_state(
+            PipelineMode.NEW_PATRONS, pd.Series({
+                'patron_id_plaintext': '2',
+                'creation_timestamp': datetime.datetime.fromisoformat(
+                    _CREATION_DT.format(2))}))
+
+        assert test_instance._get_poller_state(3) == {
+            'creation_dt': _CREATION_DT.format(2), 'creation_id': 2}
+        assert not os.path.exists(checkpoint_file + '.tmp')
+        test_instance.s3_client.set_cache.assert_not_called()
@@ -0,0 +1,156 @@
+import os
+import pytest
+
+from helpers.pipeline_mode import PipelineMode
+from helpers.query_helper import (REDSHIFT_MAX_QUERY_PARAMS, QueryHelperError,
+                                  build_active_patron_details_query,
+                                  build_active_patron_ids_query,
+                                  build_active_patrons_query,
+                                  build_deleted_patrons_query,
+                                  build_redshift_address_query,
+                                  build_redshift_patron_query,
+                                  build_redshift_temp_table_queries)
+from tests.test_helpers import TestHelpers
+
+
+_NOW = '2023-01-01 12:34:56+00:00'
+
+
+class TestQueryHelper:
+
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+
+    def test_build_new_patrons_query(self):
+        query, query_params = build_active_patrons_query(
+            PipelineMode.NEW_PATRONS,
+            {'creation_dt': '2021-01-01T01:01:01-05:00', 'creation_id': 123,
+             'update_dt': '2021-02-01T02:02:02-05:00', 'update_id': 456},
+            _NOW)
+
+        assert ('(creation_date_gmt, id) > (%(start_dt)s, '
+                '%(start_id)s)') in query
+        assert 'ORDER BY creation_date_gmt, id' in query
+        assert 'creation_date_gmt < %(now)s' in query
+        assert 'LIMIT %(limit)s' in query
+        assert 'ORDER BY display_order, patron_record_address_type_id\n' \
+            '        LIMIT 1) first_address' in query
+        assert query_params == {
+            'start_dt': '2021-01-01T01:01:01-05:00', 'start_id': 123,
+            'now': _NOW, 'limit': 4}
+
+    def test_build_updated_patrons_query(self):
+        query, query_params = build_active_patrons_query(
+            PipelineMode.UPDATED_PATRONS,
+            {'creation_dt': '2021-01-01T01:01:01-05:00', 'creation_id': 123,
+             'update_dt': '2021-02-01T02:02:02-05:00', 'update_id': 456},
+            _NOW)
+
+        assert ('(record_last_updated_gmt, id) > (%(start_dt)s, '
+                '%(start_id)s)') in query
+        assert 'ORDER BY record_last_updated_gmt, id' in query
+        assert query_params['start_dt'] == '2021-02-01T02:02:02-05:00'
+        assert query_params['start_id'] == 456
+
+    def test_build_active_patrons_query_text_is_reused(self):
+        first_query, _ = build_active_patrons_query(
+            PipelineMode.NEW_PATRONS,
+            {'creation_dt': '2021-01-01T01:01:01-05:00', 'creation_id': 1},
+            _NOW)
+        second_query, _ = build_active_patrons_query(
+            PipelineMode.NEW_PATRONS,
+            {'creation_dt': '2022-01-01T01:01:01-05:00', 'creation_id': 2},
+            '2023-02-02 12:34:56+00:00')
+
+        assert first_query == second_query
+
+    def test_build_active_patrons_query_without_cached_id(self):
+        _, query_params = build_active_patrons_query(
+            PipelineMode.NEW_PATRONS,
+            {'creation_dt': '2021-01-01T01:01:01-05:00'}, _NOW)
+
+        assert query_params['start_id'] == 0
+
+    def test_build_active_patron_ids_query(self):
+        query, query_params = build_active_patron_ids_query(
+            PipelineMode.UPDATED_PATRONS,
+            {'update_dt': '2021-02-01T02:02:02-05:00', 'update_id': 456},
+            _NOW)
+
+        assert query.strip().startswith(
+            'SELECT\n            id, record_last_updated_gmt')
+        assert ('(record_last_updated_gmt, id) > (%(start_dt)s, '
+                '%(start_id)s)') in query
+        assert 'patron_record_address' not in query
+        assert query.endswith('LIMIT %(limit)s;')
+        assert query_params['start_id'] == 456
+
+    def test_build_active_patron_details_query(self):
+        query, query_params = build_active_patron_details_query(
+            PipelineMode.UPDATED_PATRONS, ['123', '789'])
+
+        assert 'WHERE id = ANY(%(patron_ids)s)) x' in query
+        assert 'LIMIT 1) first_address' in query
+        assert query.endswith('ORDER BY record_last_updated_gmt, x.id;')
+        assert query_params == {'patron_ids': [123, 789]}
+
+    def test_build_deleted_patrons_query(self):
+        query, query_params = build_deleted_patrons_query(
+            '2021-03-01', 789, _NOW)
+
+        assert ('(deletion_date_gmt, id) > (%(cached_deletion_date)s,\n'
+                '            %(cached_deletion_id)s)') in query
+        assert 'ORDER BY deletion_date_gmt, id' in query
+        assert query_params == {
+            'cached_deletion_date': '2021-03-01', 'cached_deletion_id': 789,
+            'limit': 3, 'now': _NOW}
+
+    def test_build_redshift_address_query(self):
+        query, query_params = build_redshift_address_query(
+            ['hash1', 'hash2', 'hash3'])
+
+        assert 'FROM {}'.format(os.environ['REDSHIFT_TABLE']) in query
+        assert 'WHERE address_hash IN (%s,%s,%s,%s)' in query
+        assert query_params == ['hash1', 'hash2', 'hash3', 'hash3']
+
+    def test_build_redshift_patron_query(self):
+        query, query_params = build_redshift_patron_query(['id1', 'id2'])
+
+        assert 'WHERE patron_id IN (%s,%s)' in query
+        assert query_params == ['id1', 'id2']
+
+    def test_build_redshift_query_param_limit(self):
+        patron_ids = [str(i) for i in range(20000)]
+        query, query_params = build_redshift_patron_query(patron_ids)
+
+        assert len(query_params) == REDSHIFT_MAX_QUERY_PARAMS
+        assert query.count('%s') == REDSHIFT_MAX_QUERY_PARAMS
+        assert query_params[-1] == '19999'
+
+        with pytest.raises(QueryHelperError):
+            build_redshift_patron_query(
+                patron_ids + [str(i) for i in range(20000, 40000)])
+
+    def test_build_redshift_patron_query_with_temp_table(self):
+        query, query_params = build_redshift_patron_query(
+            ['id1', 'id2'], temp_table='lookup_keys_1')
+
+        assert ('JOIN lookup_keys_1\n        ON test_redshift_table.patron_id '
+                '= lookup_keys_1.lookup_key') in query
+        assert 'WHERE' not in query
+        assert query_params is None
+
+    def test_build_redshift_temp_table_queries(self):
+        os.environ['REDSHIFT_INSERT_CHUNK_SIZE'] = '2'
+        assert build_redshift_temp_table_queries(
+            'lookup_keys_1', ['id1', 'id2', 'id3']) == [
+            ('CREATE TEMP TABLE lookup_keys_1 (lookup_key VARCHAR(256));',
+             None),
+            ('INSERT INTO lookup_keys_1 VALUES (%s),(%s);', ['id1', 'id2']),
+            ('INSERT INTO lookup_keys_1 VALUES (%s);', ['id3'])]
+        del os.environ['REDSHIFT_INSERT_CHUNK_SIZE']
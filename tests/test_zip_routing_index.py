@@ -0,0 +1,25 @@
+import pandas as pd
+
+from lib.zip_routing_index import ZipRoutingIndex
+
+
+class TestZipRoutingIndex:
+
+    def test_default_zip_file(self):
+        test_instance = ZipRoutingIndex()
+
+        assert test_instance.boroughs_by_zip['10001'] == 'MANHATTAN'
+        assert test_instance.boroughs_by_zip['10451'] == 'BRONX'
+        assert test_instance.boroughs_by_zip['11201'] == 'BROOKLYN'
+        assert test_instance.boroughs_by_zip['11375'] == 'QUEENS'
+        assert test_instance.boroughs_by_zip['10314'] == 'STATEN IS'
+        assert '07030' not in test_instance.boroughs_by_zip
+
+    def test_is_nyc(self, tmp_path):
+        zip_file = tmp_path / 'zips.csv'
+        zip_file.write_text('zip_code,borough\n10001,MANHATTAN\n')
+        test_instance = ZipRoutingIndex(str(zip_file))
+
+        assert list(test_instance.is_nyc(pd.Series(
+            ['10001', '10001-1234', '07030', '', None], dtype='string'))) == [
+            True, True, False, False, False]